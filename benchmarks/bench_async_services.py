@@ -0,0 +1,64 @@
+"""
+Benchmark for resolving a batch of links with one worker
+
+before: one blocking call at a time, as YoutubeService does on a celery worker
+after:  AsyncYoutubeService with gather_limited, every call in flight on one event loop
+
+Runs against a local fake server that waits LATENCY seconds before answering,
+so the numbers are about waiting on the platform, not parsing.
+
+Usage: PYTHONPATH=. python benchmarks/bench_async_services.py
+"""
+import asyncio
+import time
+from unittest.mock import patch
+
+from aiohttp.test_utils import TestServer
+from oauth2client.client import AccessTokenCredentials
+
+from src.async_music_services import AsyncYoutubeService, client_session, gather_limited
+from src.quota import QuotaAccountant
+from tests.fakes import fake_youtube_server
+
+LINKS = 40
+LATENCY = 0.05
+CONCURRENCY = 20
+LINK = "https://youtu.be/XPpTgCho5ZA"
+
+
+async def resolve(concurrent):
+    server = TestServer(fake_youtube_server(delay=LATENCY).app)
+    await server.start_server()
+    try:
+        async with client_session() as session:
+            service = AsyncYoutubeService(
+                credentials=AccessTokenCredentials('token', 'slacktunes-bench'),
+                session=session,
+                base_url=str(server.make_url('/youtube/v3'))
+            )
+
+            start = time.perf_counter()
+            if concurrent:
+                await gather_limited([service.get_track_info_from_link(LINK) for _ in range(LINKS)], CONCURRENCY)
+            else:
+                for _ in range(LINKS):
+                    await service.get_track_info_from_link(LINK)
+
+            return time.perf_counter() - start
+    finally:
+        await server.close()
+
+
+def main():
+    with patch('src.async_music_services.youtube_quota', QuotaAccountant('bench', 10 ** 9, use_redis=False)):
+        before = asyncio.run(resolve(concurrent=False))
+        after = asyncio.run(resolve(concurrent=True))
+
+    print("%s links, %.0fms per call" % (LINKS, LATENCY * 1000))
+    print("one at a time:   %.2fs" % before)
+    print("%2s in flight:    %.2fs" % (CONCURRENCY, after))
+    print("speedup:         %.1fx" % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Throughput benchmark for resolving shared links to (platform, track id)
+
+before: Platform.from_link, then the service's substring/split track_id_from_link,
+        as get_track_info_from_link did it
+after:  src.links.parse_link, one precompiled pattern
+
+"per shared link" is everything done with a link on the way through get_track_info_from_link:
+its platform, its track id (twice, by utils and the service) and its dedupe key.
+parse_link's cache makes everything after the first parse a lookup.
+
+The corpus is generated from the link shapes slack sees: watch, youtu.be, shorts,
+music.youtube, spotify web/intl/uri and album/playlist links, plus non-music links.
+"before" gets some of these wrong (or raises); the count of links it resolves differently
+is printed.
+
+Usage: PYTHONPATH=. python benchmarks/bench_links.py
+"""
+import random
+import string
+import timeit
+
+from src.constants import LinkKind, Platform
+from src.links import link_key, link_platform, parse_link, track_id_from_link
+
+CORPUS_SIZE = 100000
+PASSES = 3
+
+TEMPLATES = [
+    'https://www.youtube.com/watch?v={yt}',
+    'https://www.youtube.com/watch?v={yt}&list=PL{sp}&index=3',
+    'https://youtube.com/watch?feature=share&v={yt}',
+    'https://youtu.be/{yt}',
+    'https://youtu.be/{yt}?si={sp}',
+    'https://www.youtube.com/shorts/{yt}',
+    'https://music.youtube.com/watch?v={yt}&feature=share',
+    'https://open.spotify.com/track/{sp}',
+    'https://open.spotify.com/track/{sp}?si={yt}',
+    'https://open.spotify.com/intl-de/track/{sp}',
+    'spotify:track:{sp}',
+    'https://open.spotify.com/album/{sp}',
+    'https://open.spotify.com/playlist/{sp}',
+    'https://example.com/some/article?id={yt}',
+]
+
+
+def random_id(length, alphabet):
+    return ''.join(random.choice(alphabet) for _ in range(length))
+
+
+def legacy_youtube_track_id(link):
+    if 'yout' not in link:
+        return None
+
+    video_id = None
+    if "v=" in link:
+        for param in link.split('&'):
+            if 'v=' in param:
+                video_id = param.split('=')[1]
+    else:
+        link_parts = link.split()
+        link = [p for p in link_parts if 'yout' in p]
+        if not link:
+            return None
+        video_id = link[0].split('be/')[1]
+
+    return video_id
+
+
+def legacy_spotify_track_id(link):
+    if link.find('spotify:track') != -1:
+        return link.split(':')[-1]
+
+    return link.split('/')[-1].split('?')[0]
+
+
+def legacy_resolve(link):
+    platform = Platform.from_link(link)
+    try:
+        if platform is Platform.YOUTUBE:
+            return platform, legacy_youtube_track_id(link)
+        elif platform is Platform.SPOTIFY:
+            return platform, legacy_spotify_track_id(link)
+    except IndexError:
+        # e.g. shorts links
+        return 'error'
+
+    return None
+
+
+def resolve(link):
+    parsed = parse_link(link)
+    if not parsed or parsed.kind is not LinkKind.TRACK:
+        return None
+
+    return parsed.platform, parsed.id
+
+
+def legacy_pipeline(link):
+    # get_track_info_from_link and the service both parsed the link, then it was keyed
+    platform = Platform.from_link(link)
+    legacy_resolve(link)
+    legacy_resolve(link)
+    return platform, legacy_resolve(link)
+
+
+def pipeline(link):
+    platform = link_platform(link)
+    track_id_from_link(link, platform=platform)
+    track_id_from_link(link, platform=platform)
+    return platform, link_key(link)
+
+
+def main():
+    random.seed(12)
+    yt_alphabet = string.ascii_letters + string.digits + '_-'
+    sp_alphabet = string.ascii_letters + string.digits
+    corpus = [
+        random.choice(TEMPLATES).format(yt=random_id(11, yt_alphabet), sp=random_id(22, sp_alphabet))
+        for _ in range(CORPUS_SIZE)
+    ]
+
+    differences = sum(1 for link in corpus if legacy_resolve(link) != resolve(link))
+    print("%s links, %s resolved differently than before" % (len(corpus), differences))
+
+    for name, func in (
+            ('before', legacy_resolve),
+            ('after', resolve),
+            ('before, per shared link', legacy_pipeline),
+            ('after, per shared link', pipeline)):
+        def run():
+            parse_link.cache_clear()
+            return [func(link) for link in corpus]
+
+        seconds = min(timeit.repeat(run, number=1, repeat=PASSES))
+        print("%-24s %10.0f links/sec" % (name, len(corpus) / seconds))
+
+
+if __name__ == '__main__':
+    main()
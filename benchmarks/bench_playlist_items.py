@@ -0,0 +1,124 @@
+"""
+Micro-benchmark for collecting the video ids in a youtube playlist
+
+before: part='snippet' pages, and a new set from track_ids.union(...) for every page
+after:  part='contentDetails' with fields='nextPageToken,items/contentDetails/videoId',
+        ids streamed from a generator into one set
+
+Responses are generated from the playlistItems json fake, so bytes are what
+each page would carry over the wire (uncompressed), not a measurement of the api.
+
+Usage: PYTHONPATH=. python benchmarks/bench_playlist_items.py
+"""
+import copy
+import json
+import timeit
+
+from src.constants import Platform
+from src.models import Playlist
+from src.music_services import YoutubeService
+from tests.json_fakes import YOUTUBE_PLAYLIST_ITEMS_LIST_RESPONSE
+
+PLAYLIST_SIZE = 5000
+PAGE_SIZE = 50
+RUNS = 20
+
+
+def snippet_pages():
+    item = YOUTUBE_PLAYLIST_ITEMS_LIST_RESPONSE['items'][0]
+    pages = []
+    for start in range(0, PLAYLIST_SIZE, PAGE_SIZE):
+        items = []
+        for i in range(start, min(start + PAGE_SIZE, PLAYLIST_SIZE)):
+            page_item = copy.deepcopy(item)
+            page_item['snippet']['resourceId']['videoId'] = '%011d' % i
+            # a part='snippet' response has no contentDetails
+            page_item.pop('contentDetails', None)
+            items.append(page_item)
+        pages.append({'nextPageToken': 'page%s' % start, 'items': items})
+
+    return pages
+
+
+def projected_pages():
+    return [
+        {
+            'nextPageToken': 'page%s' % start,
+            'items': [
+                {'contentDetails': {'videoId': '%011d' % i}}
+                for i in range(start, min(start + PAGE_SIZE, PLAYLIST_SIZE))
+            ]
+        }
+        for start in range(0, PLAYLIST_SIZE, PAGE_SIZE)
+    ]
+
+
+class PagedClient(object):
+    """
+    Just enough of the youtube client to page through canned responses
+    """
+    def __init__(self, pages):
+        self.pages = pages
+
+    def playlistItems(self):
+        return self
+
+    def list(self, **kwargs):
+        return PagedRequest(self.pages, 0)
+
+    def list_next(self, request, response):
+        if request.index + 1 >= len(self.pages):
+            return None
+        return PagedRequest(self.pages, request.index + 1)
+
+
+class PagedRequest(object):
+    def __init__(self, pages, index):
+        self.pages = pages
+        self.index = index
+
+    def execute(self):
+        return self.pages[self.index]
+
+
+def legacy_track_ids(client):
+    track_ids = set()
+    playlist_items_list_request = client.playlistItems().list()
+    while playlist_items_list_request:
+        playlist_items_list_response = playlist_items_list_request.execute()
+        track_ids = track_ids.union({
+            item['snippet']['resourceId']['videoId']
+            for item in playlist_items_list_response['items']
+        })
+
+        playlist_items_list_request = client.playlistItems().list_next(
+            playlist_items_list_request,
+            playlist_items_list_response
+        )
+
+    return track_ids
+
+
+def main():
+    playlist = Playlist(name='yt', channel_id='123', platform=Platform.YOUTUBE, platform_id='abc', user_id=1)
+    before_pages = snippet_pages()
+    after_pages = projected_pages()
+    before_client = PagedClient(before_pages)
+    service = YoutubeService(credentials={'ok': True}, client=PagedClient(after_pages))
+
+    assert legacy_track_ids(before_client) == service.get_track_ids_in_playlist(playlist=playlist)
+
+    print("%s videos, %s pages" % (PLAYLIST_SIZE, len(after_pages)))
+    for label, pages, func in (
+            ('before', before_pages, lambda: legacy_track_ids(before_client)),
+            ('after', after_pages, lambda: service.get_track_ids_in_playlist(playlist=playlist))):
+        seconds = timeit.timeit(func, number=RUNS)
+        print("%-7s %9d bytes/page %7.2f ms to collect ids" % (
+            label,
+            sum(len(json.dumps(p)) for p in pages) / len(pages),
+            seconds / RUNS * 1e3
+        ))
+
+
+if __name__ == '__main__':
+    main()
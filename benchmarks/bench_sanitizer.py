@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for TrackInfo.sanitized_track_name over a corpus of YouTube titles
+
+before: three re.sub calls, then a re.compile and sub for each of BAD_WORDS, on every call
+after:  src.sanitizer, with patterns compiled at import and BAD_WORDS as one alternation.
+        "cold" clears the memo before every pass, "warm" doesn't, and "batch" runs
+        the whole corpus through sanitize_titles from a cold cache.
+
+Usage: PYTHONPATH=. python benchmarks/bench_sanitizer.py
+"""
+import os
+import re
+import timeit
+
+from src.constants import BAD_WORDS
+from src.sanitizer import clear_cache, sanitize_title, sanitize_titles
+
+PASSES = 200
+TITLES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'youtube_titles.txt')
+
+
+def legacy_sanitized_track_name(name):
+    new_title = re.sub(r"[|&'_-]", "", name)
+    new_title = re.sub(r'\([^)]*\)', '', new_title)
+    new_title = re.sub(r'\[[^]]*\]', '', new_title)
+    new_title = ' '.join(new_title.split())
+
+    for word in BAD_WORDS:
+        replacer = re.compile("\\b%s\\b" % word, re.IGNORECASE)
+        new_title = replacer.sub('', new_title)
+    return new_title
+
+
+def main():
+    with open(TITLES_PATH) as f:
+        titles = [line.strip() for line in f if line.strip()]
+
+    expected = [legacy_sanitized_track_name(t) for t in titles]
+    clear_cache()
+    assert [sanitize_title(t) for t in titles] == expected
+    clear_cache()
+    assert sanitize_titles(titles) == expected
+
+    def before():
+        return [legacy_sanitized_track_name(t) for t in titles]
+
+    def cold():
+        clear_cache()
+        return [sanitize_title(t) for t in titles]
+
+    def warm():
+        return [sanitize_title(t) for t in titles]
+
+    def batch():
+        clear_cache()
+        return sanitize_titles(titles)
+
+    print("%s titles" % len(titles))
+    for name, func in (('before', before), ('cold', cold), ('warm', warm), ('batch', batch)):
+        seconds = timeit.timeit(func, number=PASSES)
+        print("%-8s %8.2f us/title" % (name, seconds / PASSES / len(titles) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for the scoring in SpotifyService.best_match
+
+before: fuzz.token_set_ratio for every result, then the contender strings rebuilt
+        and fuzz.token_sort_ratio for the stage 1 contenders (approximated here as
+        everything over the threshold)
+after:  batch_scorer.score for token_set over every result, then token_sort for the
+        stage 1 contenders only, each string processed once.
+        The target is processed once per process (it's cached), like a repeated search.
+
+fuzz.ratio falls back to difflib without python-Levenshtein, which makes every ratio
+several times slower on both sides; numbers are only comparable with the same install.
+
+Usage: PYTHONPATH=. python benchmarks/bench_scoring.py
+"""
+import timeit
+
+from fuzzywuzzy import fuzz
+
+from src.music_services import SPOTIFY_TOKEN_SET_THRESHHOLD
+from src.scoring import TOKEN_SET, TOKEN_SORT, BatchScorer
+from tests.json_fakes import SPOTIFY_SEARCH_REGRESSION_CORPUS
+
+PASSES = 500
+
+
+def contender_string(item):
+    return ("%s %s" % (item['name'], " ".join(a['name'] for a in item['artists']))).lower()
+
+
+def main():
+    # about what a 50 result search looks like
+    items = [item for case in SPOTIFY_SEARCH_REGRESSION_CORPUS for item in case['items']]
+    items = (items * 2)[:50]
+    targets = [case['target'].lower() for case in SPOTIFY_SEARCH_REGRESSION_CORPUS]
+
+    def before():
+        for target in targets:
+            contenders = [
+                i for i in items
+                if fuzz.token_set_ratio(target, contender_string(i)) > SPOTIFY_TOKEN_SET_THRESHHOLD
+            ]
+            [fuzz.token_sort_ratio(target, contender_string(i)) for i in contenders]
+
+    scorer = BatchScorer()
+
+    def after():
+        for target in targets:
+            strings = [contender_string(i) for i in items]
+            set_scores = scorer.score(target, strings, scorers=(TOKEN_SET, ))[TOKEN_SET]
+            contenders = [s for s, score in zip(strings, set_scores) if score > SPOTIFY_TOKEN_SET_THRESHHOLD]
+            scorer.score(target, contenders, scorers=(TOKEN_SORT, ))
+
+    for name, func in (('before', before), ('after', after)):
+        seconds = timeit.timeit(func, number=PASSES)
+        print("%-8s %8.1f us/search" % (name, seconds / PASSES / len(targets) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark for the search_and_add_to_playlists task body on the broker
+
+json + __dict__:  the TrackInfo.__dict__ (with the full raw_json) as json, as before TrackInfo.to_wire
+json + to_wire:   TrackInfo.to_wire() as json
+msgpack:          the TrackInfo itself, with the slacktunes msgpack serializer
+msgpack + ref:    a TrackInfoRef, with TASK_TRACK_INFO_REFERENCES set
+
+Times are a kombu dumps + loads of the (args, kwargs, embed) body celery sends.
+The msgpack rows depend on msgpack's C extension: with it they're within ~1.5x of
+json + to_wire and smaller, with the pure python fallback about 3x slower, so the
+benchmark says which one it ran.
+
+Usage: PYTHONPATH=. python benchmarks/bench_task_payload.py
+"""
+import timeit
+
+from kombu.serialization import dumps, loads
+
+from src.constants import Platform
+from src.music_services import TrackInfo
+from src.serialization import SERIALIZER, TrackInfoRef, msgpack_is_compiled, register_serializer
+from tests.json_fakes import YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE
+
+CALLS = 20000
+
+
+def body(origin):
+    return ((), {'origin': origin, 'platform': Platform.SPOTIFY.name, 'channel': 'C0123456789'}, {})
+
+
+def main():
+    register_serializer()
+    print("msgpack: %s" % ('compiled' if msgpack_is_compiled() else 'pure python fallback'))
+
+    snippet = YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE['items'][0]['snippet']
+    track_info = TrackInfo(
+        name=snippet['title'],
+        platform=Platform.YOUTUBE,
+        track_id='XPpTgCho5ZA',
+        link='https://youtu.be/XPpTgCho5ZA',
+        raw_json=snippet
+    )
+    legacy_dict = {
+        'name': track_info.name,
+        'platform': track_info.platform.name,
+        'raw_json': snippet,
+        'artists': None,
+        'track_id': track_info.track_id,
+        'link': track_info.link,
+        'match_score': None,
+    }
+
+    cases = (
+        ('json + __dict__', 'json', body(legacy_dict)),
+        ('json + to_wire', 'json', body(track_info.to_wire())),
+        ('msgpack', SERIALIZER, body(track_info)),
+        ('msgpack + ref', SERIALIZER, body(TrackInfoRef.from_track_info(track_info))),
+    )
+    for name, serializer, task_body in cases:
+        def round_trip():
+            content_type, content_encoding, data = dumps(task_body, serializer=serializer)
+            return loads(data, content_type, content_encoding)
+
+        size = len(dumps(task_body, serializer=serializer)[2])
+        seconds = timeit.timeit(round_trip, number=CALLS)
+        print("%-16s %5d bytes %7.2f us/round trip" % (name, size, seconds / CALLS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark for passing a TrackInfo to a celery task, and for holding TrackInfos
+
+before: TrackInfo kept the whole raw_json and add_link_to_playlists sent
+        copy.deepcopy(track_info.__dict__) as the task argument
+after:  slotted TrackInfo holding only the extracted fields, sent as track_info.to_wire()
+
+Usage: PYTHONPATH=. python benchmarks/bench_track_info.py
+"""
+import copy
+import json
+import timeit
+import tracemalloc
+
+from src.constants import Platform
+from src.music_services import TrackInfo
+from tests.json_fakes import SPOTIFY_TRACK_RESP, YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE
+
+CALLS = 20000
+INSTANCES = 1000
+
+
+class LegacyTrackInfo():
+    def __init__(self, name, platform, raw_json=None, artists=None, track_id=None, link=None):
+        self.name = name
+        self.platform = platform
+        self.raw_json = raw_json
+        self.artists = artists
+        self.track_id = track_id
+        self.link = link
+
+
+def legacy_payload(track_info):
+    track_info_json = copy.deepcopy(track_info.__dict__)
+    track_info_json['platform'] = track_info.platform.name
+    return track_info_json
+
+
+def allocated(make):
+    tracemalloc.start()
+    instances = [make() for _ in range(INSTANCES)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return size / INSTANCES
+
+
+def main():
+    cases = {
+        'youtube': dict(
+            name='Maroon 5 - This Love',
+            platform=Platform.YOUTUBE,
+            track_id='XPpTgCho5ZA',
+            raw_json=YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE['items'][0]['snippet']
+        ),
+        'spotify': dict(
+            name='This Love',
+            platform=Platform.SPOTIFY,
+            track_id='6ECp64rv50XVz93WvxXMGF',
+            artists=['Maroon 5'],
+            raw_json=SPOTIFY_TRACK_RESP
+        ),
+    }
+
+    for name, kwargs in cases.items():
+        # deepcopy so every instance owns its raw_json, like a fresh api response
+        legacy = LegacyTrackInfo(**copy.deepcopy(kwargs))
+        slotted = TrackInfo(**copy.deepcopy(kwargs))
+
+        print(name)
+        for label, func, make in (
+                ('before', lambda: legacy_payload(legacy), lambda: LegacyTrackInfo(**copy.deepcopy(kwargs))),
+                ('after', slotted.to_wire, lambda: TrackInfo(**copy.deepcopy(kwargs)))):
+            seconds = timeit.timeit(func, number=CALLS)
+            print("  %-7s %7.2f us/payload %6d payload bytes %7d bytes/instance" % (
+                label,
+                seconds / CALLS * 1e6,
+                len(json.dumps(func())),
+                allocated(make)
+            ))
+
+
+if __name__ == '__main__':
+    main()
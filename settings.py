@@ -13,11 +13,18 @@ SLACK_VERIFICATION_TOKEN = os.environ.get('SLACK_VERIFICATION_TOKEN', None)
 YOUTUBE_CLIENT_ID = os.environ.get('YOUTUBE_CLIENT_ID', None)
 YOUTUBE_CLIENT_SECRET = os.environ.get('YOUTUBE_CLIENT_SECRET', None)
 YOUTUBE_REDIRECT_URI = '%s/youtubeoauth2callback' % BASE_URI
+# data api units the project gets per day
+YOUTUBE_DAILY_QUOTA = int(os.environ.get('YOUTUBE_DAILY_QUOTA', 10000))
 
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', None)
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', None)
 SPOTIFY_REDIRECT_URI = "%s/spotifyoauth2callback" % BASE_URI
 
+# celery's broker; also used for caches shared between workers
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redisbroker:6379/0')
+# send TrackInfos to tasks as (platform, track_id) references to the shared track info cache
+TASK_TRACK_INFO_REFERENCES = os.environ.get('TASK_TRACK_INFO_REFERENCES', '').lower() == 'true'
+
 PSQL_DB_FORMAT = 'postgresql+psycopg2://{username}:{password}@{server}:{port}/{db}'
 PSQL_USERNAME = os.environ.get('PG_SLACKTTUNES_USER', 'slacktuner')
 PSQL_PASSWORD = os.environ.get('PG_SLACKTUNES_PASSWORD', 'slacktuner')
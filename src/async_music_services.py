@@ -0,0 +1,724 @@
+import abc
+import asyncio
+import json
+import time
+
+import aiohttp
+import httplib2
+
+from app import logger
+from .constants import DUPLICATE_TRACK, InvalidEnumException, Platform
+from .links import link_platform
+from .music_services import (
+    HTTP_NOT_MODIFIED,
+    SPOTIFY_MAX_TRACKS_PER_INSERT,
+    YOUTUBE_PLAYLIST_INDEX_FIELDS,
+    YOUTUBE_PLAYLIST_ITEM_FIELDS,
+    YOUTUBE_PLAYLIST_ITEM_PART,
+    YOUTUBE_PLAYLIST_ITEMS_PER_PAGE,
+    YOUTUBE_PLAYLIST_TITLE_FIELDS,
+    YOUTUBE_PLAYLISTS_PER_PAGE,
+    SpotifyService,
+    TrackInfo,
+    YoutubeService,
+    chunks,
+    forget_playlist_index,
+)
+from .oauth_wrappers import SPOTIFY_TOKEN_EXPIRY_MARGIN, SpotipyClientCredentialsManager
+from .quota import DEFAULT_QUOTA_COST, YOUTUBE_QUOTA_COSTS, QuotaExhaustedError, youtube_quota
+
+YOUTUBE_API_URL = 'https://www.googleapis.com/youtube/v3'
+SPOTIFY_API_URL = 'https://api.spotify.com/v1'
+
+# whole-request timeout for a single platform call, in seconds
+REQUEST_TIMEOUT = 30
+# requests in flight per event loop; aiohttp's own default is 100
+MAX_CONNECTIONS = 20
+
+
+class ServiceHTTPError(Exception):
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        super(ServiceHTTPError, self).__init__("HTTP %s: %s" % (status, body))
+
+    def reasons(self):
+        error = self.body.get('error') if isinstance(self.body, dict) else None
+        if not isinstance(error, dict):
+            return []
+
+        return [e.get('reason') for e in error.get('errors', [])]
+
+    def message(self):
+        error = self.body.get('error') if isinstance(self.body, dict) else None
+        if isinstance(error, dict):
+            return error.get('message', str(self))
+
+        return str(self)
+
+
+def client_session(**kwargs):
+    """
+    One session per event loop; every service on the loop shares its connection pool
+    """
+    return aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS),
+        **kwargs
+    )
+
+
+async def gather_limited(coros, limit):
+    """
+    asyncio.gather, with at most limit of the coroutines running at once. Exceptions are returned, not raised.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[limited(coro) for coro in coros], return_exceptions=True)
+
+
+class AsyncServiceFactory():
+    @classmethod
+    def from_enum(cls, enum):
+        if enum is Platform.YOUTUBE:
+            return AsyncYoutubeService
+        elif enum is Platform.SPOTIFY:
+            return AsyncSpotifyService
+        else:
+            raise InvalidEnumException
+
+
+class AsyncServiceBase(metaclass=abc.ABCMeta):
+    """
+    The ServiceBase method set as coroutines over a shared aiohttp session, so one event loop
+    can have many platform calls in flight. Auth flows and scoring don't touch the network
+    and are left to the synchronous service (sync_service).
+    """
+    SYNC_SERVICE = None
+    API_URL = None
+    PLATFORM = None
+
+    def __init__(self, credentials, session, base_url=None, owner_id=None):
+        self.credentials = credentials
+        self.session = session
+        self.base_url = base_url or self.API_URL
+        self.owner_id = owner_id
+        self.sync_service = self.SYNC_SERVICE(credentials=credentials, owner_id=owner_id)
+        # playlist platform_id -> the last snapshot id this service saw for it
+        self.snapshot_ids = {}
+
+    @abc.abstractmethod
+    async def get_access_token(self):
+        raise NotImplementedError()
+
+    async def request(self, method, path, params=None, json_body=None, headers=None, url=None):
+        """
+        Returns (status, parsed body). path is relative to base_url unless a full url is given.
+        Raises ServiceHTTPError for 4xx/5xx responses.
+        """
+        request_headers = {'Authorization': 'Bearer %s' % await self.get_access_token()}
+        request_headers.update(headers or {})
+
+        async with self.session.request(
+            method,
+            url or self.base_url + path,
+            params=params,
+            json=json_body,
+            headers=request_headers
+        ) as resp:
+            text = await resp.text()
+            try:
+                body = json.loads(text) if text else {}
+            except ValueError:
+                body = text
+
+            if resp.status >= 400:
+                raise ServiceHTTPError(resp.status, body)
+
+            return resp.status, body
+
+    @classmethod
+    def track_id_from_link(cls, link):
+        return cls.SYNC_SERVICE.track_id_from_link(link)
+
+    def best_match(self, target_string, search_results, track_info=None):
+        return self.sync_service.best_match(
+            target_string=target_string,
+            search_results=search_results,
+            track_info=track_info
+        )
+
+    async def get_playlist_snapshot_id(self, playlist):
+        return None
+
+    def known_snapshot_id(self, playlist):
+        return self.snapshot_ids.get(playlist.platform_id)
+
+    @abc.abstractmethod
+    async def get_track_info_from_link(self, link):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def get_track_ids_in_playlist(self, playlist, track_id=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def is_track_in_playlist(self, track_info, playlist):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def fuzzy_search(self, track_name, artist=None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def fuzzy_search_from_track_info(self, track_info):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def list_playlists(self):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def get_playlist_index(self):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    async def create_playlist(self, playlist_name):
+        raise NotImplementedError()
+
+    async def _partition_new_tracks(self, track_infos, playlist, check_duplicates):
+        existing_ids = set()
+        if check_duplicates:
+            existing_ids = await self.get_track_ids_in_playlist(playlist=playlist)
+
+        new_tracks = []
+        duplicates = []
+        for track_info in track_infos:
+            if track_info.track_id in existing_ids:
+                duplicates.append((track_info, DUPLICATE_TRACK))
+            else:
+                existing_ids.add(track_info.track_id)
+                new_tracks.append(track_info)
+
+        return new_tracks, duplicates
+
+
+class AsyncYoutubeService(AsyncServiceBase):
+    SYNC_SERVICE = YoutubeService
+    API_URL = YOUTUBE_API_URL
+    PLATFORM = Platform.YOUTUBE
+
+    async def get_access_token(self):
+        if self.credentials.access_token_expired:
+            # oauth2client refreshes over httplib2, which blocks
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.credentials.refresh, httplib2.Http())
+
+        return self.credentials.access_token
+
+    async def call(self, resource, method, http_method='GET', params=None, json_body=None, headers=None):
+        """
+        A data api call, charged to the quota accountant like the synchronous client's are.
+        Returns (status, parsed body).
+        """
+        # the accountant keeps its count in redis, which blocks
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(
+            None, youtube_quota.charge, YOUTUBE_QUOTA_COSTS.get((resource, method), DEFAULT_QUOTA_COST))
+        try:
+            return await self.request(
+                http_method,
+                '/%s' % resource,
+                params=params,
+                json_body=json_body,
+                headers=headers
+            )
+        except ServiceHTTPError as e:
+            if e.status == 403 and set(e.reasons()) & {'quotaExceeded', 'dailyLimitExceeded'}:
+                await loop.run_in_executor(None, youtube_quota.exhaust)
+                raise QuotaExhaustedError(str(e))
+            raise
+
+    async def get_track_info_from_link(self, link):
+        if link_platform(link) is not Platform.YOUTUBE:
+            return False
+
+        video_id = self.track_id_from_link(link)
+        if not video_id:
+            return None
+
+        _, resp = await self.call('videos', 'list', params={'part': 'snippet', 'id': video_id})
+        items = resp.get('items', {})
+        if not items or len(items) > 1:
+            return False
+
+        track = items[0]
+
+        return TrackInfo(
+            track_id=video_id,
+            platform=Platform.YOUTUBE,
+            name=track['snippet']['title'],
+            raw_json=track['snippet']
+        )
+
+    async def iter_video_ids_in_playlist(self, playlist, track_id=None):
+        params = {
+            'part': YOUTUBE_PLAYLIST_ITEM_PART,
+            'fields': YOUTUBE_PLAYLIST_ITEM_FIELDS,
+            'playlistId': playlist.platform_id,
+            'maxResults': YOUTUBE_PLAYLIST_ITEMS_PER_PAGE
+        }
+        if track_id:
+            params['videoId'] = track_id
+
+        while True:
+            _, resp = await self.call('playlistItems', 'list', params=params)
+            for item in resp.get('items', []):
+                yield item['contentDetails']['videoId']
+
+            if not resp.get('nextPageToken'):
+                break
+            params = dict(params, pageToken=resp['nextPageToken'])
+
+    async def get_track_ids_in_playlist(self, playlist, track_id=None):
+        return {video_id async for video_id in self.iter_video_ids_in_playlist(playlist, track_id=track_id)}
+
+    async def is_track_in_playlist(self, track_info, playlist):
+        async for video_id in self.iter_video_ids_in_playlist(playlist, track_id=track_info.track_id):
+            if video_id == track_info.track_id:
+                return True
+
+        return False
+
+    async def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
+        if check_duplicates and await self.is_track_in_playlist(track_info=track_info, playlist=playlist):
+            return False, DUPLICATE_TRACK
+
+        resource_body = {
+            'kind': 'youtube#playlistItem',
+            'snippet': {
+                'playlistId': playlist.platform_id,
+                'resourceId': {
+                    'kind': 'youtube#video',
+                    'videoId': track_info.track_id,
+                }
+            }
+        }
+
+        try:
+            await self.call(
+                'playlistItems', 'insert', http_method='POST', params={'part': 'snippet'}, json_body=resource_body)
+        except (ServiceHTTPError, QuotaExhaustedError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return False, str(e)
+
+        return True, None
+
+    async def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
+        """
+        One at a time: playlistItems.insert takes one video, and concurrent inserts
+        into the same playlist get rejected or land out of order
+        """
+        new_tracks, failures = await self._partition_new_tracks(
+            track_infos=track_infos,
+            playlist=playlist,
+            check_duplicates=check_duplicates
+        )
+
+        successes = []
+        for track_info in new_tracks:
+            success, error_message = await self.add_track_to_playlist(
+                track_info=track_info,
+                playlist=playlist,
+                check_duplicates=False
+            )
+            if success:
+                successes.append((track_info, None))
+            else:
+                failures.append((track_info, error_message))
+
+        return successes, failures
+
+    async def fuzzy_search(self, track_name, artist=None):
+        target_string = "%s" % track_name
+        if artist:
+            target_string += " %s" % artist
+        target_string = target_string.strip()
+
+        _, search_results = await self.call('search', 'list', params={
+            'q': target_string,
+            'part': 'snippet',
+            'maxResults': 10,
+            'type': 'video'
+        })
+
+        search_results = search_results.get('items', None)
+        if not search_results:
+            return None
+
+        return self.best_match(target_string=target_string, search_results=search_results)
+
+    async def fuzzy_search_from_track_info(self, track_info):
+        return await self.fuzzy_search(track_name=track_info.track_name_for_comparison())
+
+    async def _list_playlist_pages(self, params, first_page):
+        playlists = list(first_page.get('items', []))
+        page = first_page
+        while page.get('nextPageToken'):
+            _, page = await self.call('playlists', 'list', params=dict(params, pageToken=page['nextPageToken']))
+            playlists.extend(page.get('items', []))
+
+        return playlists
+
+    async def list_playlists(self):
+        params = {'part': 'snippet', 'mine': 'true', 'maxResults': YOUTUBE_PLAYLISTS_PER_PAGE}
+        _, first_page = await self.call('playlists', 'list', params=params)
+
+        return await self._list_playlist_pages(params, first_page)
+
+    async def get_playlist_index(self):
+        """
+        Same index, cache and etag revalidation as YoutubeService.get_playlist_index
+        """
+        index = self.sync_service.cached_playlist_index()
+        if index:
+            channel_id = index['channel_id']
+        else:
+            _, channels_response = await self.call('channels', 'list', params={'part': 'id', 'mine': 'true'})
+            if not channels_response or not channels_response.get('items'):
+                return None
+            channel_id = channels_response['items'][0]['id']
+
+        params = {
+            'part': 'snippet',
+            'mine': 'true',
+            'maxResults': YOUTUBE_PLAYLISTS_PER_PAGE,
+            'fields': YOUTUBE_PLAYLIST_INDEX_FIELDS
+        }
+        headers = {}
+        if index and index.get('etag'):
+            headers['If-None-Match'] = index['etag']
+
+        status, first_page = await self.call('playlists', 'list', params=params, headers=headers)
+        if status == HTTP_NOT_MODIFIED:
+            return index
+
+        playlists = {}
+        for pl in await self._list_playlist_pages(params, first_page):
+            playlists.setdefault(pl['snippet']['title'], pl)
+
+        # only a single page index can be revalidated
+        paged = bool(first_page.get('nextPageToken'))
+        etag = first_page.get('etag') if not paged else None
+        index = {'channel_id': channel_id, 'etag': etag, 'paged': paged, 'playlists': playlists}
+        self.sync_service.cache_playlist_index(index)
+
+        return index
+
+    async def get_playlist_title(self, playlist_id):
+        _, response = await self.call('playlists', 'list', params={
+            'part': 'snippet',
+            'id': playlist_id,
+            'fields': YOUTUBE_PLAYLIST_TITLE_FIELDS
+        })
+        items = response.get('items')
+        if not items:
+            return None
+
+        return items[0]['snippet']['title']
+
+    async def create_playlist(self, playlist_name):
+        index = self.sync_service.cached_playlist_index()
+        if index and index.get('paged'):
+            # same as YoutubeService.create_playlist: check a hit, create a miss without relisting
+            playlist = index['playlists'].get(playlist_name)
+            if playlist:
+                if await self.get_playlist_title(playlist['id']) == playlist_name:
+                    return True, playlist
+                index = self.sync_service.forget_cached_playlist(index, playlist_name)
+        else:
+            index = await self.get_playlist_index()
+            if not index:
+                return False, "No channels"
+
+            playlist = index['playlists'].get(playlist_name)
+            if playlist:
+                return True, playlist
+
+        pl_body = {
+            "status": {
+                "privacyStatus": "Public",
+            },
+            "kind": "youtube#playlist",
+            "snippet": {
+                "description": "slacktunes created playlist! Check out https://slacktunes.me",
+                "tags": ["slacktunes", ],
+                "channelId": index['channel_id'],
+                "title": playlist_name,
+                },
+        }
+
+        try:
+            _, pl_snippet = await self.call(
+                'playlists', 'insert', http_method='POST', params={'part': 'snippet,status'}, json_body=pl_body)
+        except (ServiceHTTPError, QuotaExhaustedError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return False, e
+
+        self.sync_service.cache_new_playlist(
+            index, playlist_name, {'id': pl_snippet['id'], 'snippet': {'title': playlist_name}})
+
+        return True, pl_snippet
+
+
+class AsyncSpotifyService(AsyncServiceBase):
+    SYNC_SERVICE = SpotifyService
+    API_URL = SPOTIFY_API_URL
+    PLATFORM = Platform.SPOTIFY
+
+    def __init__(self, *args, **kwargs):
+        user_info = kwargs.pop('user_info', None)
+
+        super(AsyncSpotifyService, self).__init__(*args, **kwargs)
+
+        self.user_info = user_info
+        self.credentials_manager = SpotipyClientCredentialsManager(credentials=self.credentials)
+        self.sync_service.user_info = user_info
+
+    async def get_access_token(self):
+        credentials = self.credentials_manager.credentials
+        if credentials['expires_at'] - time.time() >= SPOTIFY_TOKEN_EXPIRY_MARGIN:
+            return credentials['access_token']
+
+        # a refresh blocks on spotify, the db, and maybe waiting out another worker's refresh
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.credentials_manager.get_access_token)
+
+    async def get_user_info(self):
+        if self.user_info:
+            return self.user_info
+
+        _, user_info = await self.request('GET', '/me')
+        self.user_info = self.sync_service.user_info = user_info
+
+        return user_info
+
+    async def _pages(self, path, params=None):
+        """
+        Yields the items of a paged response, following spotify's next urls
+        """
+        _, page = await self.request('GET', path, params=params)
+        while page:
+            for item in page.get('items', []):
+                yield item
+
+            if not page.get('next'):
+                break
+            _, page = await self.request('GET', None, url=page['next'])
+
+    async def get_track_info_from_link(self, link):
+        track_id = self.track_id_from_link(link)
+        if not track_id:
+            return None
+
+        try:
+            _, resp = await self.request('GET', '/tracks/%s' % track_id)
+        except (ServiceHTTPError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to get Spotify track from track id: %s" % str(e))
+            return None
+
+        return TrackInfo(
+            track_id=track_id,
+            name=resp['name'],
+            platform=Platform.SPOTIFY,
+            raw_json=resp,
+            artists=[a['name'] for a in resp['artists']]
+        )
+
+    async def get_track_ids_in_playlist(self, playlist, track_id=None):
+        return {
+            item['track']['id']
+            async for item in self._pages('/playlists/%s/tracks' % playlist.platform_id)
+        }
+
+    async def get_playlist_snapshot_id(self, playlist):
+        _, resp = await self.request(
+            'GET', '/playlists/%s' % playlist.platform_id, params={'fields': 'snapshot_id'})
+
+        snapshot_id = resp.get('snapshot_id')
+        self.snapshot_ids[playlist.platform_id] = snapshot_id
+
+        return snapshot_id
+
+    async def is_track_in_playlist(self, track_info, playlist):
+        return track_info.track_id in await self.get_track_ids_in_playlist(playlist=playlist)
+
+    async def _add_tracks(self, track_infos, playlist):
+        """
+        Returns an error message, or None once the tracks are in
+        """
+        try:
+            _, resp = await self.request(
+                'POST',
+                '/playlists/%s/tracks' % playlist.platform_id,
+                json_body={'uris': ['spotify:track:%s' % t.track_id for t in track_infos]}
+            )
+        except ServiceHTTPError as e:
+            return e.message()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return str(e)
+
+        if not resp.get('snapshot_id'):
+            return "Unable to add tracks to %s" % playlist.name
+
+        self.snapshot_ids[playlist.platform_id] = resp['snapshot_id']
+
+        return None
+
+    async def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
+        if check_duplicates and await self.is_track_in_playlist(track_info=track_info, playlist=playlist):
+            return False, DUPLICATE_TRACK
+
+        error_message = await self._add_tracks([track_info], playlist)
+        if error_message:
+            return False, error_message
+
+        return True, None
+
+    async def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
+        new_tracks, failures = await self._partition_new_tracks(
+            track_infos=track_infos,
+            playlist=playlist,
+            check_duplicates=check_duplicates
+        )
+
+        successes = []
+        # batches go in order so the tracks keep theirs
+        for batch in chunks(new_tracks, SPOTIFY_MAX_TRACKS_PER_INSERT):
+            error_message = await self._add_tracks(batch, playlist)
+            if error_message:
+                failures.extend((t, error_message) for t in batch)
+            else:
+                successes.extend((t, None) for t in batch)
+
+        return successes, failures
+
+    async def search(self, track_name, artist=None):
+        search_string = track_name
+        if artist:
+            search_string += "track:%s artist:%s" % (track_name, artist)
+
+        try:
+            _, results = await self.request('GET', '/search', params={
+                'q': search_string,
+                'market': 'US',
+                'type': 'track',
+                'limit': 50
+            })
+        except (ServiceHTTPError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(e)
+            return None
+
+        if not results:
+            return None
+        if not results.get('tracks', {}).get('items'):
+            return []
+
+        return results['tracks']['items']
+
+    async def fuzzy_search(self, track_name, artist=None):
+        results = await self.search(track_name=track_name, artist=artist)
+        target_string = ("%s %s" % (track_name, artist)).strip()
+
+        return self.best_match(target_string=target_string, search_results=results)
+
+    async def fuzzy_search_from_track_info(self, track_info):
+        # searches with the sanitized name and compares with the full one; see SpotifyService
+        results = await self.search(
+            track_name=track_info.sanitized_track_name(),
+            artist=track_info.artists_for_search()
+        )
+
+        return self.best_match(
+            target_string=track_info.track_name_for_comparison(),
+            search_results=results,
+            track_info=track_info
+        )
+
+    async def list_playlists(self):
+        spotify_user_info = await self.get_user_info()
+        if not spotify_user_info:
+            return []
+
+        return [pl async for pl in self._pages('/users/%s/playlists' % spotify_user_info['id'])]
+
+    async def get_playlist_index(self):
+        index = self.sync_service.cached_playlist_index()
+        if index:
+            return index
+
+        spotify_user_info = await self.get_user_info()
+        if not spotify_user_info:
+            return None
+
+        playlists = {}
+        for pl in await self.list_playlists():
+            playlists.setdefault(pl['name'], {'id': pl['id'], 'name': pl['name']})
+
+        index = {'user_id': spotify_user_info['id'], 'playlists': playlists}
+        self.sync_service.cache_playlist_index(index)
+
+        return index
+
+    async def get_playlist_name(self, user_id, playlist_id):
+        """
+        Same as SpotifyService.get_playlist_name
+        """
+        try:
+            _, playlist = await self.request('GET', '/playlists/%s' % playlist_id, params={'fields': 'name'})
+        except (ServiceHTTPError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Failed to look up playlist %s: %s" % (playlist_id, str(e)))
+            return None
+
+        return playlist.get('name') if playlist else None
+
+    async def create_playlist(self, playlist_name):
+        index = self.sync_service.cached_playlist_index()
+        playlist = index['playlists'].get(playlist_name) if index else None
+        if playlist:
+            if await self.get_playlist_name(index['user_id'], playlist['id']) == playlist_name:
+                return True, playlist
+            # same as SpotifyService.create_playlist: list them again
+            forget_playlist_index(platform=self.PLATFORM, owner_id=self.owner_id)
+
+        index = await self.get_playlist_index()
+        if not index:
+            return False, "Could not find info for this user"
+
+        playlist = index['playlists'].get(playlist_name)
+        if playlist:
+            return True, playlist
+
+        try:
+            _, playlist = await self.request(
+                'POST',
+                '/users/%s/playlists' % index['user_id'],
+                json_body={'name': playlist_name, 'public': True}
+            )
+        except (ServiceHTTPError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(e)
+            return False, "Failed to create playlist"
+
+        self.sync_service.cache_new_playlist(index, playlist_name, {'id': playlist['id'], 'name': playlist_name})
+
+        return True, playlist
@@ -0,0 +1,194 @@
+import json
+import threading
+import time
+
+import redis
+from cachetools import TTLCache
+
+from app import logger
+from settings import REDIS_URL
+
+# how long to skip the redis tier after it fails
+REDIS_RETRY_INTERVAL = 30
+
+_redis_client = None
+
+
+def get_redis():
+    global _redis_client
+    if not REDIS_URL:
+        return None
+
+    if _redis_client is None:
+        _redis_client = redis.StrictRedis.from_url(
+            REDIS_URL,
+            socket_timeout=1,
+            socket_connect_timeout=1
+        )
+
+    return _redis_client
+
+
+class RedisTier():
+    """
+    The shared redis half of a cache. After a redis error the tier is skipped
+    for REDIS_RETRY_INTERVAL seconds rather than timing out on every call.
+    """
+
+    def __init__(self, namespace, ttl, use_redis=True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.redis_retry_at = 0
+
+    def _redis_key(self, key):
+        if isinstance(key, (list, tuple)):
+            key = ":".join(str(k) for k in key)
+
+        return "%s:%s" % (self.namespace, key)
+
+    def _redis(self):
+        if not self.use_redis or time.monotonic() < self.redis_retry_at:
+            return None
+
+        return get_redis()
+
+    def _redis_failed(self, e):
+        logger.error("Redis error in %s cache: %s" % (self.namespace, str(e)))
+        self.redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+
+class TieredCache(RedisTier):
+    """
+    An in-process LRU cache with a TTL, in front of an optional redis tier shared by every worker.
+    Values must be json-able; callers get back the same dict they stored,
+    so they shouldn't mutate it.
+    """
+
+    def __init__(self, namespace, maxsize, ttl, use_redis=True, timer=time.monotonic):
+        super(TieredCache, self).__init__(namespace=namespace, ttl=ttl, use_redis=use_redis)
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.lock = threading.Lock()
+
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.local.get(key)
+            if value is not None:
+                self.local_hits += 1
+                return value
+
+        value = None
+        client = self._redis()
+        if client:
+            try:
+                raw_value = client.get(self._redis_key(key))
+                if raw_value is not None:
+                    value = json.loads(raw_value.decode('utf-8'))
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.redis_hits += 1
+            self.local[key] = value
+
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.local[key] = value
+
+        client = self._redis()
+        if client:
+            try:
+                client.set(
+                    self._redis_key(key),
+                    json.dumps(value, separators=(',', ':')),
+                    ex=int(self.ttl)
+                )
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+    def delete(self, key):
+        with self.lock:
+            self.local.pop(key, None)
+
+        client = self._redis()
+        if client:
+            try:
+                client.delete(self._redis_key(key))
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+    def clear(self):
+        """
+        Only clears the in-process tier
+        """
+        with self.lock:
+            self.local.clear()
+
+    def stats(self):
+        with self.lock:
+            hits = self.local_hits + self.redis_hits
+            lookups = hits + self.misses
+
+            return {
+                'hits': hits,
+                'local_hits': self.local_hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'hit_rate': float(hits) / lookups if lookups else 0.0,
+                'size': len(self.local),
+            }
+
+
+class TTLSet(RedisTier):
+    """
+    Remembers keys for ttl seconds, for dropping repeats.
+    add() is True only the first time a key is seen: across every process
+    while redis is up (SET NX), and at least within this process when it isn't.
+    """
+
+    def __init__(self, namespace, maxsize, ttl, use_redis=True, timer=time.monotonic):
+        super(TTLSet, self).__init__(namespace=namespace, ttl=ttl, use_redis=use_redis)
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        with self.lock:
+            if key in self.local:
+                return False
+            self.local[key] = True
+
+        client = self._redis()
+        if not client:
+            return True
+
+        try:
+            return bool(client.set(self._redis_key(key), '1', ex=int(self.ttl), nx=True))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return True
+
+    def discard(self, key):
+        """
+        Forgets key, for when whatever add() let through didn't go ahead after all
+        """
+        with self.lock:
+            self.local.pop(key, None)
+
+        client = self._redis()
+        if not client:
+            return
+
+        try:
+            client.delete(self._redis_key(key))
+        except redis.RedisError as e:
+            self._redis_failed(e)
@@ -0,0 +1,96 @@
+import threading
+
+import httplib2
+from apiclient.discovery import DISCOVERY_URI, build_from_document
+from apiclient.errors import HttpError
+from cachetools import LRUCache
+
+from .tokens import OAuth2CredentialStorage
+
+# built clients kept per thread
+CLIENTS_PER_THREAD = 64
+
+
+def credential_identity(credentials):
+    """
+    The id of the Credential row the credentials were loaded from, or None when there isn't one
+    to tell them apart from another user's. Google leaves the refresh token out when a user
+    re-consents, and Credential.to_oauth2_creds only gives credentials with one a storage.
+    """
+    store = getattr(credentials, 'store', None)
+    if not isinstance(store, OAuth2CredentialStorage) or not credentials.refresh_token:
+        return None
+
+    return store.row_id
+
+
+class DiscoveryClientPool():
+    """
+    Replaces apiclient.discovery.build(), which fetches and parses the discovery document
+    every time it's called.
+    Discovery documents are fetched once per process. Built clients (and the authorized
+    httplib2.Http they wrap) are kept per thread, keyed by credential identity,
+    because httplib2.Http isn't thread safe. Every load of a Credential row gives a new
+    credentials object, so a cached client's transport is re-authorized with the
+    newest one it's asked for, rather than the client being rebuilt.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.discovery_documents = {}
+
+    def get_discovery_document(self, api_name, api_version, http=None):
+        key = (api_name, api_version)
+        with self.lock:
+            if key not in self.discovery_documents:
+                resp, content = (http or httplib2.Http()).request(
+                    DISCOVERY_URI.format(api=api_name, apiVersion=api_version)
+                )
+                if resp.status >= 400:
+                    raise HttpError(resp, content)
+
+                self.discovery_documents[key] = content.decode('utf-8')
+
+            return self.discovery_documents[key]
+
+    def build_client(self, api_name, api_version, credentials):
+        http = credentials.authorize(httplib2.Http())
+        return http, build_from_document(self.get_discovery_document(api_name, api_version), http=http)
+
+    @staticmethod
+    def reauthorize(http, credentials):
+        # authorize() wraps whatever http.request is, so unwrap the old credentials first
+        del http.request
+        credentials.authorize(http)
+
+    def get_client(self, api_name, api_version, credentials):
+        identity = credential_identity(credentials)
+        if identity is None:
+            return self.build_client(api_name, api_version, credentials)[1]
+
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = LRUCache(maxsize=CLIENTS_PER_THREAD)
+
+        key = (api_name, api_version, identity)
+        cached = clients.get(key)
+        if cached:
+            authorized_with, http, client = cached
+            if authorized_with is not credentials:
+                self.reauthorize(http, credentials)
+                clients[key] = (credentials, http, client)
+            return client
+
+        http, client = self.build_client(api_name, api_version, credentials)
+        clients[key] = (credentials, http, client)
+
+        return client
+
+    def clear(self):
+        with self.lock:
+            self.discovery_documents = {}
+        self.local = threading.local()
+
+
+discovery_client_pool = DiscoveryClientPool()
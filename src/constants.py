@@ -37,6 +37,13 @@ class Platform(Enum):
             return None
 
 
+class LinkKind(Enum):
+    TRACK = 'track'
+    ALBUM = 'album'
+    PLAYLIST = 'playlist'
+    ARTIST = 'artist'
+
+
 BAD_WORDS = [
     'EP',
     'Full',
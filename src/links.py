@@ -0,0 +1,120 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from .constants import LinkKind, Platform
+
+ParsedLink = namedtuple('ParsedLink', ['platform', 'kind', 'id'])
+
+YOUTUBE_ID = r'[A-Za-z0-9_-]{11}(?![A-Za-z0-9_-])'
+SPOTIFY_ID = r'[A-Za-z0-9]{22}(?![A-Za-z0-9])'
+SPOTIFY_KINDS = r'track|album|playlist|artist'
+
+# one pattern for every link shape we understand; the named group that matched says which.
+# IGNORECASE is for hosts and paths; the id classes already allow both cases.
+# HOST_START keeps a search from starting partway into a host (notyoutube.com) while
+# still allowing any subdomain (a dot before the host)
+HOST_START = r'(?<![A-Za-z0-9_-])'
+LINK_RE = re.compile(
+    r'''
+    (?:
+        (?:https?:)?(?://)?
+        %(host_start)s
+        (?:
+            (?:(?:www|m|music)\.)?youtube(?:-nocookie)?\.com/
+            (?:
+                watch/?\?(?:[^#\s]*?&)?v=(?P<yt_watch>%(yt)s)
+                | (?:shorts|embed|live|v)/(?P<yt_path>%(yt)s)
+                | playlist/?\?(?:[^#\s]*?&)?list=(?P<yt_list>[A-Za-z0-9_-]+)
+            )
+            | youtu\.be/(?P<yt_short>%(yt)s)
+            | (?:open|play)\.spotify\.com/
+              (?:intl-[A-Za-z]{2}(?:-[A-Za-z]{2})?/)?
+              (?:embed/)?
+              (?:user/[^/\s]+/)?
+              (?P<sp_kind>%(sp_kinds)s)/(?P<sp_id>%(sp)s)
+        )
+        | %(host_start)sspotify:(?:user:[^:\s]+:)?(?P<sp_uri_kind>%(sp_kinds)s):(?P<sp_uri_id>%(sp)s)
+    )
+    ''' % {'host_start': HOST_START, 'yt': YOUTUBE_ID, 'sp': SPOTIFY_ID, 'sp_kinds': SPOTIFY_KINDS},
+    re.VERBOSE | re.IGNORECASE
+)
+
+# parsed links kept per process; the same link is parsed for its platform, id and key
+PARSED_LINK_CACHE_SIZE = 4096
+
+YOUTUBE_KIND_BY_GROUP = {
+    'yt_watch': LinkKind.TRACK,
+    'yt_path': LinkKind.TRACK,
+    'yt_short': LinkKind.TRACK,
+    'yt_list': LinkKind.PLAYLIST,
+}
+SPOTIFY_KIND_GROUP_BY_ID_GROUP = {
+    'sp_id': 'sp_kind',
+    'sp_uri_id': 'sp_uri_kind',
+}
+SPOTIFY_KIND_BY_NAME = {kind.value: kind for kind in LinkKind}
+
+
+@lru_cache(maxsize=PARSED_LINK_CACHE_SIZE)
+def parse_link(link):
+    """
+    Returns a ParsedLink(platform, kind, id) for a youtube or spotify link, or None.
+    Youtube videos (watch, youtu.be, shorts, music.youtube, embeds) are LinkKind.TRACKs.
+    """
+    if not link:
+        return None
+
+    match = LINK_RE.match(link)
+    if not match and ('yout' in link or 'spotify' in link):
+        # the link is somewhere in the middle of the string
+        match = LINK_RE.search(link)
+    if not match:
+        return None
+
+    # each branch of the pattern ends with its id group
+    group = match.lastgroup
+    if group in YOUTUBE_KIND_BY_GROUP:
+        return ParsedLink(Platform.YOUTUBE, YOUTUBE_KIND_BY_GROUP[group], match.group(group))
+
+    kind = match.group(SPOTIFY_KIND_GROUP_BY_ID_GROUP[group]).lower()
+    return ParsedLink(Platform.SPOTIFY, SPOTIFY_KIND_BY_NAME[kind], match.group(group))
+
+
+def track_id_from_link(link, platform=None):
+    """
+    The canonical track id for a link to a single track (on platform, if given), or None
+    """
+    parsed = parse_link(link)
+    if not parsed or parsed.kind is not LinkKind.TRACK:
+        return None
+
+    if platform and parsed.platform is not platform:
+        return None
+
+    return parsed.id
+
+
+def link_platform(link):
+    """
+    The platform of a youtube or spotify link we can parse, or None
+    """
+    parsed = parse_link(link)
+    if not parsed:
+        return None
+
+    return parsed.platform
+
+
+def link_key(link):
+    """
+    Cache/dedupe key for a link; every link to the same thing has the same key
+    """
+    parsed = parse_link(link)
+    if not parsed:
+        return link
+
+    if parsed.kind is LinkKind.TRACK:
+        return "%s:%s" % (parsed.platform.name, parsed.id)
+
+    return "%s:%s:%s" % (parsed.platform.name, parsed.kind.value, parsed.id)
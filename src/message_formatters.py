@@ -1,24 +1,27 @@
-import requests
-
-from settings import SLACK_OAUTH_TOKEN
-from .constants import SlackUrl
 from .music_services import TrackInfo
+from .slack_client import slack_client
+
+# slack rejects a whole message with invalid_blocks when it has more than this
+SLACK_MAX_BLOCKS = 50
 
 
 class SlackMessageFormatter():
     @classmethod
     def post_message(cls, payload):
-        res = requests.post(
-            url=SlackUrl.POST_MESSAGE.value,
-            json=payload,
-            headers={
-                "Content-type": "application/json",
-                "Authorization": "Bearer %s" % SLACK_OAUTH_TOKEN
-            }
-        )
+        res = slack_client.post_message(payload=payload)
+
+        return res.text, res.status_code
+
+    @classmethod
+    def respond(cls, response_url, text):
+        res = slack_client.respond(response_url=response_url, text=text)
 
         return res.text, res.status_code
 
+    @classmethod
+    def get_channel_history(cls, channel, latest=None, count=200):
+        return slack_client.get_channel_history(channel=channel, latest=latest, count=count)
+
     @classmethod
     def format_results_block(cls, track_info, successes, failures):
         if not successes and not failures:
@@ -61,7 +64,10 @@ class SlackMessageFormatter():
 
     @classmethod
     def format_failed_search_results_message(cls, origin, target_platform):
-        if isinstance(origin, TrackInfo):
+        if target_platform is None:
+            # a link we couldn't parse, so there's no platform to name
+            attempt_message = "Unable to find info for link %s" % origin
+        elif isinstance(origin, TrackInfo):
             origin_link = "*<%s|%s>*" % (origin.track_open_url(), origin.track_name_for_display())
             attempt_message = "Unable to find %s track for %s" % (
                 target_platform.name.title(),
@@ -132,3 +138,46 @@ class SlackMessageFormatter():
                 {"type": "divider"}
             ]
         }
+
+    @classmethod
+    def format_add_tracks_results_messages(cls, results, failed_searches):
+        """
+        Messages for a group of tracks (e.g. every link in a link_shared event).
+        results is a list of (origin, track_info, successes, failures) and
+        failed_searches is a list of (origin, target_platform).
+        Each track's blocks stay together, and a message only gets as many tracks as fit
+        in SLACK_MAX_BLOCKS; returns a list of payloads, empty if there's nothing to post
+        """
+        tracks = []
+        for origin, track_info, successes, failures in results:
+            if not successes and not failures:
+                continue
+
+            tracks.append(cls.format_add_track_results_message(
+                origin=origin,
+                track_info=track_info,
+                successes=successes,
+                failures=failures
+            )['blocks'])
+
+        for origin, target_platform in failed_searches:
+            tracks.append(cls.format_failed_search_results_message(
+                origin=origin,
+                target_platform=target_platform
+            )['blocks'])
+
+        messages = []
+        for blocks in tracks:
+            if not messages or len(messages[-1]['blocks']) + len(blocks) > SLACK_MAX_BLOCKS:
+                messages.append({'blocks': [], 'num_tracks': 0})
+            messages[-1]['blocks'].extend(blocks)
+            messages[-1]['num_tracks'] += 1
+
+        return [
+            {
+                'text': "Playlist results for %s track%s" % (
+                    message['num_tracks'], '' if message['num_tracks'] == 1 else 's'),
+                'blocks': message['blocks'],
+            }
+            for message in messages
+        ]
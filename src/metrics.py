@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# latency samples kept for percentiles
+LATENCY_SAMPLES = 1000
+
+
+class LatencyRecorder():
+    """
+    Thread safe count and percentiles over the most recent LATENCY_SAMPLES durations (in seconds)
+    """
+
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, pct):
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if not samples:
+            return 0.0
+
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+
+class LatencyRecorders():
+    """
+    A LatencyRecorder per name (a slash command, say), made on first use
+    """
+
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.recorders = {}
+
+    def get(self, name):
+        with self.lock:
+            if name not in self.recorders:
+                self.recorders[name] = LatencyRecorder(max_samples=self.max_samples)
+            return self.recorders[name]
+
+    def record(self, name, seconds):
+        self.get(name).record(seconds)
+
+    @contextmanager
+    def timed(self, name, clock=time.monotonic):
+        started = clock()
+        try:
+            yield
+        finally:
+            self.record(name, clock() - started)
+
+    def summary(self):
+        with self.lock:
+            recorders = dict(self.recorders)
+
+        return {name: recorder.summary() for name, recorder in recorders.items()}
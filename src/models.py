@@ -1,11 +1,22 @@
 import datetime
 import json
+import uuid
 
 from oauth2client.client import OAuth2Credentials
 from sqlalchemy import UniqueConstraint
+from sqlalchemy.exc import IntegrityError
 
 from app import db
 from .constants import Platform
+from .tokens import OAuth2CredentialStorage
+
+# how long a playlist's local track index is trusted before it is reconciled against the platform
+PLAYLIST_INDEX_RECONCILE_INTERVAL = datetime.timedelta(hours=12)
+# how long cross-platform search results are reused
+MATCH_CACHE_TTL = datetime.timedelta(days=30)
+NO_MATCH_CACHE_TTL = datetime.timedelta(hours=6)
+# a backfill run that hasn't finished a page in this long is assumed dead, and can be started again
+BACKFILL_STALL_TIMEOUT = datetime.timedelta(minutes=30)
 
 
 def now():
@@ -31,9 +42,18 @@ class Playlist(db.Model, BaseModelMixin):
     channel_id = db.Column(db.String(100))
     platform = db.Column(db.Enum(Platform))
     platform_id = db.Column(db.String(100))
+    index_reconciled_at = db.Column(db.DateTime, nullable=True)
+    # the platform's version tag for the playlist contents the index matches, if it has one
+    snapshot_id = db.Column(db.String(100), nullable=True)
     # relations
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref=db.backref('playlists', lazy='dynamic'))
+    tracks = db.relationship(
+        'PlaylistTrack',
+        backref='playlist',
+        lazy='dynamic',
+        cascade='all, delete-orphan'
+    )
 
     __table_args__ = (
         UniqueConstraint(
@@ -50,6 +70,255 @@ class Playlist(db.Model, BaseModelMixin):
         self.platform_id = platform_id
         self.user_id = user_id
 
+    def is_indexed(self):
+        return self.index_reconciled_at is not None
+
+    def has_track(self, track_id):
+        return db.session.query(
+            PlaylistTrack.query.filter_by(playlist_id=self.id, track_id=track_id).exists()
+        ).scalar()
+
+    def index_track(self, track_id, snapshot_id=None):
+        self.index_tracks([track_id], snapshot_id=snapshot_id)
+
+    def index_tracks(self, track_ids, snapshot_id=None):
+        """
+        Adds track ids we just inserted to the local index.
+        snapshot_id is the playlist's snapshot id after the insert, if the platform returned one
+        """
+        track_ids = {t for t in track_ids if t}
+        if not track_ids:
+            return
+
+        indexed_ids = {
+            t for (t, ) in db.session.query(PlaylistTrack.track_id).filter(
+                PlaylistTrack.playlist_id == self.id,
+                PlaylistTrack.track_id.in_(track_ids)
+            )
+        }
+        db.session.add_all([
+            PlaylistTrack(playlist_id=self.id, track_id=t)
+            for t in track_ids - indexed_ids
+        ])
+        self.snapshot_id = snapshot_id
+        db.session.add(self)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker indexed some of these first; the next reconcile will catch up
+            db.session.rollback()
+
+    def reconcile_track_index(self, track_ids, snapshot_id=None):
+        """
+        Make the local index match the given set of track ids,
+        which should be the full contents of the playlist on its platform
+        (as of snapshot_id, if the platform has them)
+        """
+        track_ids = {t for t in track_ids if t}
+        indexed_ids = {
+            t for (t, ) in db.session.query(PlaylistTrack.track_id).filter_by(playlist_id=self.id)
+        }
+
+        removed_ids = indexed_ids - track_ids
+        if removed_ids:
+            PlaylistTrack.query.filter(
+                PlaylistTrack.playlist_id == self.id,
+                PlaylistTrack.track_id.in_(removed_ids)
+            ).delete(synchronize_session=False)
+
+        db.session.add_all([
+            PlaylistTrack(playlist_id=self.id, track_id=t)
+            for t in track_ids - indexed_ids
+        ])
+        self.index_reconciled_at = datetime.datetime.utcnow()
+        self.snapshot_id = snapshot_id
+        db.session.add(self)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker indexed the same tracks first; its index is as good as ours
+            db.session.rollback()
+
+    def touch_track_index(self):
+        """
+        The platform says the playlist hasn't changed since the index was last reconciled
+        """
+        self.index_reconciled_at = datetime.datetime.utcnow()
+        self.save()
+
+
+class PlaylistTrack(db.Model, BaseModelMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    playlist_id = db.Column(db.Integer, db.ForeignKey('playlist.id'), nullable=False)
+    track_id = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('playlist_id', 'track_id', name='_playlist_track_constraint'),
+    )
+
+    def __init__(self, playlist_id, track_id):
+        self.playlist_id = playlist_id
+        self.track_id = track_id
+
+
+class ChannelBackfill(db.Model, BaseModelMixin):
+    """
+    Progress of a /scrape_music/ run through a channel's history.
+    latest_ts is the timestamp of the oldest message processed so far;
+    channels.history is paged backwards from it.
+    Only the run with run_id carries on; heartbeat_at is when it was queued or last finished a page.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    channel_id = db.Column(db.String(100), index=True, unique=True)
+    latest_ts = db.Column(db.String(32), nullable=True)
+    is_finished = db.Column(db.Boolean, default=False)
+    messages_scanned = db.Column(db.Integer, default=0)
+    tracks_added = db.Column(db.Integer, default=0)
+    elapsed_seconds = db.Column(db.Float, default=0.0)
+    run_id = db.Column(db.String(32), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, channel_id):
+        self.channel_id = channel_id
+        self.latest_ts = None
+        self.is_finished = False
+        self.messages_scanned = 0
+        self.tracks_added = 0
+        self.elapsed_seconds = 0.0
+
+    @classmethod
+    def claim_run(cls, channel_id):
+        """
+        Starts a new run for the channel, unless it's finished or another run
+        has been heard from within BACKFILL_STALL_TIMEOUT.
+        Returns the new run's id, or None.
+        """
+        if not cls.query.filter_by(channel_id=channel_id).first():
+            db.session.add(cls(channel_id=channel_id))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # another request created it first
+                db.session.rollback()
+
+        now = datetime.datetime.utcnow()
+        run_id = uuid.uuid4().hex
+        # one conditional update, so two requests can't both claim it
+        claimed = cls.query.filter(
+            cls.channel_id == channel_id,
+            cls.is_finished.isnot(True),
+            db.or_(cls.heartbeat_at.is_(None), cls.heartbeat_at < now - BACKFILL_STALL_TIMEOUT)
+        ).update({'run_id': run_id, 'heartbeat_at': now}, synchronize_session=False)
+        db.session.commit()
+
+        return run_id if claimed else None
+
+    def tracks_per_second(self):
+        if not self.elapsed_seconds:
+            return 0.0
+
+        return self.tracks_added / self.elapsed_seconds
+
+
+class DeferredSearch(db.Model, BaseModelMixin):
+    """
+    A search put off until the youtube quota resets. run_deferred_searches queues it
+    once run_after has passed and there's quota for it.
+    origin is json: a TrackInfo.to_wire(), or {'track_name', 'artist'} for a manual search.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.Text)
+    platform = db.Column(db.Enum(Platform))
+    channel_id = db.Column(db.String(100))
+    post_results = db.Column(db.Boolean, default=True)
+    run_after = db.Column(db.DateTime, index=True)
+
+
+class TrackMatch(db.Model, BaseModelMixin):
+    """
+    Cached result of a cross-platform search for a track.
+    A NULL target_track_id means the search found nothing.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    source_platform = db.Column(db.Enum(Platform))
+    source_track_id = db.Column(db.String(100))
+    target_platform = db.Column(db.Enum(Platform))
+    target_track_id = db.Column(db.String(100), nullable=True)
+    score = db.Column(db.Integer, nullable=True)
+    # TrackInfo.to_cache_dict() of the match
+    target_track = db.Column(db.String(5000), nullable=True)
+    matched_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        UniqueConstraint(
+            'source_platform',
+            'source_track_id',
+            'target_platform',
+            name='_source_target_platform_constraint'
+        ),
+    )
+
+    def __init__(self, source_platform, source_track_id, target_platform):
+        self.source_platform = source_platform
+        self.source_track_id = source_track_id
+        self.target_platform = target_platform
+
+    @classmethod
+    def lookup(cls, source_platform, source_track_id, target_platform, include_expired=False):
+        """
+        Returns the cached match if there is one that hasn't expired
+        """
+        match = cls.query.filter_by(
+            source_platform=source_platform,
+            source_track_id=source_track_id,
+            target_platform=target_platform
+        ).first()
+        if not match or (match.is_expired() and not include_expired):
+            return None
+
+        return match
+
+    @classmethod
+    def record(cls, source_platform, source_track_id, target_platform, target_track=None):
+        """
+        target_track is the match's TrackInfo.to_cache_dict(), or None if nothing matched
+        """
+        match = cls.query.filter_by(
+            source_platform=source_platform,
+            source_track_id=source_track_id,
+            target_platform=target_platform
+        ).first()
+        if not match:
+            match = cls(
+                source_platform=source_platform,
+                source_track_id=source_track_id,
+                target_platform=target_platform
+            )
+
+        match.target_track_id = target_track['track_id'] if target_track else None
+        match.score = target_track.get('match_score') if target_track else None
+        match.target_track = json.dumps(target_track) if target_track else None
+        match.matched_at = datetime.datetime.utcnow()
+
+        db.session.add(match)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another worker recorded the same search first
+            db.session.rollback()
+
+        return match
+
+    def is_expired(self):
+        ttl = MATCH_CACHE_TTL if self.target_track_id else NO_MATCH_CACHE_TTL
+        return self.matched_at < datetime.datetime.utcnow() - ttl
+
+    def target_track_dict(self):
+        if not self.target_track:
+            return None
+
+        return json.loads(self.target_track)
+
 
 class User(db.Model, BaseModelMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -86,9 +355,25 @@ class Credential(db.Model, BaseModelMixin):
         self.platform = platform
         self.credentials = credentials
 
+    @classmethod
+    def for_slack_user(cls, slack_id, platform):
+        return cls.query.join(User, User.id == cls.user_id).filter(
+            User.slack_id == slack_id,
+            cls.platform == platform
+        ).first()
+
     def to_oauth2_creds(self):
         if self.platform is Platform.YOUTUBE:
-            return OAuth2Credentials.from_json(self.credentials)
+            credentials = OAuth2Credentials.from_json(self.credentials)
+            if self.id and credentials.refresh_token:
+                # refreshed tokens are written back here and shared with the other workers
+                credentials.set_store(OAuth2CredentialStorage(
+                    model=Credential,
+                    row_id=self.id,
+                    credentials_json=self.credentials,
+                    refresh_token=credentials.refresh_token
+                ))
+            return credentials
         elif self.platform is Platform.SPOTIFY:
             return json.loads(self.credentials)
         else:
@@ -1,18 +1,21 @@
 import abc
 import json
-import httplib2
-import re
 from functools import wraps
-from fuzzywuzzy import fuzz
 
-from apiclient.discovery import build
+from apiclient.errors import HttpError
 from oauth2client.client import OAuth2WebServerFlow
 from spotipy import Spotify as Spotipy
 from spotipy.client import SpotifyException
 
 from app import logger
-from .constants import BAD_WORDS, DUPLICATE_TRACK, InvalidEnumException, Platform
+from .cache import TieredCache
+from .client_pool import discovery_client_pool
+from .constants import DUPLICATE_TRACK, InvalidEnumException, Platform
+from .links import link_platform, track_id_from_link
 from .oauth_wrappers import SpotipyClientCredentialsManager, SpotipyDBWrapper
+from .quota import QuotaClient, youtube_quota
+from .sanitizer import sanitize_title
+from .scoring import TOKEN_SET, TOKEN_SORT, Candidate, batch_scorer
 from settings import (
     SPOTIFY_CLIENT_ID,
     SPOTIFY_CLIENT_SECRET,
@@ -26,6 +29,39 @@ YOUTUBE_TOKEN_SET_THRESHHOLD = 85
 SPOTIFY_TOKEN_SET_THRESHHOLD = 75
 SPOTIFY_TOKEN_SORT_THRESHHOLD = 65
 
+# user_playlist_add_tracks takes at most 100 tracks per request
+SPOTIFY_MAX_TRACKS_PER_INSERT = 100
+
+# playlistItems.list pages hold at most 50 items
+YOUTUBE_PLAYLIST_ITEMS_PER_PAGE = 50
+# only what's needed to collect video ids and keep paging; contentDetails is far smaller than snippet
+YOUTUBE_PLAYLIST_ITEM_PART = 'contentDetails'
+YOUTUBE_PLAYLIST_ITEM_FIELDS = 'nextPageToken,items/contentDetails/videoId'
+
+# the playlist index only needs titles and ids; the etag is what revalidates it
+YOUTUBE_PLAYLISTS_PER_PAGE = 50
+YOUTUBE_PLAYLIST_INDEX_FIELDS = 'etag,nextPageToken,items(id,snippet/title)'
+YOUTUBE_PLAYLIST_TITLE_FIELDS = 'items(id,snippet/title)'
+HTTP_NOT_MODIFIED = 304
+
+PLAYLIST_INDEX_CACHE_SIZE = 512
+PLAYLIST_INDEX_TTL = 60 * 60 * 6
+
+# a user's platform playlists by name, keyed by (platform name, slacktunes user id),
+# so create_playlist doesn't have to page through all of them
+playlist_index_cache = TieredCache(
+    namespace='playlist_index',
+    maxsize=PLAYLIST_INDEX_CACHE_SIZE,
+    ttl=PLAYLIST_INDEX_TTL
+)
+
+
+def forget_playlist_index(platform, owner_id):
+    """
+    For when a user's credentials change; the index may belong to a different account
+    """
+    playlist_index_cache.delete((platform.name, owner_id))
+
 
 class NoCredentialsError(Exception):
     pass
@@ -49,16 +85,146 @@ def credentials_required(func):
 
 
 class TrackInfo():
-    def __init__(self, name, platform, raw_json=None, artists=None, track_id=None, link=None):
+    """
+    Only the parts of a platform response that TrackInfo methods read are kept:
+    the youtube description and channelTitle, the smallest image url and artist names.
+    raw_json is accepted for convenience and dropped after those are pulled out of it.
+    """
+    __slots__ = (
+        'name',
+        'platform',
+        'artists',
+        'track_id',
+        'link',
+        'match_score',
+        'description_text',
+        'channel_title_text',
+        'image_url',
+    )
+
+    def __init__(
+        self,
+        name,
+        platform,
+        raw_json=None,
+        artists=None,
+        track_id=None,
+        link=None,
+        match_score=None,
+        description=None,
+        channel_title=None,
+        image_url=None
+    ):
         self.name = name
         if isinstance(platform, Platform):
             self.platform = platform
         else:
             self.platform = Platform.from_string(platform)
-        self.raw_json = raw_json  # NOTE: for youtube responses, this means raw['snippet']
         self.artists = artists
         self.track_id = track_id
         self.link = link
+        # fuzzy match score, if this TrackInfo was the best match for a search
+        self.match_score = match_score
+        self.description_text = description
+        self.channel_title_text = channel_title
+        self.image_url = image_url
+
+        if raw_json:
+            # NOTE: for youtube responses, this means raw['snippet']
+            self._extract(raw_json)
+
+    def _extract(self, raw_json):
+        if self.platform is Platform.YOUTUBE:
+            self.description_text = raw_json.get('description', '')
+            self.channel_title_text = raw_json.get('channelTitle', '')
+            self.image_url = raw_json.get('thumbnails', {}).get('default', {}).get('url')
+            return
+
+        images = raw_json.get('album', {}).get('images', None)
+        if images:
+            self.image_url = min(images, key=lambda im: im.get('height') or 0).get('url')
+
+        if self.artists is None and raw_json.get('artists'):
+            self.artists = [a['name'] for a in raw_json['artists']]
+
+    @property
+    def raw_json(self):
+        return self.compact_raw_json()
+
+    @classmethod
+    def from_cache_dict(cls, data):
+        return cls(**data)
+
+    def to_cache_dict(self):
+        """
+        A json-able dict with only the parts of raw_json that TrackInfo methods read
+        """
+        return {
+            'name': self.name,
+            'platform': self.platform.name,
+            'track_id': self.track_id,
+            'artists': self.artists,
+            'link': self.link,
+            'match_score': self.match_score,
+            'raw_json': self.compact_raw_json(),
+        }
+
+    @classmethod
+    def from_wire(cls, data):
+        (
+            name,
+            platform,
+            track_id,
+            artists,
+            link,
+            match_score,
+            description,
+            channel_title,
+            image_url
+        ) = data
+        return cls(
+            name=name,
+            platform=platform,
+            track_id=track_id,
+            artists=artists,
+            link=link,
+            match_score=match_score,
+            description=description,
+            channel_title=channel_title,
+            image_url=image_url
+        )
+
+    def to_wire(self):
+        """
+        Positional, json-able encoding for passing a TrackInfo to a celery task
+        """
+        return [
+            self.name,
+            self.platform.name,
+            self.track_id,
+            self.artists,
+            self.link,
+            self.match_score,
+            self.description_text,
+            self.channel_title_text,
+            self.image_url,
+        ]
+
+    def compact_raw_json(self):
+        if self.platform is Platform.YOUTUBE:
+            if self.description_text is None and self.channel_title_text is None and not self.image_url:
+                return None
+
+            return {
+                'description': self.description(),
+                'channelTitle': self.channel_title(),
+                'thumbnails': {'default': {'url': self.track_image_url()}},
+            }
+
+        if not self.image_url:
+            return None
+
+        return {'album': {'images': [{'url': self.image_url}]}}
 
     def artists_display_name(self):
         if self.artists:
@@ -100,16 +266,10 @@ class TrackInfo():
         return self.name
 
     def description(self):
-        if self.raw_json:
-            return self.raw_json.get('description', '')
-
-        return ''
+        return self.description_text or ''
 
     def channel_title(self):
-        if self.raw_json:
-            return self.raw_json.get('channelTitle', '')
-
-        return ''
+        return self.channel_title_text or ''
 
     def track_open_url(self):
         if self.link:
@@ -123,31 +283,15 @@ class TrackInfo():
             return None
 
     def track_image_url(self):
-        if not self.raw_json:
-            return 'nope'
-
-        if self.platform is Platform.YOUTUBE:
-            return self.raw_json.get('thumbnails', {}).get('default', {}).get('url', 'nope')
-        elif self.platform is Platform.SPOTIFY:
-            images = self.raw_json.get('album', {}).get('images', None)
-            if not images:
-                return 'nope'
-
-            return  min(images, key=lambda im: im['height']).get('url', 'nope')
-        else:
-            return 'nope'
+        return self.image_url or 'nope'
 
     def sanitized_track_name(self):
-        new_title = re.sub(r"[|&'_-]", "", self.name)
-        new_title = re.sub(r'\([^)]*\)', '', new_title)
-        new_title = re.sub(r'\[[^]]*\]', '', new_title)
-        # take out multiple spaces
-        new_title = ' '.join(new_title.split())
+        return sanitize_title(self.name)
 
-        for word in BAD_WORDS:
-            replacer = re.compile("\\b%s\\b" % word, re.IGNORECASE)
-            new_title = replacer.sub('', new_title)
-        return new_title
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class ServiceFactory():
@@ -161,14 +305,13 @@ class ServiceFactory():
             raise Exception("Invalid platform")
 
     @classmethod
-    def from_link(self, link):
-        if 'yout' in link:
-            return YoutubeService
-        elif 'spotify' in link:
-            return SpotifyService
-        else:
+    def from_link(cls, link):
+        platform = link_platform(link)
+        if not platform:
             return None
 
+        return cls.from_enum(platform)
+
     @classmethod
     def from_enum(cls, enum):
         if enum is Platform.YOUTUBE:
@@ -180,9 +323,15 @@ class ServiceFactory():
 
 
 class ServiceBase(metaclass=abc.ABCMeta):
-    def __init__(self, credentials, client=None):
+    PLATFORM = None
+
+    def __init__(self, credentials, client=None, owner_id=None):
         self.credentials = credentials
         self.client = client
+        # the slacktunes user the credentials belong to; without one the playlist index isn't cached
+        self.owner_id = owner_id
+        # playlist platform_id -> the last snapshot id this service saw for it
+        self.snapshot_ids = {}
 
     @abc.abstractclassmethod
     def get_flow(cls):
@@ -200,6 +349,10 @@ class ServiceBase(metaclass=abc.ABCMeta):
     def get_wrapped_client(self):
         raise NotImplementedError()
 
+    @abc.abstractclassmethod
+    def track_id_from_link(cls, link):
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def get_track_info_from_link(self, link):
         raise NotImplementedError()
@@ -212,8 +365,25 @@ class ServiceBase(metaclass=abc.ABCMeta):
     def is_track_in_playlist(self, track_info, playlist):
         raise NotImplementedError()
 
+    def get_playlist_snapshot_id(self, playlist):
+        """
+        Fetches the playlist's snapshot id, a tag that changes whenever its contents do.
+        Platforms without one return None.
+        """
+        return None
+
+    def known_snapshot_id(self, playlist):
+        """
+        The playlist's snapshot id as of the last call this service made that fetched or changed it
+        """
+        return self.snapshot_ids.get(playlist.platform_id)
+
+    @abc.abstractmethod
+    def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
+        raise NotImplementedError()
+
     @abc.abstractmethod
-    def add_track_to_playlist(self, track_info, playlist):
+    def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
         raise NotImplementedError()
 
     @abc.abstractmethod
@@ -232,16 +402,70 @@ class ServiceBase(metaclass=abc.ABCMeta):
     def list_playlists(self, *args, **kwargs):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def get_playlist_index(self):
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def create_playlist(self, playlist_name):
         raise NotImplementedError()
 
+    def cached_playlist_index(self):
+        if self.owner_id is None:
+            return None
+
+        return playlist_index_cache.get((self.PLATFORM.name, self.owner_id))
+
+    def cache_playlist_index(self, index):
+        if self.owner_id is None:
+            return
+
+        playlist_index_cache.set((self.PLATFORM.name, self.owner_id), index)
+
+    def cache_new_playlist(self, index, playlist_name, playlist):
+        # the cached index is shared, so it's copied rather than changed
+        playlists = dict(index['playlists'])
+        playlists[playlist_name] = playlist
+        self.cache_playlist_index(dict(index, playlists=playlists))
+
+    def forget_cached_playlist(self, index, playlist_name):
+        """
+        Drops a playlist that's gone or been renamed from the cached index, and returns the new index
+        """
+        playlists = dict(index['playlists'])
+        playlists.pop(playlist_name, None)
+        index = dict(index, playlists=playlists)
+        self.cache_playlist_index(index)
+
+        return index
+
+    def _partition_new_tracks(self, track_infos, playlist, check_duplicates):
+        """
+        Splits track_infos into tracks that still need to be inserted and
+        failures for tracks that are already in the playlist (or repeated in track_infos)
+        """
+        existing_ids = set()
+        if check_duplicates:
+            existing_ids = self.get_track_ids_in_playlist(playlist=playlist)
+
+        new_tracks = []
+        duplicates = []
+        for track_info in track_infos:
+            if track_info.track_id in existing_ids:
+                duplicates.append((track_info, DUPLICATE_TRACK))
+            else:
+                existing_ids.add(track_info.track_id)
+                new_tracks.append(track_info)
+
+        return new_tracks, duplicates
+
 
 class YoutubeService(ServiceBase):
     SCOPE = 'https://www.googleapis.com/auth/youtube'
     API_SERVICE_NAME = "youtube"
     API_VERSION = "v3"
     NAME = 'Youtube'
+    PLATFORM = Platform.YOUTUBE
 
     @classmethod
     def get_flow(cls):
@@ -270,33 +494,28 @@ class YoutubeService(ServiceBase):
         if self.client:
             return self.client
 
-        http_auth = self.credentials.authorize(httplib2.Http())
-        return build(
-            self.API_SERVICE_NAME,
-            self.API_VERSION,
-            http=http_auth,
-            cache_discovery=False
+        self.client = QuotaClient(
+            discovery_client_pool.get_client(
+                api_name=self.API_SERVICE_NAME,
+                api_version=self.API_VERSION,
+                credentials=self.credentials
+            ),
+            accountant=youtube_quota
         )
+        return self.client
+
+    @classmethod
+    def track_id_from_link(cls, link):
+        return track_id_from_link(link, platform=Platform.YOUTUBE)
 
     def get_track_info_from_link(self, link):
-        if 'yout' not in link:
+        if link_platform(link) is not Platform.YOUTUBE:
             # TODO
             return False
 
-        video_id = None
-        if "v=" in link:
-            link.split('?')
-            for param in link.split('&'):
-                if 'v=' in param:
-                    video_id = param.split('=')[1]
-        else:
-            # mobile video share
-            # TODO: what is all this dumbass link splitting?
-            link_parts = link.split()
-            link = [p for p in link_parts if 'yout' in p]
-            if not link:
-                return None
-            video_id = link[0].split('be/')[1]
+        video_id = self.track_id_from_link(link)
+        if not video_id:
+            return None
 
         client = self.get_wrapped_client()
         resp = client.videos().list(part='snippet', id=video_id).execute()
@@ -314,43 +533,47 @@ class YoutubeService(ServiceBase):
             raw_json=track['snippet']
         )
 
-    def get_track_ids_in_playlist(self, playlist, track_id=None, **kwargs):
+    def iter_video_ids_in_playlist(self, playlist, track_id=None, **kwargs):
+        """
+        Yields the video ids in a playlist a page at a time, only fetching the next page
+        when the caller gets to it. With track_id, youtube filters the playlist down to that video.
+        """
         client = self.get_wrapped_client()
 
         list_kwargs = {
-            'part': 'snippet',
+            'part': YOUTUBE_PLAYLIST_ITEM_PART,
+            'fields': YOUTUBE_PLAYLIST_ITEM_FIELDS,
             'playlistId': playlist.platform_id,
-            'maxResults': 50
+            'maxResults': YOUTUBE_PLAYLIST_ITEMS_PER_PAGE
         }
         if track_id:
             list_kwargs['videoId'] = track_id
 
         list_kwargs.update(**kwargs)
 
-        track_ids = set()
         playlist_items_list_request = client.playlistItems().list(**list_kwargs)
         while playlist_items_list_request:
             playlist_items_list_response = playlist_items_list_request.execute()
-            track_ids = track_ids.union({
-                item['snippet']['resourceId']['videoId']
-                for item in playlist_items_list_response['items']
-            })
+            for item in playlist_items_list_response.get('items', []):
+                yield item['contentDetails']['videoId']
 
             playlist_items_list_request = client.playlistItems().list_next(
                 playlist_items_list_request,
                 playlist_items_list_response
             )
 
-        return track_ids
+    def get_track_ids_in_playlist(self, playlist, track_id=None, **kwargs):
+        return set(self.iter_video_ids_in_playlist(playlist=playlist, track_id=track_id, **kwargs))
 
     def is_track_in_playlist(self, track_info, playlist):
-        return track_info.track_id in self.get_track_ids_in_playlist(
+        # stops at the first match; with the videoId filter that's the first page
+        return track_info.track_id in self.iter_video_ids_in_playlist(
             playlist=playlist, track_id=track_info.track_id)
 
-    def add_track_to_playlist(self, track_info, playlist):
+    def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
         client = self.get_wrapped_client()
 
-        if self.is_track_in_playlist(track_info=track_info, playlist=playlist):
+        if check_duplicates and self.is_track_in_playlist(track_info=track_info, playlist=playlist):
             return False, DUPLICATE_TRACK
 
         resource_body = {
@@ -372,11 +595,39 @@ class YoutubeService(ServiceBase):
 
         return True, None
 
+    def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
+        """
+        NOTE: playlistItems().insert only takes one video, so the savings here
+        come from doing a single duplicate scan for the whole batch
+        """
+        new_tracks, failures = self._partition_new_tracks(
+            track_infos=track_infos,
+            playlist=playlist,
+            check_duplicates=check_duplicates
+        )
+
+        successes = []
+        for track_info in new_tracks:
+            success, error_message = self.add_track_to_playlist(
+                track_info=track_info,
+                playlist=playlist,
+                check_duplicates=False
+            )
+            if success:
+                successes.append((track_info, None))
+            else:
+                failures.append((track_info, error_message))
+
+        return successes, failures
 
     def best_match(self, target_string, search_results, track_info=None):
+        set_scores = batch_scorer.score(
+            target_string,
+            [item['snippet']['title'] for item in search_results]
+        )[TOKEN_SET]
+
         best_result = (None, 0)
-        for item in search_results:
-            contender = fuzz.token_set_ratio(target_string, item['snippet']['title'])
+        for item, contender in zip(search_results, set_scores):
             if contender > best_result[1] and contender > YOUTUBE_TOKEN_SET_THRESHHOLD:
                 best_result = (item, contender)
 
@@ -387,7 +638,8 @@ class YoutubeService(ServiceBase):
             track_id=best_result[0]['id']['videoId'],
             name=best_result[0]['snippet']['title'],
             platform=Platform.YOUTUBE,
-            raw_json=best_result[0]['snippet']
+            raw_json=best_result[0]['snippet'],
+            match_score=best_result[1]
         )
 
     def fuzzy_search(self, track_name, artist=None):
@@ -403,11 +655,8 @@ class YoutubeService(ServiceBase):
             target_string += " %s" % artist
         target_string = target_string.strip()
 
-        try:
-            search_results = client.search().list(q=target_string, **search_kwargs).execute()
-        except Exception as e:
-            # TODO: better exception handling
-            return None
+        # errors are raised rather than returned as None, which would be cached as "no match"
+        search_results = client.search().list(q=target_string, **search_kwargs).execute()
 
         search_results = search_results.get('items', None)
         if not search_results:
@@ -434,19 +683,99 @@ class YoutubeService(ServiceBase):
 
         return playlists
 
+    def get_playlist_index(self):
+        """
+        {'channel_id', 'etag', 'paged', 'playlists': {title: playlist}} for the user's channel, or None
+        if they don't have one. A cached index that fit on one page costs one request, which the etag
+        lets youtube answer with a 304 when none of the user's playlists changed; a paged one is listed
+        again, so create_playlist checks its hits with get_playlist_title instead.
+        """
+        client = self.get_wrapped_client()
+
+        index = self.cached_playlist_index()
+        if index:
+            channel_id = index['channel_id']
+        else:
+            channels_response = client.channels().list(part='id', mine=True).execute()
+            if not channels_response or not channels_response.get('items'):
+                return None
+            channel_id = channels_response['items'][0]['id']
+
+        request = client.playlists().list(
+            part='snippet',
+            mine=True,
+            maxResults=YOUTUBE_PLAYLISTS_PER_PAGE,
+            fields=YOUTUBE_PLAYLIST_INDEX_FIELDS
+        )
+        if index and index.get('etag'):
+            request.headers['If-None-Match'] = index['etag']
+
+        try:
+            response = request.execute()
+        except HttpError as e:
+            if e.resp.status == HTTP_NOT_MODIFIED:
+                return index
+            raise
+
+        # list_next copies the request, headers included, and the etag only fits the first page
+        request.headers.pop('If-None-Match', None)
+
+        # a 304 for the first page says nothing about the rest, so longer indexes are always re-listed
+        paged = bool(response.get('nextPageToken'))
+        etag = response.get('etag') if not paged else None
+        playlists = {}
+        while True:
+            for pl in response.get('items', []):
+                playlists.setdefault(pl['snippet']['title'], pl)
+
+            request = client.playlists().list_next(request, response)
+            if not request:
+                break
+            response = request.execute()
+
+        index = {'channel_id': channel_id, 'etag': etag, 'paged': paged, 'playlists': playlists}
+        self.cache_playlist_index(index)
+
+        return index
+
+    def get_playlist_title(self, playlist_id):
+        """
+        The playlist's current title, or None if it's gone
+        """
+        response = self.get_wrapped_client().playlists().list(
+            part='snippet',
+            id=playlist_id,
+            fields=YOUTUBE_PLAYLIST_TITLE_FIELDS
+        ).execute()
+        items = response.get('items')
+        if not items:
+            return None
+
+        return items[0]['snippet']['title']
+
     def create_playlist(self, playlist_name):
         client = self.get_wrapped_client()
 
-        channels_response = client.channels().list(part='id', mine=True).execute()
-        if not channels_response or not channels_response.get('items'):
-            # TODO: figure out error handling
-            return False, "No channels"
+        index = self.cached_playlist_index()
+        if index and index.get('paged'):
+            # a paged index can't be revalidated in one request, but it was complete when it was built:
+            # one lookup checks a hit is still there under that name, and a miss is created right away
+            playlist = index['playlists'].get(playlist_name)
+            if playlist:
+                if self.get_playlist_title(playlist['id']) == playlist_name:
+                    return True, playlist
+                index = self.forget_cached_playlist(index, playlist_name)
+        else:
+            index = self.get_playlist_index()
+            if not index:
+                # TODO: figure out error handling
+                return False, "No channels"
 
-        channel_id = channels_response['items'][0]['id']
+            playlist = index['playlists'].get(playlist_name)
+            if playlist:
+                return True, playlist
 
-        for pl in self.list_playlists():
-            if pl['snippet']['title'] == playlist_name:
-                return True, pl
+        channel_id = index['channel_id']
 
         pl_body = {
             "status": {
@@ -466,12 +795,15 @@ class YoutubeService(ServiceBase):
         except Exception as e:
             return False, e
 
+        self.cache_new_playlist(index, playlist_name, {'id': pl_snippet['id'], 'snippet': {'title': playlist_name}})
+
         return True, pl_snippet
 
 
 class SpotifyService(ServiceBase):
     SCOPE = 'playlist-modify-private playlist-modify-public'
     NAME = 'Spotify'
+    PLATFORM = Platform.SPOTIFY
 
     def __init__(self, *args, **kwargs):
         user_info = kwargs.pop('user_info', None)
@@ -524,12 +856,15 @@ class SpotifyService(ServiceBase):
 
         return user_info
 
+    @classmethod
+    def track_id_from_link(cls, link):
+        return track_id_from_link(link, platform=Platform.SPOTIFY)
+
     def get_track_info_from_link(self, link):
-        track_id = None
-        if link.find('spotify:track') != -1:
-            track_id = link.split(':')[-1]
-        else:
-            track_id = link.split('/')[-1].split('?')[0]
+        track_id = self.track_id_from_link(link)
+        if not track_id:
+            # album, playlist or not a spotify link
+            return None
 
         client = self.get_wrapped_client()
 
@@ -565,13 +900,26 @@ class SpotifyService(ServiceBase):
 
         return track_ids
 
+    def get_playlist_snapshot_id(self, playlist):
+        client = self.get_wrapped_client()
+        resp = client.user_playlist(
+            user=self.get_user_info()['id'],
+            playlist_id=playlist.platform_id,
+            fields='snapshot_id'
+        )
+
+        snapshot_id = resp.get('snapshot_id')
+        self.snapshot_ids[playlist.platform_id] = snapshot_id
+
+        return snapshot_id
+
     def is_track_in_playlist(self, track_info, playlist):
         return track_info.track_id in self.get_track_ids_in_playlist(playlist=playlist)
 
-    def add_track_to_playlist(self, track_info, playlist):
+    def add_track_to_playlist(self, track_info, playlist, check_duplicates=True):
         client = self.get_wrapped_client()
 
-        if self.is_track_in_playlist(track_info=track_info, playlist=playlist):
+        if check_duplicates and self.is_track_in_playlist(track_info=track_info, playlist=playlist):
             return False, DUPLICATE_TRACK
 
         try:
@@ -589,8 +937,48 @@ class SpotifyService(ServiceBase):
         if not resp.get('snapshot_id'):
             return False, "Unable to add %s to %s" % (track_info.name, playlist.name)
 
+        self.snapshot_ids[playlist.platform_id] = resp['snapshot_id']
+
         return True, None
 
+    def add_tracks_to_playlist(self, track_infos, playlist, check_duplicates=True):
+        new_tracks, failures = self._partition_new_tracks(
+            track_infos=track_infos,
+            playlist=playlist,
+            check_duplicates=check_duplicates
+        )
+        if not new_tracks:
+            return [], failures
+
+        client = self.get_wrapped_client()
+        user_id = self.get_user_info()['id']
+
+        successes = []
+        for batch in chunks(new_tracks, SPOTIFY_MAX_TRACKS_PER_INSERT):
+            error_message = None
+            try:
+                resp = client.user_playlist_add_tracks(
+                    user=user_id,
+                    playlist_id=playlist.platform_id,
+                    tracks=[t.track_id for t in batch]
+                )
+                if resp.get('snapshot_id'):
+                    self.snapshot_ids[playlist.platform_id] = resp['snapshot_id']
+                else:
+                    error_message = "Unable to add tracks to %s" % playlist.name
+            except SpotifyException as e:
+                error_message = e.msg
+            except Exception as e:
+                logger.error("Failed to add tracks to Spotify playlist %s: %s" % (playlist.name, str(e)))
+                error_message = str(e)
+
+            if error_message:
+                failures.extend((t, error_message) for t in batch)
+            else:
+                successes.extend((t, None) for t in batch)
+
+        return successes, failures
+
     def search(self, track_name, artist=None):
         client = self.get_wrapped_client()
         search_kwargs = {
@@ -656,30 +1044,27 @@ class SpotifyService(ServiceBase):
 
         Check if the given name and artist combo at least form a set of the results
         """
+        candidates = [Candidate.from_spotify_item(item) for item in search_results]
+
+        set_scores = batch_scorer.score(
+            target_string.lower(),
+            [c.comparison_string() for c in candidates],
+            scorers=(TOKEN_SET, )
+        )[TOKEN_SET]
+
         contenders = []
         best_score_so_far = 0
-        for item in search_results:
-            contender_name = item['name']
-            contender_artist = " ".join(a['name'] for a in item['artists'])
-            contender_string = ("%s %s" % (contender_name, contender_artist)).lower()
-            # using set
-            contender_score = fuzz.token_set_ratio(target_string.lower(), contender_string)
-            if contender_score >= best_score_so_far and contender_score > SPOTIFY_TOKEN_SET_THRESHHOLD:
-                best_score_so_far = contender_score
-                contenders.append(item)
+        for candidate, set_score in zip(candidates, set_scores):
+            candidate.set_score = set_score
+            if set_score >= best_score_so_far and set_score > SPOTIFY_TOKEN_SET_THRESHHOLD:
+                best_score_so_far = set_score
+                contenders.append(candidate)
 
         if not contenders:
             return None
 
         if len(contenders) == 1:
-            winner = contenders[0]
-            return TrackInfo(
-                platform=Platform.SPOTIFY,
-                raw_json=winner,
-                name=winner['name'],
-                artists=[a['name'] for a in winner['artists']],
-                track_id=winner['id']
-            )
+            return self._track_info_from_candidate(contenders[0])
 
         """
         STAGE 2: token_sort_ratio
@@ -687,49 +1072,36 @@ class SpotifyService(ServiceBase):
         If multiple contenders pass the token_set_ratio criteria, try a token_sort_ratio.
         How many transformations are necessary to change the source string to the target string?
         """
+        # only the contenders, whose strings the set pass already processed
+        sort_scores = batch_scorer.score(
+            target_string.lower(),
+            [c.comparison_string() for c in contenders],
+            scorers=(TOKEN_SORT, )
+        )[TOKEN_SORT]
+        for contender, sort_score in zip(contenders, sort_scores):
+            contender.sort_score = sort_score
+
         best_sort_score_so_far = 0
         sort_contenders = []
         for contender in contenders:
-            contender_name = contender['name']
-            contender_artist = " ".join(a['name'] for a in contender['artists'])
-            contender_string = ("%s %s" % (contender_name, contender_artist)).lower()
-            # using sort
-            sort_score = fuzz.token_sort_ratio(target_string.lower(), contender_string)
-            if sort_score >= best_sort_score_so_far and sort_score > SPOTIFY_TOKEN_SORT_THRESHHOLD:
-                contender['sort_score'] = sort_score
-                best_sort_score_so_far = sort_score
+            if contender.sort_score >= best_sort_score_so_far and contender.sort_score > SPOTIFY_TOKEN_SORT_THRESHHOLD:
+                best_sort_score_so_far = contender.sort_score
                 sort_contenders.append(contender)
 
         # did any results pass the token sort threshold?
         if sort_contenders:
-            highest_sort_score = max(sort_contenders, key=lambda b: b['sort_score'])['sort_score']
-            best_contenders = [c for c in sort_contenders if c['sort_score'] >= highest_sort_score]
+            highest_sort_score = max(c.sort_score for c in sort_contenders)
+            best_contenders = [c for c in sort_contenders if c.sort_score >= highest_sort_score]
 
             if len(best_contenders) == 1:
-                winner = best_contenders[0]
-
-                return TrackInfo(
-                    platform=Platform.SPOTIFY,
-                    raw_json=winner,
-                    name=winner['name'],
-                    artists=[a['name'] for a in winner['artists']],
-                    track_id=winner['id']
-                )
+                return self._track_info_from_candidate(best_contenders[0])
         else:
             # if no tracks passed the token sort threshold, try with the token set contenders
             best_contenders = contenders
 
         # No track_info to inspect; return the most popular
         if not track_info:
-            winner = max(best_contenders, key=lambda sc: sc['popularity'])
-
-            return TrackInfo(
-                platform=Platform.SPOTIFY,
-                raw_json=winner,
-                name=winner['name'],
-                artists=[a['name'] for a in winner['artists']],
-                track_id=winner['id']
-            )
+            return self._track_info_from_candidate(max(best_contenders, key=lambda sc: sc.popularity))
 
         """
         STAGE 3:
@@ -739,8 +1111,8 @@ class SpotifyService(ServiceBase):
         for mentions of the artist name
         """
         best_results_with_artist = []
-        best_score_so_far_with_artist = 0
         original_description = track_info.description().lower()
+        original_channel_title = track_info.channel_title().lower()
         for contender in best_contenders:
             """
             if we're here, it means comparing search_string to the artists
@@ -753,42 +1125,37 @@ class SpotifyService(ServiceBase):
             3. if there's still a tie, take the most popular one
             """
             current_score = 0
-            for a in contender['artists']:
-                if a['name'].lower() in original_description:
+            for artist in contender.artists:
+                if artist.lower() in original_description:
                     current_score += 10
 
-                if a['name'].lower() in track_info.channel_title().lower():
+                if artist.lower() in original_channel_title:
                     current_score += 25
 
-            if current_score > 0 and current_score >= best_score_so_far_with_artist:
-                contender['with_artist_score'] = current_score
+            if current_score > 0:
+                contender.artist_score = current_score
                 best_results_with_artist.append(contender)
 
         if best_results_with_artist:
-            highest_best_result_with_artist_score = max(
-                best_results_with_artist,
-                key=lambda b: b['with_artist_score'])['with_artist_score']
+            highest_artist_score = max(c.artist_score for c in best_results_with_artist)
             winner = max(
-                [
-                    c for c in best_results_with_artist
-                    if c['with_artist_score'] >= highest_best_result_with_artist_score
-                ],
-                key=lambda bra: bra['popularity']
+                [c for c in best_results_with_artist if c.artist_score >= highest_artist_score],
+                key=lambda bra: bra.popularity
             )
         else:
             # Nothing worked; just take the most popular
-            winner = max(best_contenders, key=lambda bc: bc['popularity'])
+            winner = max(best_contenders, key=lambda bc: bc.popularity)
 
-        # Awkward. I guess everything is fucked
-        if not winner:
-            return None
+        return self._track_info_from_candidate(winner)
 
+    def _track_info_from_candidate(self, candidate):
         return TrackInfo(
-            raw_json=winner,
-            name=winner['name'],
-            artists=[a['name'] for a in winner['artists']],
-            track_id=winner['id'],
-            platform=Platform.SPOTIFY
+            platform=Platform.SPOTIFY,
+            image_url=candidate.image_url,
+            name=candidate.name,
+            artists=list(candidate.artists),
+            track_id=candidate.id,
+            match_score=candidate.set_score
         )
 
     def list_playlists(self):
@@ -807,22 +1174,66 @@ class SpotifyService(ServiceBase):
 
         return playlists
 
-    def create_playlist(self, playlist_name):
-        client = self.get_wrapped_client()
+    def get_playlist_index(self):
+        """
+        {'user_id', 'playlists': {name: {'id', 'name'}}}, or None without user info.
+        Spotify has no etag or snapshot id for the list of a user's playlists,
+        so create_playlist checks a cached hit with get_playlist_name before trusting it.
+        """
+        index = self.cached_playlist_index()
+        if index:
+            return index
 
         spotify_user_info = self.get_user_info()
         if not spotify_user_info:
-            return False, "Could not find info for this user"
+            return None
 
-        spotify_user_id = spotify_user_info['id']
+        playlists = {}
         for pl in self.list_playlists():
-            if pl['name'] == playlist_name:
-                return True, pl
+            playlists.setdefault(pl['name'], {'id': pl['id'], 'name': pl['name']})
+
+        index = {'user_id': spotify_user_info['id'], 'playlists': playlists}
+        self.cache_playlist_index(index)
+
+        return index
+
+    def get_playlist_name(self, user_id, playlist_id):
+        """
+        The playlist's current name, or None if it's gone (or couldn't be looked up)
+        """
+        try:
+            playlist = self.get_wrapped_client().user_playlist(user=user_id, playlist_id=playlist_id, fields='name')
+        except SpotifyException as e:
+            logger.error("Failed to look up playlist %s: %s" % (playlist_id, str(e)))
+            return None
+
+        return playlist.get('name') if playlist else None
+
+    def create_playlist(self, playlist_name):
+        client = self.get_wrapped_client()
+
+        index = self.cached_playlist_index()
+        playlist = index['playlists'].get(playlist_name) if index else None
+        if playlist:
+            if self.get_playlist_name(index['user_id'], playlist['id']) == playlist_name:
+                return True, playlist
+            # deleted or renamed since it was indexed; another may have that name now, so list them again
+            forget_playlist_index(platform=self.PLATFORM, owner_id=self.owner_id)
+
+        index = self.get_playlist_index()
+        if not index:
+            return False, "Could not find info for this user"
+
+        playlist = index['playlists'].get(playlist_name)
+        if playlist:
+            return True, playlist
 
         try:
-            playlist = client.user_playlist_create(user=spotify_user_id, name=playlist_name)
+            playlist = client.user_playlist_create(user=index['user_id'], name=playlist_name)
         except Exception as e:
             logger.error(e)
             return False, "Failed to create playlist"
 
+        self.cache_new_playlist(index, playlist_name, {'id': playlist['id'], 'name': playlist_name})
+
         return True, playlist
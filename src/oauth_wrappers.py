@@ -4,37 +4,96 @@ import time
 from spotipy import oauth2
 
 from .constants import Platform
-from .models import User
+from .models import Credential
+from .tokens import SingleFlightRefresher, token_identity
 
 from settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_REDIRECT_URI
 
+# tokens this close to expiring are refreshed before they're used
+SPOTIFY_TOKEN_EXPIRY_MARGIN = 60
+
+# one refresh per token at a time across every worker; the others pick up its result.
+# only shared_spotify_token()s are cached, so refresh tokens stay out of redis
+spotify_tokens = SingleFlightRefresher(
+    namespace='spotify',
+    expires_at=lambda token_info: token_info['expires_at']
+)
+
+
+def spotify_token_key(credentials):
+    return token_identity(credentials['refresh_token'])
+
+
+def shared_spotify_token(credentials):
+    return {'access_token': credentials['access_token'], 'expires_at': credentials['expires_at']}
+
+
+def refresh_spotify_credentials(credentials):
+    """
+    Gets a new access token for credentials and saves it to the user's credential row
+    """
+    spotify_oauth = SpotipyDBWrapper(
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        redirect_uri=SPOTIFY_REDIRECT_URI
+    )
+    refresh_credentials = spotify_oauth.refresh_access_token(credentials['refresh_token'])
+
+    new_credentials = dict(credentials)
+    new_credentials.update(refresh_credentials)
+
+    slack_id, _ = credentials['userdata'].split(':')
+    creds = Credential.for_slack_user(slack_id=slack_id, platform=Platform.SPOTIFY)
+    if creds:
+        creds.credentials = json.dumps(new_credentials)
+        creds.save()
+
+    return new_credentials
+
+
+def check_spotify_credentials(credentials, margin=SPOTIFY_TOKEN_EXPIRY_MARGIN):
+    """
+    Returns (credentials with a token good for at least margin more seconds, whether this worker
+    refreshed it). A token another worker already refreshed is adopted rather than refreshed again.
+    """
+    # the hot path: the token in hand is good
+    if credentials['expires_at'] - time.time() >= margin:
+        return credentials, False
+
+    refreshed = {}
+
+    def refresh(token):
+        refreshed.update(refresh_spotify_credentials(credentials))
+        return shared_spotify_token(refreshed)
+
+    token = spotify_tokens.fresh(
+        key=spotify_token_key(credentials),
+        token=shared_spotify_token(credentials),
+        refresh=refresh,
+        margin=margin
+    )
+
+    # ours if this worker refreshed, which may have brought a new refresh token too
+    new_credentials = dict(refreshed or credentials)
+    new_credentials.update(token)
+
+    return new_credentials, bool(refreshed)
+
+
+def fresh_spotify_credentials(credentials, margin=SPOTIFY_TOKEN_EXPIRY_MARGIN):
+    new_credentials, _ = check_spotify_credentials(credentials, margin=margin)
+
+    return new_credentials
+
 
 class SpotipyClientCredentialsManager():
 
     def __init__(self, credentials):
         self.credentials = credentials
 
-    # shamelessly copy/pasted from spotipy.oauth2.SpotifyClientCredentials
-    def _is_token_expired(self, token_info):
-        now = int(time.time())
-        return token_info['expires_at'] - now < 60
-
     def get_access_token(self):
-        if self._is_token_expired(self.credentials):
-            spotify_oauth = SpotipyDBWrapper(
-                client_id=SPOTIFY_CLIENT_ID,
-                client_secret=SPOTIFY_CLIENT_SECRET,
-                redirect_uri=SPOTIFY_REDIRECT_URI
-            )
-            refresh_credentials = spotify_oauth.refresh_access_token(self.credentials['refresh_token'])
-            slack_id, slack_user_name = self.credentials['userdata'].split(':')
-            user = User.query.filter_by(slack_id=slack_id).first()
-            creds = [creds for creds in user.credentials if creds.platform is Platform.SPOTIFY][0]
-            old_creds = creds.to_oauth2_creds()
-            old_creds.update(refresh_credentials)
-            creds.credentials = json.dumps(old_creds)
-            creds.save()
-            self.credentials = old_creds
+        # some other worker has usually refreshed it already, if the beat task hasn't
+        self.credentials = fresh_spotify_credentials(self.credentials)
 
         return self.credentials['access_token']
 
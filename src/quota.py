@@ -0,0 +1,191 @@
+import datetime
+import json
+import threading
+
+import redis
+from apiclient.errors import HttpError
+
+from settings import YOUTUBE_DAILY_QUOTA
+from .cache import RedisTier
+
+# youtube data api unit costs by (resource, method); anything not listed costs 1
+YOUTUBE_QUOTA_COSTS = {
+    ('search', 'list'): 100,
+    ('playlistItems', 'insert'): 50,
+    ('playlists', 'insert'): 50,
+}
+DEFAULT_QUOTA_COST = 1
+YOUTUBE_SEARCH_COST = YOUTUBE_QUOTA_COSTS[('search', 'list')]
+# searches stop when this much of the day's quota is left, so adding tracks to playlists still works
+YOUTUBE_SEARCH_RESERVE = YOUTUBE_DAILY_QUOTA // 5
+
+# youtube quotas reset at midnight pacific. Pacific standard time, so during
+# daylight time our day rolls over an hour after google's rather than before it
+QUOTA_DAY_TZ = datetime.timezone(datetime.timedelta(hours=-8))
+QUOTA_KEY_TTL = int(datetime.timedelta(days=2).total_seconds())
+
+
+class QuotaExhaustedError(Exception):
+    pass
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class QuotaAccountant(RedisTier):
+    """
+    Keeps count of the api units spent today, in redis so every worker shares
+    one count. While redis is down each process counts for itself.
+    """
+
+    def __init__(self, namespace, daily_budget, use_redis=True, clock=utcnow):
+        super(QuotaAccountant, self).__init__(namespace=namespace, ttl=QUOTA_KEY_TTL, use_redis=use_redis)
+        self.daily_budget = daily_budget
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.local_day = None
+        self.local_used = 0
+
+    def day(self):
+        return self.clock().astimezone(QUOTA_DAY_TZ).strftime('%Y-%m-%d')
+
+    def seconds_until_reset(self):
+        now = self.clock().astimezone(QUOTA_DAY_TZ)
+        tomorrow = (now + datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return int((tomorrow - now).total_seconds()) + 1
+
+    def _local_charge(self, day, units):
+        with self.lock:
+            if self.local_day != day:
+                self.local_day = day
+                self.local_used = 0
+            self.local_used += units
+
+            return self.local_used
+
+    def charge(self, units):
+        day = self.day()
+        used = self._local_charge(day, units)
+
+        client = self._redis()
+        if not client:
+            return used
+
+        try:
+            pipe = client.pipeline()
+            pipe.incrby(self._redis_key(day), units)
+            pipe.expire(self._redis_key(day), self.ttl)
+            used, _ = pipe.execute()
+        except redis.RedisError as e:
+            self._redis_failed(e)
+
+        return used
+
+    def used(self):
+        day = self.day()
+        client = self._redis()
+        if client:
+            try:
+                return int(client.get(self._redis_key(day)) or 0)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+        with self.lock:
+            return self.local_used if self.local_day == day else 0
+
+    def remaining(self):
+        return max(0, self.daily_budget - self.used())
+
+    def exhaust(self):
+        """
+        The platform says we're out of quota, whatever our count says
+        """
+        self.charge(self.remaining())
+
+    def calls_left(self, cost, reserve=0):
+        """
+        How many calls costing cost units fit in today's quota without dipping into reserve
+        """
+        return max(0, (self.remaining() - reserve) // cost)
+
+
+def is_quota_exceeded(error):
+    if not isinstance(error, HttpError) or error.resp.status != 403:
+        return False
+
+    try:
+        errors = json.loads(error.content.decode('utf-8'))['error']['errors']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+    return any(e.get('reason') in ('quotaExceeded', 'dailyLimitExceeded') for e in errors)
+
+
+class QuotaClient():
+    """
+    Wraps a youtube discovery client so every request charges its unit cost
+    to the accountant when it's executed
+    """
+
+    def __init__(self, client, accountant):
+        self._client = client
+        self._accountant = accountant
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def resource(*args, **kwargs):
+            return QuotaResource(name, attr(*args, **kwargs), self._accountant)
+
+        return resource
+
+
+class QuotaResource():
+    def __init__(self, name, resource, accountant):
+        self._name = name
+        self._resource = resource
+        self._accountant = accountant
+
+    def __getattr__(self, method):
+        attr = getattr(self._resource, method)
+        # list_next builds another list request
+        cost = YOUTUBE_QUOTA_COSTS.get((self._name, method.replace('_next', '')), DEFAULT_QUOTA_COST)
+
+        def build_request(*args, **kwargs):
+            args = [a._request if isinstance(a, QuotaRequest) else a for a in args]
+            kwargs = {k: v._request if isinstance(v, QuotaRequest) else v for k, v in kwargs.items()}
+
+            request = attr(*args, **kwargs)
+            if request is None:
+                return None
+
+            return QuotaRequest(request, cost, self._accountant)
+
+        return build_request
+
+
+class QuotaRequest():
+    def __init__(self, request, cost, accountant):
+        self._request = request
+        self._cost = cost
+        self._accountant = accountant
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+    def execute(self, *args, **kwargs):
+        # youtube charges for failed requests too
+        self._accountant.charge(self._cost)
+        try:
+            return self._request.execute(*args, **kwargs)
+        except HttpError as e:
+            if is_quota_exceeded(e):
+                self._accountant.exhaust()
+                raise QuotaExhaustedError(str(e))
+            raise
+
+
+youtube_quota = QuotaAccountant(namespace='youtube-quota', daily_budget=YOUTUBE_DAILY_QUOTA)
@@ -0,0 +1,80 @@
+import re
+import threading
+
+from cachetools import LRUCache
+
+from .constants import BAD_WORDS
+
+# sanitized titles kept per process, keyed by the raw title
+SANITIZED_TITLE_CACHE_SIZE = 4096
+
+# applied in this order; none of them cross a line so a batch can be sanitized as one string
+PUNCTUATION_RE = re.compile(r"[|&'_-]")
+PARENS_RE = re.compile(r'\([^)\n]*\)')
+BRACKETS_RE = re.compile(r'\[[^]\n]*\]')
+BAD_WORDS_RE = re.compile(
+    r"\b(?:%s)\b" % "|".join(
+        # longest first so e.g. Lyrics wins over Lyric
+        re.escape(word) for word in sorted(BAD_WORDS, key=len, reverse=True)
+    ),
+    re.IGNORECASE
+)
+
+_cache = LRUCache(maxsize=SANITIZED_TITLE_CACHE_SIZE)
+_cache_lock = threading.Lock()
+
+
+def _strip_punctuation(text):
+    text = PUNCTUATION_RE.sub('', text)
+    text = PARENS_RE.sub('', text)
+    return BRACKETS_RE.sub('', text)
+
+
+def _sanitize(title):
+    # take out multiple spaces
+    title = ' '.join(_strip_punctuation(title).split())
+    return BAD_WORDS_RE.sub('', title)
+
+
+def sanitize_title(title):
+    """
+    Strips punctuation, anything in parens or brackets and BAD_WORDS from a track title
+    """
+    with _cache_lock:
+        sanitized = _cache.get(title)
+    if sanitized is not None:
+        return sanitized
+
+    sanitized = _sanitize(title)
+    with _cache_lock:
+        _cache[title] = sanitized
+
+    return sanitized
+
+
+def sanitize_titles(titles):
+    """
+    Batch version of sanitize_title.
+    Titles that aren't cached yet are joined and run through each pattern once.
+    Results are in the same order as titles.
+    """
+    with _cache_lock:
+        missing = list(dict.fromkeys(
+            t for t in titles if t not in _cache and '\n' not in t
+        ))
+
+    if missing:
+        text = _strip_punctuation('\n'.join(missing))
+        text = '\n'.join(' '.join(line.split()) for line in text.split('\n'))
+        sanitized = BAD_WORDS_RE.sub('', text).split('\n')
+
+        with _cache_lock:
+            for title, result in zip(missing, sanitized):
+                _cache[title] = result
+
+    return [sanitize_title(t) for t in titles]
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,150 @@
+import threading
+
+from cachetools import LRUCache
+from fuzzywuzzy import fuzz, utils
+
+# processed strings kept per process, keyed by the raw string
+PROCESSED_STRING_CACHE_SIZE = 4096
+
+TOKEN_SET = 'token_set'
+TOKEN_SORT = 'token_sort'
+
+
+class ProcessedString(object):
+    """
+    A string run through fuzzywuzzy's full_process and tokenized, once
+    """
+    __slots__ = ('processed', 'tokens', 'sorted_tokens')
+
+    def __init__(self, string):
+        self.processed = utils.full_process(string, force_ascii=True)
+        self.tokens = set(self.processed.split())
+        self.sorted_tokens = " ".join(sorted(self.processed.split())).strip()
+
+
+def token_set_ratio(p1, p2):
+    """
+    fuzz.token_set_ratio for two ProcessedStrings
+    """
+    if not p1.processed or not p2.processed:
+        return 0
+
+    intersection = p1.tokens & p2.tokens
+    sorted_sect = " ".join(sorted(intersection))
+    combined_1to2 = (sorted_sect + " " + " ".join(sorted(p1.tokens - intersection))).strip()
+    combined_2to1 = (sorted_sect + " " + " ".join(sorted(p2.tokens - intersection))).strip()
+    sorted_sect = sorted_sect.strip()
+
+    return max(
+        fuzz.ratio(sorted_sect, combined_1to2),
+        fuzz.ratio(sorted_sect, combined_2to1),
+        fuzz.ratio(combined_1to2, combined_2to1)
+    )
+
+
+def token_sort_ratio(p1, p2):
+    """
+    fuzz.token_sort_ratio for two ProcessedStrings
+    """
+    return fuzz.ratio(p1.sorted_tokens, p2.sorted_tokens)
+
+
+SCORERS = {
+    TOKEN_SET: token_set_ratio,
+    TOKEN_SORT: token_sort_ratio,
+}
+
+
+class Candidate(object):
+    """
+    The parts of a Spotify search result that best_match needs, plus its scores,
+    so the result dicts themselves are never written to or held onto
+    """
+    __slots__ = (
+        'id',
+        'name',
+        'artists',
+        'popularity',
+        'image_url',
+        'set_score',
+        'sort_score',
+        'artist_score',
+    )
+
+    def __init__(self, id, name, artists, popularity=0, image_url=None):
+        self.id = id
+        self.name = name
+        self.artists = tuple(artists)
+        self.popularity = popularity
+        self.image_url = image_url
+        self.set_score = None
+        self.sort_score = None
+        self.artist_score = None
+
+    @classmethod
+    def from_spotify_item(cls, item):
+        images = item.get('album', {}).get('images')
+        return cls(
+            id=item['id'],
+            name=item['name'],
+            artists=[a['name'] for a in item['artists']],
+            popularity=item.get('popularity', 0),
+            image_url=min(images, key=lambda im: im.get('height') or 0).get('url') if images else None
+        )
+
+    def comparison_string(self):
+        return ("%s %s" % (self.name, " ".join(self.artists))).lower()
+
+
+class BatchScorer(object):
+    """
+    Scores every query against every choice, like rapidfuzz's cdist.
+    Each string is processed and tokenized once no matter how many times
+    (or by how many scorers) it's compared.
+    """
+    def __init__(self, maxsize=PROCESSED_STRING_CACHE_SIZE):
+        self._processed = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def process(self, string):
+        with self._lock:
+            processed = self._processed.get(string)
+        if processed is not None:
+            return processed
+
+        processed = ProcessedString(string)
+        with self._lock:
+            self._processed[string] = processed
+
+        return processed
+
+    def cdist(self, queries, choices, scorers=(TOKEN_SET, )):
+        """
+        Returns {scorer: matrix} where matrix[i][j] is the score of queries[i] against choices[j]
+        """
+        processed_queries = [self.process(q) for q in queries]
+        processed_choices = [self.process(c) for c in choices]
+
+        return {
+            scorer: [
+                [SCORERS[scorer](q, c) for c in processed_choices]
+                for q in processed_queries
+            ]
+            for scorer in scorers
+        }
+
+    def score(self, query, choices, scorers=(TOKEN_SET, )):
+        """
+        cdist for a single query; returns {scorer: [score per choice]}
+        """
+        return {
+            scorer: matrix[0]
+            for scorer, matrix in self.cdist([query], choices, scorers=scorers).items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self._processed.clear()
+
+
+batch_scorer = BatchScorer()
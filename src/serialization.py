@@ -0,0 +1,97 @@
+import msgpack
+from kombu.serialization import register
+
+from app import logger
+from .constants import Platform
+from .music_services import TrackInfo
+
+SERIALIZER = 'slacktunes-msgpack'
+CONTENT_TYPE = 'application/x-slacktunes-msgpack'
+
+# msgpack ext type codes
+TRACK_INFO_EXT = 1
+TRACK_INFO_REF_EXT = 2
+
+
+class TrackInfoRef():
+    """
+    Stands in for a TrackInfo in a task payload when only its platform and track id
+    are sent; the task looks the rest up in the track info cache (or the platform).
+    """
+    __slots__ = ('platform', 'track_id')
+
+    def __init__(self, platform, track_id):
+        if isinstance(platform, Platform):
+            self.platform = platform
+        else:
+            self.platform = Platform.from_string(platform)
+        self.track_id = track_id
+
+    @classmethod
+    def from_track_info(cls, track_info):
+        return cls(platform=track_info.platform, track_id=track_info.track_id)
+
+    def link(self):
+        return TrackInfo(name=None, platform=self.platform, track_id=self.track_id).track_open_url()
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, TrackInfoRef)
+            and (self.platform, self.track_id) == (other.platform, other.track_id)
+        )
+
+    def __hash__(self):
+        return hash((self.platform, self.track_id))
+
+
+def _default(obj):
+    if isinstance(obj, TrackInfo):
+        return msgpack.ExtType(TRACK_INFO_EXT, _packb(obj.to_wire()))
+
+    if isinstance(obj, TrackInfoRef):
+        return msgpack.ExtType(TRACK_INFO_REF_EXT, _packb([obj.platform.name, obj.track_id]))
+
+    raise TypeError("Can't serialize %r" % (obj, ))
+
+
+def _ext_hook(code, data):
+    if code == TRACK_INFO_EXT:
+        return TrackInfo.from_wire(_unpackb(data))
+
+    if code == TRACK_INFO_REF_EXT:
+        platform, track_id = _unpackb(data)
+        return TrackInfoRef(platform=platform, track_id=track_id)
+
+    return msgpack.ExtType(code, data)
+
+
+def _packb(obj):
+    return msgpack.packb(obj, use_bin_type=True, default=_default)
+
+
+def _unpackb(data):
+    return msgpack.unpackb(data, raw=False, ext_hook=_ext_hook)
+
+
+def dumps(obj):
+    return _packb(obj)
+
+
+def loads(data):
+    return _unpackb(data)
+
+
+def msgpack_is_compiled():
+    """
+    False when msgpack fell back to its pure python implementation, which makes task
+    payloads about 3x slower to round trip than json. The pinned msgpack has a compiled
+    wheel for the docker image's python (3.7); elsewhere install one that does.
+    """
+    return msgpack.Packer.__module__ != 'msgpack.fallback'
+
+
+def register_serializer():
+    if not msgpack_is_compiled():
+        logger.warning("msgpack C extension not available, task payloads will (de)serialize slowly")
+
+    register(SERIALIZER, dumps, loads, content_type=CONTENT_TYPE, content_encoding='binary')
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import redis
+from sqlalchemy import event
+
+from .cache import RedisTier
+from .models import Credential, User
+from .music_services import ServiceFactory
+from .tokens import adopt_shared_token
+
+
+# how often a worker checks whether another process invalidated the registry
+REGISTRY_CHECK_INTERVAL = 5
+
+
+class SharedGeneration(RedisTier):
+    """
+    A counter in redis that any process bumps to tell the others their copies are stale.
+    Read at most once every check_interval seconds; None while redis is down.
+    """
+
+    def __init__(self, namespace, check_interval=REGISTRY_CHECK_INTERVAL, use_redis=True, clock=time.monotonic):
+        super(SharedGeneration, self).__init__(namespace=namespace, ttl=None, use_redis=use_redis)
+        self.check_interval = check_interval
+        self.clock = clock
+        self.value = None
+        self.check_at = 0
+
+    def get(self):
+        if self.clock() < self.check_at:
+            return self.value
+
+        client = self._redis()
+        if not client:
+            return None
+
+        try:
+            raw_value = client.get(self._redis_key('generation'))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return None
+
+        self.value = int(raw_value or 0)
+        self.check_at = self.clock() + self.check_interval
+        return self.value
+
+    def bump(self):
+        client = self._redis()
+        if not client:
+            return None
+
+        try:
+            self.value = client.incrby(self._redis_key('generation'), 1)
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return None
+
+        self.check_at = self.clock() + self.check_interval
+        return self.value
+
+
+class ServiceUserRegistry():
+    """
+    Per-worker cache of the service user's parsed credentials and the services built from them.
+    Credentials are loaded once per process; services are built once per thread because
+    the http clients underneath them aren't thread safe.
+    Saving any of the service user's credentials invalidates everything, in this process
+    right away and in the others through shared_generation within REGISTRY_CHECK_INTERVAL.
+    """
+
+    def __init__(self, shared_generation=None):
+        # reentrant because saving a credential during a load would invalidate
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.generation = 0
+        self.user_id = None
+        self.credentials_by_platform = None
+        self.shared_generation = shared_generation or SharedGeneration(namespace='service_user_registry')
+        self.shared_generation_seen = None
+
+    def check_shared_generation(self):
+        shared = self.shared_generation.get()
+        if shared is None or shared == self.shared_generation_seen:
+            return
+
+        if self.shared_generation_seen is not None:
+            # the credentials were saved in another process
+            self.drop()
+        self.shared_generation_seen = shared
+
+    def load(self):
+        with self.lock:
+            self.check_shared_generation()
+            if self.credentials_by_platform is None:
+                slacktunes_user = User.query.filter_by(is_service_user=True).first()
+                self.user_id = slacktunes_user.id
+                self.credentials_by_platform = {
+                    c.platform: c.to_oauth2_creds()
+                    for c in slacktunes_user.credentials
+                }
+
+            return self.generation, self.credentials_by_platform
+
+    def get_credentials(self, platform):
+        _, credentials_by_platform = self.load()
+        return credentials_by_platform.get(platform)
+
+    def get_service(self, platform):
+        generation, credentials_by_platform = self.load()
+
+        if getattr(self.local, 'generation', None) != generation:
+            self.local.generation = generation
+            self.local.services = {}
+
+        credentials = credentials_by_platform.get(platform)
+        if credentials is not None:
+            # these live as long as the worker; another one may have refreshed the token since
+            adopt_shared_token(credentials)
+
+        service = self.local.services.get(platform)
+        if not service:
+            service = ServiceFactory.from_enum(platform)(credentials=credentials)
+            self.local.services[platform] = service
+
+        return service
+
+    def drop(self):
+        self.generation += 1
+        self.user_id = None
+        self.credentials_by_platform = None
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            # a process that hasn't loaded the service user can't tell, so it invalidates everyone
+            if user_id is not None and self.user_id is not None and user_id != self.user_id:
+                return
+
+            self.drop()
+            shared = self.shared_generation.bump()
+            if shared is not None:
+                self.shared_generation_seen = shared
+
+
+service_user_registry = ServiceUserRegistry()
+
+
+@event.listens_for(Credential, 'after_insert')
+@event.listens_for(Credential, 'after_update')
+def invalidate_service_user_registry(mapper, connection, credential):
+    service_user_registry.invalidate(user_id=credential.user_id)
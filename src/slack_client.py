@@ -0,0 +1,222 @@
+import threading
+import time
+
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import logger
+from settings import SLACK_OAUTH_TOKEN
+from .cache import RedisTier
+from .constants import SlackUrl
+from .metrics import LatencyRecorder
+
+SLACK_TIMEOUT = 10
+SLACK_POOL_SIZE = 10
+# retries after a 429 before giving up
+SLACK_MAX_RETRIES = 3
+# chat.postMessage allows about one message per second per channel
+CHANNEL_POST_INTERVAL = 1.0
+# how long a post waits on other workers' posts to its channel before going ahead anyway
+CHANNEL_WAIT_TIMEOUT = 30
+
+
+class ChannelSlots(RedisTier):
+    """
+    When each channel may next be posted to, shared by every worker: a key per channel,
+    SET NX with a PX timeout, is held by whoever posts until the channel is free again.
+    While redis is down reserve() returns None, and spacing is only kept within each process.
+    """
+
+    def __init__(self, namespace, interval=CHANNEL_POST_INTERVAL, use_redis=True):
+        super(ChannelSlots, self).__init__(namespace=namespace, ttl=interval, use_redis=use_redis)
+
+    def reserve(self, channel):
+        """
+        Claims the channel for the next interval. Returns 0 if we have it, the seconds
+        until another worker's claim runs out if they do, or None without redis
+        """
+        client = self._redis()
+        if not client:
+            return None
+
+        key = self._redis_key(channel)
+        try:
+            if client.set(key, '1', px=int(self.ttl * 1000), nx=True):
+                return 0
+            # -2 if it ran out since the SET, -1 if it somehow has no timeout
+            wait_ms = client.pttl(key)
+            if wait_ms == -1:
+                client.pexpire(key, int(self.ttl * 1000))
+                wait_ms = self.ttl * 1000
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return None
+
+        return max(wait_ms, 1) / 1000.0
+
+    def hold(self, channel, seconds):
+        """
+        Keeps every worker off the channel for seconds, e.g. a 429's Retry-After
+        """
+        client = self._redis()
+        if not client:
+            return
+
+        try:
+            client.set(self._redis_key(channel), '1', px=int(seconds * 1000))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+
+
+class SlackClient():
+    """
+    Talks to the Slack Web API over one pooled keep-alive session.
+    Posts to the same channel are queued behind each other and spaced out by
+    CHANNEL_POST_INTERVAL, and a 429's Retry-After holds back the channel
+    (or the whole request, for calls that aren't to a channel) before retrying.
+    Channel spacing and back-off are shared across workers through channel_slots,
+    and kept per process while redis is down.
+    """
+
+    def __init__(self, token=SLACK_OAUTH_TOKEN, session=None, clock=time.monotonic, sleep=time.sleep,
+                 channel_slots=None):
+        self.token = token
+        self.clock = clock
+        self.sleep = sleep
+        self.adapter = None
+        self.session = session or self._make_session()
+
+        self.lock = threading.Lock()
+        self.channel_locks = {}
+        self.next_post_at = {}
+        self.channel_slots = channel_slots or ChannelSlots(namespace='slack_channel')
+
+        self.latency = LatencyRecorder()
+        self.rate_limited = 0
+
+    def _make_session(self):
+        session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=SLACK_POOL_SIZE, pool_maxsize=SLACK_POOL_SIZE)
+        session.mount('https://', self.adapter)
+        return session
+
+    def _channel_lock(self, channel):
+        with self.lock:
+            if channel not in self.channel_locks:
+                self.channel_locks[channel] = threading.Lock()
+            return self.channel_locks[channel]
+
+    def _wait_for_channel(self, channel):
+        give_up_at = self.clock() + CHANNEL_WAIT_TIMEOUT
+        while True:
+            wait = self.channel_slots.reserve(channel)
+            if wait is None:
+                # no redis; only this process's posts are spaced out
+                wait = self.next_post_at.get(channel, 0) - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+                return
+
+            if not wait:
+                return
+
+            if self.clock() + wait > give_up_at:
+                logger.error("Gave up waiting on other workers to post to %s" % channel)
+                return
+
+            self.sleep(wait)
+
+    def _send(self, method, url, headers=None, auth=True, **kwargs):
+        headers = dict(headers or {})
+        if auth:
+            headers.setdefault("Authorization", "Bearer %s" % self.token)
+
+        started = self.clock()
+        res = self.session.request(method, url, headers=headers, timeout=SLACK_TIMEOUT, **kwargs)
+        self.latency.record(self.clock() - started)
+
+        return res
+
+    def request(self, method, url, channel=None, **kwargs):
+        if not channel:
+            return self._request_with_retries(method, url, channel=None, **kwargs)
+
+        with self._channel_lock(channel):
+            return self._request_with_retries(method, url, channel=channel, **kwargs)
+
+    def _request_with_retries(self, method, url, channel, **kwargs):
+        for attempt in range(SLACK_MAX_RETRIES + 1):
+            if channel:
+                self._wait_for_channel(channel)
+
+            res = self._send(method, url, **kwargs)
+            if channel:
+                self.next_post_at[channel] = self.clock() + CHANNEL_POST_INTERVAL
+
+            if res.status_code != 429:
+                return res
+
+            self.rate_limited += 1
+            retry_after = float(res.headers.get('Retry-After', 1))
+            logger.info("Slack rate limited %s, retrying in %ss" % (url, retry_after))
+            if attempt == SLACK_MAX_RETRIES:
+                break
+
+            if channel:
+                self.next_post_at[channel] = self.clock() + retry_after
+                self.channel_slots.hold(channel, retry_after)
+            else:
+                self.sleep(retry_after)
+
+        return res
+
+    def post_message(self, payload):
+        return self.request(
+            'POST',
+            SlackUrl.POST_MESSAGE.value,
+            channel=payload.get('channel'),
+            json=payload,
+            headers={"Content-type": "application/json"}
+        )
+
+    def respond(self, response_url, text):
+        """
+        Replies to a slash command through its response_url, which takes
+        no token and accepts up to five replies within 30 minutes
+        """
+        return self.request(
+            'POST',
+            response_url,
+            json={'response_type': 'ephemeral', 'text': text},
+            headers={"Content-type": "application/json"},
+            auth=False
+        )
+
+    def get_channel_history(self, channel, latest=None, count=200):
+        params = {'channel': channel, 'count': count}
+        if latest:
+            params['latest'] = latest
+
+        return self.request('GET', SlackUrl.CHANNEL_HISTORY.value, params=params).json()
+
+    def connection_count(self):
+        """
+        Number of connections opened by the session's pools so far
+        """
+        if not self.adapter:
+            return 0
+
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def metrics(self):
+        metrics = self.latency.summary()
+        metrics.update({
+            'connections': self.connection_count(),
+            'rate_limited': self.rate_limited,
+        })
+        return metrics
+
+
+slack_client = SlackClient()
@@ -1,46 +1,236 @@
-import copy
+import datetime
+import json
+import time
 
 import celery
+import httplib2
+from celery.signals import task_postrun
 
+from app import logger
+from settings import REDIS_URL, TASK_TRACK_INFO_REFERENCES
 from src.constants import Platform
-from src.models import Playlist
+from src.links import link_platform
+from src.metrics import LatencyRecorders
+from src.models import (
+    PLAYLIST_INDEX_RECONCILE_INTERVAL,
+    ChannelBackfill,
+    Credential,
+    DeferredSearch,
+    Playlist,
+    User
+)
 from src.message_formatters import SlackMessageFormatter
-from src.music_services import TrackInfo
+from src.music_services import ServiceFactory, TrackInfo, playlist_index_cache
+from src.oauth_wrappers import check_spotify_credentials
+from src.quota import QuotaExhaustedError, youtube_quota
+from src.sanitizer import sanitize_titles
+from src.serialization import SERIALIZER, TrackInfoRef, register_serializer
+from src.slack_client import slack_client
+from src.tokens import utc_timestamp
 from src.utils import (
     add_track_to_playlists,
+    add_tracks_to_playlists,
+    cross_platform_for,
+    extract_links_from_message,
     fuzzy_search_from_string,
     fuzzy_search_from_track_info,
-    get_track_info_from_link
+    get_service_user_service,
+    get_track_info_from_link,
+    get_track_infos_from_links,
+    reconcile_playlist_index,
+    resolve_links,
+    search_cross_platform,
+    searches_left,
+    track_info_cache
 )
 
-app = celery.Celery('tasks', broker="redis://redisbroker:6379/0")
+# channels.history messages fetched per backfill task
+BACKFILL_PAGE_SIZE = 200
+# searches deferred for quota wait in the db rather than as countdown tasks, which redis
+# would redeliver after its visibility timeout; once the quota resets they're queued
+# at most this many every interval, so they don't all land at once
+DEFERRED_SEARCH_INTERVAL = 60 * 5
+DEFERRED_SEARCHES_PER_RUN = 50
+
+# spotify and youtube tokens last an hour; the beat tasks refresh any with less than the margin
+# left, often enough that none get near expiring while a task is using them
+TOKEN_REFRESH_INTERVAL = 60 * 5
+PROACTIVE_REFRESH_MARGIN = 60 * 15
+
+# seconds from a slash command reaching the view to its reply going out, per command
+command_latency = LatencyRecorders()
+
+# the client and cache metrics are per worker process, so each logs its own after a task
+# once this many seconds have passed since it last did
+METRICS_LOG_INTERVAL = 60 * 15
+metrics_logged_at = time.monotonic()
+
+register_serializer()
+
+app = celery.Celery('tasks', broker=REDIS_URL)
+# smaller payloads than json, at about the same speed only with msgpack's C extension;
+# see serialization.msgpack_is_compiled
+app.conf.task_serializer = SERIALIZER
+# json for tasks queued before the msgpack serializer
+app.conf.accept_content = [SERIALIZER, 'json']
+app.conf.beat_schedule = {
+    'reconcile-playlist-indexes': {
+        'task': 'src.tasks.reconcile_playlist_indexes',
+        'schedule': PLAYLIST_INDEX_RECONCILE_INTERVAL.total_seconds() / 4,
+    },
+    'refresh-spotify-tokens': {
+        'task': 'src.tasks.refresh_spotify_tokens',
+        'schedule': TOKEN_REFRESH_INTERVAL,
+    },
+    'refresh-youtube-tokens': {
+        'task': 'src.tasks.refresh_youtube_tokens',
+        'schedule': TOKEN_REFRESH_INTERVAL,
+    },
+    'run-deferred-searches': {
+        'task': 'src.tasks.run_deferred_searches',
+        'schedule': DEFERRED_SEARCH_INTERVAL,
+    },
+}
+
+
+def log_metrics():
+    slack = slack_client.metrics()
+    logger.info("Slack client: %s requests (p50 %.2fs, p99 %.2fs), %s connections, %s rate limited" % (
+        slack['count'],
+        slack['p50'],
+        slack['p99'],
+        slack['connections'],
+        slack['rate_limited']
+    ))
+
+    for cache in (track_info_cache, playlist_index_cache):
+        stats = cache.stats()
+        logger.info("%s cache: %.0f%% of %s lookups hit (%s local, %s redis), %s cached locally" % (
+            cache.namespace,
+            stats['hit_rate'] * 100,
+            stats['hits'] + stats['misses'],
+            stats['local_hits'],
+            stats['redis_hits'],
+            stats['size']
+        ))
+
+
+@task_postrun.connect
+def log_metrics_periodically(**kwargs):
+    global metrics_logged_at
+
+    now = time.monotonic()
+    if now - metrics_logged_at < METRICS_LOG_INTERVAL:
+        return
+
+    metrics_logged_at = now
+    log_metrics()
+
+
+def task_track_info(track_info):
+    """
+    What to pass to a task for track_info: the TrackInfo itself,
+    or a reference to it if TASK_TRACK_INFO_REFERENCES is set
+    """
+    if TASK_TRACK_INFO_REFERENCES and track_info.track_id:
+        return TrackInfoRef.from_track_info(track_info)
+
+    return track_info
+
+
+def defer_search(origin, platform, channel, post_results=True):
+    """
+    Saves a search_and_add_to_playlists for run_deferred_searches to queue after the youtube quota resets
+    """
+    if isinstance(origin, TrackInfo):
+        origin = origin.to_wire()
+
+    DeferredSearch(
+        origin=json.dumps(origin),
+        platform=platform,
+        channel_id=channel,
+        post_results=post_results,
+        run_after=datetime.datetime.utcnow() + datetime.timedelta(seconds=youtube_quota.seconds_until_reset())
+    ).save()
+
+
+@app.task
+def run_deferred_searches():
+    """
+    Queues the deferred searches that are due, as many as the quota has room for.
+    Returns the number queued.
+    """
+    due = DeferredSearch.query.filter(
+        DeferredSearch.run_after <= datetime.datetime.utcnow()
+    ).order_by(DeferredSearch.run_after).limit(DEFERRED_SEARCHES_PER_RUN).all()
+
+    left = {platform: searches_left(platform) for platform in Platform}
+    queued = 0
+    for deferred in due:
+        if left[deferred.platform] is not None:
+            if left[deferred.platform] <= 0:
+                continue
+            left[deferred.platform] -= 1
+
+        search_and_add_to_playlists.delay(
+            origin=json.loads(deferred.origin),
+            platform=deferred.platform.name,
+            channel=deferred.channel_id,
+            post_results=deferred.post_results
+        )
+        deferred.delete()
+        queued += 1
+
+    return queued
 
 
 @app.task
-def search_and_add_to_playlists(origin, platform, channel):
+def search_and_add_to_playlists(origin, platform, channel, post_results=True):
     """
     1. Search for track info based on target
     2. add to same platform playlists
+    3. post the results to the channel, unless post_results is False
     """
     platform = Platform.from_string(platform)
     playlists = Playlist.query.filter_by(channel_id=channel, platform=platform).all()
     if not playlists:
         return True
 
-    # see if we were passed a TrackInfo.__dict__
-    if 'platform' in origin:
+    if isinstance(origin, TrackInfoRef):
+        track_info = get_track_info_from_link(link=origin.link())
+        if not track_info:
+            logger.error("Couldn't resolve track %s %s" % (origin.platform.name, origin.track_id))
+            return False
+        origin = track_info
+    # see if we were passed a TrackInfo.to_wire(), from json serialized tasks
+    elif isinstance(origin, list):
+        origin = TrackInfo.from_wire(origin)
+    # or a TrackInfo dict, from tasks queued before to_wire
+    elif isinstance(origin, dict) and 'platform' in origin:
         origin = TrackInfo(**origin)
 
-    if isinstance(origin, TrackInfo):
-        best_match = fuzzy_search_from_track_info(track_info=origin)
-    else:
-        best_match = fuzzy_search_from_string(
-            track_name=origin.get('track_name'),
-            artist=origin.get('artist'),
-            platform=platform
-        )
+    try:
+        if isinstance(origin, TrackInfo):
+            best_match = fuzzy_search_from_track_info(track_info=origin)
+        else:
+            best_match = fuzzy_search_from_string(
+                track_name=origin.get('track_name'),
+                artist=origin.get('artist'),
+                platform=platform
+            )
+    except QuotaExhaustedError as e:
+        logger.info("Deferring search until the quota resets: %s" % str(e))
+        defer_search(origin=origin, platform=platform, channel=channel, post_results=post_results)
+        return True
+    except Exception as e:
+        # reported like finding nothing, but not cached as a match
+        logger.error("Search on %s failed: %s" % (platform.name, str(e)))
+        best_match = None
 
     if not best_match:
+        if not post_results:
+            return True
+
         msg_payload = SlackMessageFormatter.format_failed_search_results_message(
             origin=origin,
             target_platform=platform
@@ -55,6 +245,8 @@ def search_and_add_to_playlists(origin, platform, channel):
         playlists=playlists
     )
 
+    if not post_results:
+        return True
 
     # send message
     payload = SlackMessageFormatter.format_add_track_results_message(
@@ -95,7 +287,7 @@ def add_link_to_playlists(link, channel):
     2. Schedules an attempt to add TrackInfo to other platform playlistss
     3. Adds the track to all Playlists of the same platform
     """
-    link_platform = Platform.from_link(link)
+    platform = link_platform(link)
 
     # Get TrackInfo from native platform
     track_info = get_track_info_from_link(link=link)
@@ -103,28 +295,24 @@ def add_link_to_playlists(link, channel):
         # There's something wrong with the link
         msg_payload = SlackMessageFormatter.format_failed_search_results_message(
             origin=link,
-            target_platform=link_platform
+            target_platform=platform
         )
         msg_payload.update({'channel': channel})
         SlackMessageFormatter.post_message(payload=msg_payload)
         return True
 
-    # celery needs json-able objects
-    track_info_json = copy.deepcopy(track_info.__dict__)
-    track_info_json['platform'] = track_info.platform.name
-
     # Schedule cross-platform playlists
     search_and_add_to_playlists.delay(
-        origin=track_info_json,
+        origin=task_track_info(track_info),
         platform=(
             Platform.SPOTIFY.name
-            if link_platform is Platform.YOUTUBE
+            if platform is Platform.YOUTUBE
             else Platform.YOUTUBE.name
         ),
         channel=channel
     )
 
-    playlists = Playlist.query.filter_by(channel_id=channel, platform=link_platform).all()
+    playlists = Playlist.query.filter_by(channel_id=channel, platform=platform).all()
     if not playlists:
         return True
 
@@ -145,3 +333,388 @@ def add_link_to_playlists(link, channel):
     SlackMessageFormatter.post_message(payload=payload)
 
     return True
+
+
+@app.task
+def add_links_to_playlists(links, channel):
+    """
+    Grouped version of add_link_to_playlists for every link in a link_shared event:
+    1. Gets the TrackInfo for every link concurrently
+    2. Searches for cross-platform matches for all of them concurrently
+    3. Adds the tracks and matches to the channel's playlists
+    4. Posts one message with the results for the whole event
+    """
+    playlists_by_platform = {
+        platform: Playlist.query.filter_by(channel_id=channel, platform=platform).all()
+        for platform in Platform
+    }
+    if not any(playlists_by_platform.values()):
+        return True
+
+    # the same link can be shared more than once in a message
+    links = list(dict.fromkeys(links))
+    resolved = resolve_links(links=links)
+
+    needs_match = [
+        track_info for _, track_info in resolved
+        if track_info and playlists_by_platform[cross_platform_for(track_info.platform)]
+    ]
+    deferred = []
+    matches = dict(zip(needs_match, search_cross_platform(track_infos=needs_match, deferred=deferred)))
+    for track_info in deferred:
+        defer_search(origin=track_info, platform=cross_platform_for(track_info.platform), channel=channel)
+
+    results = []
+    failed_searches = []
+    for link, track_info in resolved:
+        if not track_info:
+            failed_searches.append((link, link_platform(link)))
+            continue
+
+        native_playlists = playlists_by_platform[track_info.platform]
+        if native_playlists:
+            successes, failures = add_track_to_playlists(
+                track_info=track_info,
+                playlists=native_playlists
+            )
+            results.append((link, track_info, successes, failures))
+
+        cross_platform = cross_platform_for(track_info.platform)
+        cross_playlists = playlists_by_platform[cross_platform]
+        if not cross_playlists:
+            continue
+
+        best_match = matches.get(track_info)
+        if not best_match:
+            if track_info not in deferred:
+                failed_searches.append((track_info, cross_platform))
+            continue
+
+        successes, failures = add_track_to_playlists(
+            track_info=best_match,
+            playlists=cross_playlists
+        )
+        results.append((track_info, best_match, successes, failures))
+
+    payloads = SlackMessageFormatter.format_add_tracks_results_messages(
+        results=results,
+        failed_searches=failed_searches
+    )
+    for payload in payloads:
+        payload.update({'channel': channel})
+        SlackMessageFormatter.post_message(payload=payload)
+
+    return True
+
+
+@app.task
+def reconcile_playlist_indexes():
+    """
+    Schedules a reconcile for every playlist whose local track index
+    is missing or older than PLAYLIST_INDEX_RECONCILE_INTERVAL
+    """
+    cutoff = datetime.datetime.utcnow() - PLAYLIST_INDEX_RECONCILE_INTERVAL
+    stale_playlists = Playlist.query.filter(
+        (Playlist.index_reconciled_at == None) | (Playlist.index_reconciled_at < cutoff)  # noqa: E711
+    ).all()
+
+    for pl in stale_playlists:
+        reconcile_playlist_track_index.delay(playlist_id=pl.id)
+
+    return True
+
+
+@app.task
+def refresh_spotify_tokens():
+    """
+    Refreshes spotify tokens ahead of expiry, so tasks don't have to
+    """
+    refreshed = 0
+    for credential in Credential.query.filter_by(platform=Platform.SPOTIFY).all():
+        credentials = credential.to_oauth2_creds()
+        if not credentials.get('refresh_token'):
+            continue
+
+        try:
+            _, did_refresh = check_spotify_credentials(credentials, margin=PROACTIVE_REFRESH_MARGIN)
+        except Exception as e:
+            logger.error("Failed to refresh spotify token for credential %s: %s" % (credential.id, str(e)))
+            continue
+
+        # not counting tokens another worker had already refreshed
+        if did_refresh:
+            refreshed += 1
+
+    return refreshed
+
+
+@app.task
+def refresh_youtube_tokens():
+    """
+    Refreshes youtube tokens ahead of expiry. The credentials' storage saves each new token
+    to its row and shares it with the other workers.
+    """
+    refreshed = 0
+    for credential in Credential.query.filter_by(platform=Platform.YOUTUBE).all():
+        try:
+            credentials = credential.to_oauth2_creds()
+            if not credentials.store or not credentials.token_expiry:
+                continue
+
+            if utc_timestamp(credentials.token_expiry) - time.time() > PROACTIVE_REFRESH_MARGIN:
+                continue
+
+            credentials.refresh(httplib2.Http())
+        except Exception as e:
+            logger.error("Failed to refresh youtube token for credential %s: %s" % (credential.id, str(e)))
+            continue
+
+        refreshed += 1
+
+    return refreshed
+
+
+@app.task
+def reconcile_playlist_track_index(playlist_id):
+    playlist = Playlist.query.get(playlist_id)
+    if not playlist:
+        return True
+
+    reconcile_playlist_index(playlist=playlist)
+
+    return True
+
+
+def backfill_tracks(track_infos, channel):
+    """
+    Adds resolved tracks to same-platform playlists in the channel and their
+    best cross-platform matches to the other platform's playlists.
+    Returns the number of tracks added.
+    """
+    tracks_added = 0
+    for platform in Platform:
+        native_tracks = [t for t in track_infos if t.platform is platform]
+        if not native_tracks:
+            continue
+
+        native_playlists = Playlist.query.filter_by(channel_id=channel, platform=platform).all()
+        if native_playlists:
+            for _, successes, _ in add_tracks_to_playlists(
+                    track_infos=native_tracks, playlists=native_playlists):
+                tracks_added += len(successes)
+
+        cross_platform = cross_platform_for(platform)
+        cross_playlists = Playlist.query.filter_by(channel_id=channel, platform=cross_platform).all()
+        if not cross_playlists:
+            continue
+
+        cross_service = get_service_user_service(cross_platform)
+        sanitize_titles([t.name for t in native_tracks])
+        matches = {}
+        for track_info in native_tracks:
+            try:
+                match = fuzzy_search_from_track_info(
+                    track_info=track_info,
+                    slacktunes_cross_service=cross_service
+                )
+            except QuotaExhaustedError:
+                # the backfill only posts a summary; a message per deferred track would flood the channel
+                defer_search(origin=track_info, platform=cross_platform, channel=channel, post_results=False)
+                continue
+            except Exception as e:
+                logger.error("Backfill search failed for %s: %s" % (track_info.track_id, str(e)))
+                continue
+
+            if match:
+                matches.setdefault(match.track_id, match)
+
+        if matches:
+            for _, successes, _ in add_tracks_to_playlists(
+                    track_infos=list(matches.values()), playlists=cross_playlists):
+                tracks_added += len(successes)
+
+    return tracks_added
+
+
+@app.task
+def scrape_channel_history(channel, run_id=None):
+    """
+    Processes one page of channel history per run and reschedules itself,
+    saving the cursor after every page so a restart picks up where it left off.
+    run_id is from ChannelBackfill.claim_run; a run that's been replaced stops.
+    """
+    backfill = ChannelBackfill.query.filter_by(channel_id=channel).first()
+    if not backfill:
+        backfill = ChannelBackfill(channel_id=channel)
+        backfill.save()
+
+    if backfill.is_finished:
+        return True
+
+    if run_id and backfill.run_id != run_id:
+        logger.info("Backfill %s: run %s was replaced by %s" % (channel, run_id, backfill.run_id))
+        return True
+
+    started = time.time()
+    history = SlackMessageFormatter.get_channel_history(
+        channel=channel,
+        latest=backfill.latest_ts,
+        count=BACKFILL_PAGE_SIZE
+    )
+    if not history.get('ok'):
+        logger.error("Failed to fetch history for %s: %s" % (channel, history.get('error')))
+        return False
+
+    messages = history.get('messages', [])
+    links = []
+    for message in messages:
+        links.extend(extract_links_from_message(message))
+
+    tracks_added = 0
+    if links:
+        tracks_added = backfill_tracks(
+            track_infos=get_track_infos_from_links(links=links),
+            channel=channel
+        )
+
+    # messages come newest first
+    if messages:
+        backfill.latest_ts = messages[-1]['ts']
+    backfill.is_finished = not history.get('has_more') or not messages
+    backfill.messages_scanned += len(messages)
+    backfill.tracks_added += tracks_added
+    backfill.elapsed_seconds += time.time() - started
+    backfill.heartbeat_at = datetime.datetime.utcnow()
+    backfill.save()
+
+    logger.info("Backfill %s: %s messages, %s tracks, %.2f tracks/sec" % (
+        channel,
+        backfill.messages_scanned,
+        backfill.tracks_added,
+        backfill.tracks_per_second()
+    ))
+
+    if not backfill.is_finished:
+        scrape_channel_history.delay(channel=channel, run_id=run_id)
+        return True
+
+    SlackMessageFormatter.post_message(payload={
+        'channel': channel,
+        'text': "Finished scraping channel history: added *%s* tracks from %s messages" % (
+            backfill.tracks_added,
+            backfill.messages_scanned
+        )
+    })
+
+    return True
+
+
+def respond_to_command(command, response_url, received_at, text):
+    SlackMessageFormatter.respond(response_url=response_url, text=text)
+
+    elapsed = time.time() - received_at
+    command_latency.record(command, elapsed)
+    summary = command_latency.get(command).summary()
+    logger.info("/%s replied in %.2fs (p50 %.2fs, p99 %.2fs over %s)" % (
+        command,
+        elapsed,
+        summary['p50'],
+        summary['p99'],
+        summary['count']
+    ))
+
+    return True
+
+
+@app.task
+def create_playlist_from_command(
+        channel_id, slack_user_id, slack_user_name, playlist_name, platform, auth_url, response_url,
+        received_at):
+    """
+    The slow half of /create_playlist: the platform's playlist list and insert.
+    auth_url is where to send the user if they haven't authed with the platform.
+    """
+    platform = Platform.from_string(platform)
+
+    def respond(text):
+        return respond_to_command('create_playlist', response_url, received_at, text)
+
+    user = User.query.filter_by(slack_id=slack_user_id).first()
+    credentials = user.credentials_for_platform(platform=platform) if user else None
+    if not credentials:
+        # prompt them to auth on the website
+        return respond("No verified auth for %s. Please go to %s and allow access" % (slack_user_name, auth_url))
+
+    playlist = Playlist.query.filter_by(
+        user_id=user.id,
+        name=playlist_name,
+        platform=platform,
+        channel_id=channel_id
+    ).first()
+    if playlist:
+        return respond("Found a playlist %s (%s) for %s in this channel already" % (
+            playlist_name, platform.name.title(), slack_user_name))
+
+    music_service = ServiceFactory.from_enum(platform)(credentials=credentials, owner_id=user.id)
+    success, playlist_snippet = music_service.create_playlist(playlist_name=playlist_name)
+    if not success:
+        return respond("Unable to create playlist")
+
+    playlist = Playlist(
+        name=playlist_name,
+        channel_id=channel_id,
+        platform=platform,
+        platform_id=playlist_snippet['id'],
+        user_id=user.id
+    )
+    playlist.save()
+
+    return respond("Created playlist %s for %s in this channel!" % (playlist_name, slack_user_name))
+
+
+@app.task
+def delete_playlist_from_command(
+        channel_id, channel_name, slack_user_id, slack_user_name, playlist_name, platform, response_url,
+        received_at):
+    """
+    /delete_playlist, after the ack. platform is None when the command didn't name one.
+    """
+    def respond(text):
+        return respond_to_command('delete_playlist', response_url, received_at, text)
+
+    user = User.query.filter_by(slack_id=slack_user_id).first()
+    if not user:
+        return respond("No record of you, %s. Are you sure you have a playlist in this channel?" % slack_user_name)
+
+    playlists = Playlist.query.filter_by(user_id=user.id, channel_id=channel_id).all()
+    if not playlists:
+        return respond("No playlists found in this channel that belong to you")
+
+    playlist_to_delete = [pl for pl in playlists if pl.name == playlist_name]
+    if platform:
+        platform = Platform.from_string(platform)
+        playlist_to_delete = [pl for pl in playlist_to_delete if pl.platform is platform]
+
+    if not playlist_to_delete:
+        existing_in_channel = "\n".join(
+            "%s (%s)" % (p.name, p.platform.name.title())
+            for p in playlists
+        )
+        return respond("Couldn't find a playlist named %s... I see these: \n%s" % (
+            playlist_name,
+            existing_in_channel
+        ))
+
+    if len(playlist_to_delete) > 1:
+        return respond("More than one playlist matching name %s ... Try specifying the platform" % playlist_name)
+
+    playlist_to_delete = playlist_to_delete[0]
+
+    platform = playlist_to_delete.platform
+    playlist_to_delete.delete()
+
+    return respond(
+        "Deleted slacktunes record of *%s* in channel *%s* \n"
+        "Keep in mind, this won't delete the %s version, it'll only stop slacktunes "
+        "from posting links to it" % (playlist_name, channel_name, platform.name.title())
+    )
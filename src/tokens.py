@@ -0,0 +1,299 @@
+import calendar
+import datetime
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+import redis
+from oauth2client.client import OAuth2Credentials, Storage
+
+from app import logger
+from .cache import RedisTier
+
+# how long one worker may hold a refresh lock before another is allowed to refresh
+REFRESH_LOCK_TIMEOUT = 10
+# how often a worker waiting on someone else's refresh checks for the new token
+REFRESH_POLL_INTERVAL = 0.1
+# an oauth2client token this close to expiring is swapped for a newer shared one, if there is one
+OAUTH2_TOKEN_EXPIRY_MARGIN = 60
+
+
+def token_identity(refresh_token):
+    """
+    Stable key for a user's token that doesn't put the refresh token itself in a redis key
+    """
+    return hashlib.sha1(refresh_token.encode('utf-8')).hexdigest()
+
+
+class RefreshLock(RedisTier):
+    """
+    A lock per token, held in redis (SET NX with a timeout) so only one worker refreshes it.
+    While redis is down everyone gets the lock, and refreshes are only single-flight per process.
+    """
+
+    def __init__(self, namespace, timeout=REFRESH_LOCK_TIMEOUT, use_redis=True):
+        super(RefreshLock, self).__init__(namespace=namespace, ttl=timeout, use_redis=use_redis)
+
+    def acquire(self, key):
+        """
+        Returns an owner token to release the lock with, or None if another worker holds it
+        """
+        owner = uuid.uuid4().hex
+        client = self._redis()
+        if not client:
+            return owner
+
+        try:
+            if client.set(self._redis_key(key), owner, ex=int(self.ttl), nx=True):
+                return owner
+            return None
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return owner
+
+    def release(self, key, owner):
+        client = self._redis()
+        if not client:
+            return
+
+        try:
+            # only our own lock; if it timed out someone else may hold it now
+            if client.get(self._redis_key(key)) == owner.encode('utf-8'):
+                client.delete(self._redis_key(key))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+
+
+class TokenCache(RedisTier):
+    """
+    The newest token seen for each key, in process and in redis, each kept until it expires
+    """
+
+    def __init__(self, namespace, expires_at, use_redis=True, clock=time.time):
+        super(TokenCache, self).__init__(namespace=namespace, ttl=None, use_redis=use_redis)
+        self.expires_at = expires_at
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.local = {}
+
+    def get(self, key):
+        with self.lock:
+            token = self.local.get(key)
+        if token and self.expires_at(token) > self.clock():
+            return token
+
+        client = self._redis()
+        if not client:
+            return None
+
+        try:
+            raw_token = client.get(self._redis_key(key))
+        except redis.RedisError as e:
+            self._redis_failed(e)
+            return None
+
+        if raw_token is None:
+            return None
+
+        token = json.loads(raw_token.decode('utf-8'))
+        with self.lock:
+            self.local[key] = token
+
+        return token
+
+    def set(self, key, token):
+        with self.lock:
+            self.local[key] = token
+
+        ttl = int(self.expires_at(token) - self.clock())
+        client = self._redis()
+        if not client or ttl <= 0:
+            return
+
+        try:
+            client.set(self._redis_key(key), json.dumps(token, separators=(',', ':')), ex=ttl)
+        except redis.RedisError as e:
+            self._redis_failed(e)
+
+
+class SingleFlightRefresher():
+    """
+    Hands out fresh tokens, refreshing each at most once at a time across every worker.
+    Threads in a process queue on a local lock; processes on a RefreshLock, and the
+    ones that lose wait for the winner's token to show up in the TokenCache.
+    Tokens are json-able dicts; expires_at(token) is when one expires, in epoch seconds.
+    """
+
+    def __init__(self, namespace, expires_at, use_redis=True, clock=time.time, sleep=time.sleep):
+        self.cache = TokenCache(
+            namespace='%s:token' % namespace, expires_at=expires_at, use_redis=use_redis, clock=clock)
+        self.refresh_lock = RefreshLock(namespace='%s:refresh' % namespace, use_redis=use_redis)
+        self.expires_at = expires_at
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+        self.refreshes = 0
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def _usable(self, token, margin):
+        return token is not None and self.expires_at(token) - self.clock() >= margin
+
+    def _wait_for_refresh(self, key, margin):
+        for _ in range(int(self.refresh_lock.ttl / REFRESH_POLL_INTERVAL)):
+            self.sleep(REFRESH_POLL_INTERVAL)
+            token = self.cache.get(key)
+            if self._usable(token, margin):
+                return token
+
+        return None
+
+    def fresh(self, key, token, refresh, margin):
+        """
+        A token for key good for at least margin more seconds: token itself, the newest one
+        any worker has cached, or refresh(token)'s, which is then cached for everyone else.
+        """
+        if self._usable(token, margin):
+            return token
+
+        cached = self.cache.get(key)
+        if self._usable(cached, margin):
+            return cached
+
+        with self._key_lock(key):
+            # another thread may have refreshed while this one waited for the lock
+            cached = self.cache.get(key)
+            if self._usable(cached, margin):
+                return cached
+
+            owner = self.refresh_lock.acquire(key)
+            if owner is None:
+                refreshed = self._wait_for_refresh(key, margin)
+                if refreshed:
+                    return refreshed
+
+                logger.error("Gave up waiting on another worker to refresh token %s" % key)
+
+            try:
+                refreshed = refresh(cached or token)
+                self.refreshes += 1
+                self.cache.set(key, refreshed)
+            finally:
+                if owner:
+                    self.refresh_lock.release(key, owner)
+
+        return refreshed
+
+
+def utc_timestamp(dt):
+    return calendar.timegm(dt.timetuple())
+
+
+# youtube access tokens, shared by every worker through OAuth2CredentialStorage
+youtube_tokens = SingleFlightRefresher(namespace='youtube', expires_at=lambda token: token['expires_at'])
+
+
+class OAuth2CredentialStorage(Storage):
+    """
+    oauth2client Storage for a Credential row. oauth2client takes the lock and calls
+    locked_get before refreshing, and uses the stored token instead if it's newer
+    than its own; locked_put saves the refreshed token to the row and the shared cache.
+    The lock is youtube_tokens' RefreshLock, so one worker refreshes and the rest pick it up.
+    """
+
+    def __init__(self, model, row_id, credentials_json, refresh_token, tokens=None):
+        super(OAuth2CredentialStorage, self).__init__(lock=threading.Lock())
+        self.model = model
+        self.row_id = row_id
+        self.credentials_json = credentials_json
+        self.key = token_identity(refresh_token)
+        self.tokens = tokens or youtube_tokens
+        self.owner = None
+
+    def shared_token(self, margin=0):
+        token = self.tokens.cache.get(self.key)
+        if token and token['expires_at'] - self.tokens.clock() > margin:
+            return token
+
+        return None
+
+    def acquire_lock(self):
+        super(OAuth2CredentialStorage, self).acquire_lock()
+
+        for _ in range(int(self.tokens.refresh_lock.ttl / REFRESH_POLL_INTERVAL)):
+            self.owner = self.tokens.refresh_lock.acquire(self.key)
+            # a token showing up means whoever had the lock is done with it
+            if self.owner or self.shared_token():
+                return
+            self.tokens.sleep(REFRESH_POLL_INTERVAL)
+
+        logger.error("Gave up waiting on another worker to refresh token %s" % self.key)
+
+    def release_lock(self):
+        if self.owner:
+            self.tokens.refresh_lock.release(self.key, self.owner)
+            self.owner = None
+
+        super(OAuth2CredentialStorage, self).release_lock()
+
+    def locked_get(self):
+        token = self.shared_token()
+        if token:
+            credentials = OAuth2Credentials.from_json(self.credentials_json)
+            credentials.access_token = token['access_token']
+            credentials.token_expiry = datetime.datetime.utcfromtimestamp(token['expires_at'])
+            return credentials
+
+        row = self.model.query.get(self.row_id)
+        if not row:
+            return None
+
+        self.credentials_json = row.credentials
+        return OAuth2Credentials.from_json(row.credentials)
+
+    def locked_put(self, credentials):
+        if credentials.access_token and credentials.token_expiry and not credentials.invalid:
+            self.tokens.cache.set(self.key, {
+                'access_token': credentials.access_token,
+                'expires_at': utc_timestamp(credentials.token_expiry),
+            })
+            self.tokens.refreshes += 1
+
+        self.credentials_json = credentials.to_json()
+        row = self.model.query.get(self.row_id)
+        if row:
+            row.credentials = self.credentials_json
+            row.save()
+
+    def locked_delete(self):
+        row = self.model.query.get(self.row_id)
+        if row:
+            row.delete()
+
+
+def adopt_shared_token(credentials, margin=OAUTH2_TOKEN_EXPIRY_MARGIN):
+    """
+    Swaps an access token that's about to expire for a newer one another worker
+    (or the beat task) already stored, so the next request doesn't fail on it. Never refreshes.
+    """
+    store = getattr(credentials, 'store', None)
+    if not isinstance(store, OAuth2CredentialStorage) or not credentials.token_expiry:
+        return False
+
+    if utc_timestamp(credentials.token_expiry) - store.tokens.clock() > margin:
+        return False
+
+    token = store.shared_token(margin=margin)
+    if not token or token['access_token'] == credentials.access_token:
+        return False
+
+    credentials.access_token = token['access_token']
+    credentials.token_expiry = datetime.datetime.utcfromtimestamp(token['expires_at'])
+    return True
+
@@ -1,56 +1,465 @@
-from .constants import Platform
-from .models import User
-from .music_services import ServiceFactory
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db, logger
+from .cache import TieredCache
+from .constants import DUPLICATE_TRACK, Platform
+from .links import link_key, link_platform, track_id_from_link
+from .models import TrackMatch
+from .music_services import ServiceFactory, TrackInfo
+from .quota import YOUTUBE_SEARCH_COST, YOUTUBE_SEARCH_RESERVE, QuotaExhaustedError, youtube_quota
+from .sanitizer import sanitize_titles
+from .service_registry import service_user_registry
+
+# slack wraps links in messages as <url> or <url|label>
+SLACK_LINK_RE = re.compile(r'<(https?://[^>|]+)(?:\|[^>]*)?>')
+
+# max threads used to resolve links, run searches or add to playlists for a single task
+LOOKUP_WORKERS = 8
+# a user's playlists share one service (and http client), so their calls must not overlap
+MAX_CONCURRENT_CALLS_PER_USER = 1
+
+# one pool per worker process, so the services and clients kept on its threads outlive a task
+lookup_executor = None
+lookup_executor_pid = None
+lookup_executor_lock = threading.Lock()
+
+TRACK_INFO_CACHE_SIZE = 2048
+TRACK_INFO_CACHE_TTL = 60 * 60 * 6
+
+# TrackInfo.to_cache_dict()s keyed by (platform name, track_id)
+track_info_cache = TieredCache(
+    namespace='track_info',
+    maxsize=TRACK_INFO_CACHE_SIZE,
+    ttl=TRACK_INFO_CACHE_TTL
+)
+
+
+def get_service_user_service(platform):
+    return service_user_registry.get_service(platform)
+
+
+def cross_platform_for(platform):
+    return Platform.SPOTIFY if platform is Platform.YOUTUBE else Platform.YOUTUBE
 
 
 def get_track_info_from_link(link, service=None):
-    link_platform = Platform.from_link(link)
+    platform = link_platform(link)
+    if not platform:
+        return None
+
+    track_id = track_id_from_link(link, platform=platform)
+    cache_key = (platform.name, track_id)
+    if track_id:
+        cached = track_info_cache.get(cache_key)
+        if cached:
+            return TrackInfo.from_cache_dict(cached)
+
     if not service:
-        slacktunes_user = User.query.filter_by(is_service_user=True).first()
-        slacktunes_creds = slacktunes_user.credentials_for_platform(link_platform)
-        service = ServiceFactory.from_enum(link_platform)(credentials=slacktunes_creds)
+        service = get_service_user_service(platform)
+
+    track_info = service.get_track_info_from_link(link=link)
+    if track_info and track_id:
+        track_info_cache.set(cache_key, track_info.to_cache_dict())
+
+    return track_info
 
-    return service.get_track_info_from_link(link=link)
+
+def searches_left(platform):
+    """
+    How many searches platform's api quota has room for right now, or None if it has no quota
+    """
+    if platform is not Platform.YOUTUBE:
+        return None
+
+    return youtube_quota.calls_left(YOUTUBE_SEARCH_COST, reserve=YOUTUBE_SEARCH_RESERVE)
 
 
 def fuzzy_search_from_string(track_name, artist, platform):
-    slacktunes_user = User.query.filter_by(is_service_user=True).first()
-    slacktunes_creds = slacktunes_user.credentials_for_platform(platform)
-    slacktunes_service = ServiceFactory.from_enum(platform)(credentials=slacktunes_creds)
+    if searches_left(platform) == 0:
+        raise QuotaExhaustedError("No %s quota left for searches" % platform.name)
+
+    slacktunes_service = get_service_user_service(platform)
 
     return slacktunes_service.fuzzy_search(track_name=track_name, artist=artist)
 
 
-def fuzzy_search_from_track_info(track_info, slacktunes_cross_service=None):
-    cross_platform = (
-        Platform.SPOTIFY
-        if track_info.platform is Platform.YOUTUBE
-        else Platform.YOUTUBE
+def get_cached_match(track_info, include_expired=False):
+    """
+    Returns (found, match) from the match cache.
+    match is None for a cached search that found nothing
+    """
+    cached = TrackMatch.lookup(
+        source_platform=track_info.platform,
+        source_track_id=track_info.track_id,
+        target_platform=cross_platform_for(track_info.platform),
+        include_expired=include_expired
+    )
+    if not cached:
+        return False, None
+
+    target_track = cached.target_track_dict()
+    if not target_track:
+        return True, None
+
+    return True, TrackInfo.from_cache_dict(target_track)
+
+
+def cache_match(track_info, match):
+    TrackMatch.record(
+        source_platform=track_info.platform,
+        source_track_id=track_info.track_id,
+        target_platform=cross_platform_for(track_info.platform),
+        target_track=match.to_cache_dict() if match else None
     )
+
+
+def get_stale_match(track_info):
+    """
+    For when the cross platform has no quota left to search: an expired match from
+    the match cache, or QuotaExhaustedError. Expired "no match"es aren't trusted.
+    """
+    found, match = get_cached_match(track_info, include_expired=True)
+    if not match:
+        raise QuotaExhaustedError("No %s quota left for searches" % cross_platform_for(track_info.platform).name)
+
+    return match
+
+
+def fuzzy_search_from_track_info(track_info, slacktunes_cross_service=None):
+    found, match = get_cached_match(track_info)
+    if found:
+        return match
+
+    if searches_left(cross_platform_for(track_info.platform)) == 0:
+        return get_stale_match(track_info)
+
     if not slacktunes_cross_service:
-        slacktunes_user = User.query.filter_by(is_service_user=True).first()
-        slacktunes_creds = slacktunes_user.credentials_for_platform(cross_platform)
-        slacktunes_cross_service = ServiceFactory.from_enum(
-            cross_platform)(credentials=slacktunes_creds)
+        slacktunes_cross_service = get_service_user_service(
+            cross_platform_for(track_info.platform))
 
-    return slacktunes_cross_service.fuzzy_search_from_track_info(track_info=track_info)
+    match = slacktunes_cross_service.fuzzy_search_from_track_info(track_info=track_info)
+    cache_match(track_info=track_info, match=match)
 
+    return match
 
-def add_track_to_playlists(track_info, playlists):
-    successes = []
-    failures = []
+
+def extract_links_from_message(message):
+    """
+    Returns the Youtube and Spotify links in a channels.history message, in order
+    """
+    links = SLACK_LINK_RE.findall(message.get('text', ''))
+    links.extend(
+        a['from_url'] for a in message.get('attachments', [])
+        if a.get('from_url')
+    )
+
+    seen = set()
+    music_links = []
+    for link in links:
+        # only links to single tracks, once each
+        if track_id_from_link(link) and link_key(link) not in seen:
+            seen.add(link_key(link))
+            music_links.append(link)
+
+    return music_links
+
+
+def get_lookup_executor():
+    """
+    The worker's shared pool of LOOKUP_WORKERS threads, started on first use
+    (and again in a forked child, which doesn't get its parent's threads)
+    """
+    global lookup_executor, lookup_executor_pid
+    with lookup_executor_lock:
+        if lookup_executor is None or lookup_executor_pid != os.getpid():
+            lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS)
+            lookup_executor_pid = os.getpid()
+
+        return lookup_executor
+
+
+def run_pool_job(func, args):
+    """
+    Pool threads get their own db session the first time a job touches the db
+    (e.g. a token refresh saving its Credential); it's removed after every job so it
+    doesn't hold a connection, or stale rows, past the task that used it
+    """
+    try:
+        return func(*args)
+    finally:
+        db.session.remove()
+
+
+def map_concurrently(func, *iterables, max_workers=LOOKUP_WORKERS):
+    """
+    Calls func with each set of zipped args on the shared thread pool,
+    at most max_workers at a time. Results are returned in the same order as the args
+    """
+    args = list(zip(*iterables))
+    if not args:
+        return []
+
+    if max_workers <= 1:
+        return [func(*a) for a in args]
+
+    executor = get_lookup_executor()
+    # the pool is shared, so bound this call's share of it when it asks for less
+    in_flight = threading.BoundedSemaphore(min(max_workers, LOOKUP_WORKERS))
+    futures = []
+    for a in args:
+        in_flight.acquire()
+        future = executor.submit(run_pool_job, func, a)
+        future.add_done_callback(lambda _: in_flight.release())
+        futures.append(future)
+
+    return [future.result() for future in futures]
+
+
+def resolve_links(links):
+    """
+    Gets TrackInfo for every link concurrently.
+    Returns a list of (link, track_info) in the same order as links;
+    track_info is None for links that couldn't be resolved
+    """
+    links = [link for link in links if link_platform(link)]
+    # load credentials here so the threads don't hit the db
+    service_user_registry.load()
+
+    def resolve(link):
+        try:
+            return get_track_info_from_link(link=link)
+        except Exception as e:
+            logger.error("Failed to get track info for %s: %s" % (link, str(e)))
+            return None
+
+    track_infos = map_concurrently(resolve, links)
+
+    return [(link, track_info or None) for link, track_info in zip(links, track_infos)]
+
+
+def search_cross_platform(track_infos, deferred=None):
+    """
+    Finds the best cross-platform match for each TrackInfo, searching concurrently
+    for the ones that aren't in the match cache.
+    Once a platform's quota runs low, expired matches are used instead of searching;
+    tracks with none are appended to deferred, to be searched once the quota resets.
+    Returns a list of matches (or None) in the same order as track_infos
+    """
+    cached = [get_cached_match(t) for t in track_infos]
+
+    left = {platform: searches_left(platform) for platform in Platform}
+    uncached = []
+    for i, (track_info, (found, _)) in enumerate(zip(track_infos, cached)):
+        if found:
+            continue
+
+        cross_platform = cross_platform_for(track_info.platform)
+        if left[cross_platform] is None:
+            uncached.append(track_info)
+        elif left[cross_platform] > 0:
+            left[cross_platform] -= 1
+            uncached.append(track_info)
+        else:
+            try:
+                cached[i] = True, get_stale_match(track_info)
+            except QuotaExhaustedError:
+                cached[i] = True, None
+                if deferred is not None:
+                    deferred.append(track_info)
+
+    if uncached:
+        # load credentials here so the threads don't hit the db
+        service_user_registry.load()
+        # and sanitize the titles in one pass
+        sanitize_titles([t.name for t in uncached])
+
+    def search(track_info):
+        service = get_service_user_service(cross_platform_for(track_info.platform))
+        try:
+            return True, service.fuzzy_search_from_track_info(track_info=track_info)
+        except QuotaExhaustedError:
+            # the platform ran out before our count did
+            return None, None
+        except Exception as e:
+            logger.error("Cross-platform search failed for %s: %s" % (track_info.track_id, str(e)))
+            return False, None
+
+    searched = dict(zip(uncached, map_concurrently(search, uncached)))
+
+    matches = []
+    for track_info, (found, match) in zip(track_infos, cached):
+        if not found:
+            succeeded, match = searched[track_info]
+            # don't cache a failure as "no match"
+            if succeeded:
+                cache_match(track_info=track_info, match=match)
+            elif succeeded is None and deferred is not None:
+                deferred.append(track_info)
+        matches.append(match)
+
+    return matches
+
+
+def get_track_infos_from_links(links):
+    """
+    Resolves links with the service user's accounts and drops
+    links that resolve to a track we've already seen
+    """
+    track_infos = {}
+    for _, track_info in resolve_links(links):
+        if track_info:
+            track_infos.setdefault((track_info.platform, track_info.track_id), track_info)
+
+    return list(track_infos.values())
+
+
+def service_for_playlist(playlist):
+    pl_creds = playlist.user.credentials_for_platform(platform=playlist.platform)
+    return ServiceFactory.from_enum(playlist.platform)(credentials=pl_creds)
+
+
+def reconcile_playlist_index(playlist, service=None):
+    """
+    Rebuilds the playlist's local track index from its platform. When the platform has
+    snapshot ids, the playlist is only re-paged if its snapshot changed since the last rebuild.
+    """
+    if not service:
+        service = service_for_playlist(playlist)
+
+    snapshot_id = service.get_playlist_snapshot_id(playlist=playlist)
+    if snapshot_id is not None and playlist.is_indexed() and snapshot_id == playlist.snapshot_id:
+        playlist.touch_track_index()
+        return
+
+    playlist.reconcile_track_index(
+        service.get_track_ids_in_playlist(playlist=playlist),
+        snapshot_id=snapshot_id
+    )
+
+
+def index_is_current(is_indexed, indexed_snapshot_id, snapshot_id):
+    """
+    Whether an index built at indexed_snapshot_id can be trusted now that the platform
+    says the playlist is at snapshot_id (None if the platform has no snapshots or didn't answer)
+    """
+    return is_indexed and snapshot_id in (None, indexed_snapshot_id)
+
+
+def ensure_playlist_index(playlist, service):
+    """
+    Builds the local track index for a playlist that has never been indexed, or that
+    has changed outside slacktunes since it was indexed.
+    Returns whether the index can be trusted for duplicate checks.
+    """
+    snapshot_id = None
+    try:
+        snapshot_id = service.get_playlist_snapshot_id(playlist=playlist)
+    except Exception as e:
+        logger.error("Failed to get snapshot of playlist %s: %s" % (playlist.id, str(e)))
+
+    if index_is_current(playlist.is_indexed(), playlist.snapshot_id, snapshot_id):
+        return True
+
+    try:
+        playlist.reconcile_track_index(
+            service.get_track_ids_in_playlist(playlist=playlist),
+            snapshot_id=snapshot_id
+        )
+    except Exception as e:
+        # a failed commit leaves the session unusable for the next playlist
+        db.session.rollback()
+        logger.error("Failed to index playlist %s: %s" % (playlist.id, str(e)))
+        return False
+
+    return True
+
+
+def add_track_to_playlists(track_info, playlists, max_workers=LOOKUP_WORKERS):
+    """
+    Adds track_info to every playlist, running playlists concurrently (at most
+    MAX_CONCURRENT_CALLS_PER_USER at a time for any one user).
+    Only the platform calls run in the pool; db reads and writes stay on this thread,
+    apart from token refreshes, which save on the pool thread's own session (see run_pool_job).
+    Pass max_workers=1 to add to one playlist at a time.
+    """
     services_by_user = {}
+    semaphores_by_user = {}
     for pl in playlists:
-        pl_service = services_by_user.get(pl.user)
-        if not pl_service:
-            pl_creds = pl.user.credentials_for_platform(platform=pl.platform)
-            pl_service = ServiceFactory.from_enum(pl.platform)(credentials=pl_creds)
-            services_by_user[pl.user] = pl_service
+        if pl.user_id not in services_by_user:
+            services_by_user[pl.user_id] = service_for_playlist(pl)
+            semaphores_by_user[pl.user_id] = threading.BoundedSemaphore(MAX_CONCURRENT_CALLS_PER_USER)
+
+    indexed = [pl.is_indexed() for pl in playlists]
+    indexed_snapshot_ids = [pl.snapshot_id for pl in playlists]
+    duplicate = [
+        is_indexed and pl.has_track(track_info.track_id)
+        for pl, is_indexed in zip(playlists, indexed)
+    ]
+
+    def add_to_playlist(pl, is_indexed, indexed_snapshot_id, is_duplicate):
+        """
+        Returns (whether the index was trusted, track ids fetched to build the index or None,
+        (success, error_message))
+        """
+        service = services_by_user[pl.user_id]
+        with semaphores_by_user[pl.user_id]:
+            snapshot_id = None
+            try:
+                snapshot_id = service.get_playlist_snapshot_id(playlist=pl)
+            except Exception as e:
+                logger.error("Failed to get snapshot of playlist %s: %s" % (pl.id, str(e)))
+
+            if not index_is_current(is_indexed, indexed_snapshot_id, snapshot_id):
+                # changed outside slacktunes since it was indexed (or never indexed)
+                is_indexed = is_duplicate = False
+
+            if is_duplicate:
+                return is_indexed, None, (False, DUPLICATE_TRACK)
+
+            track_ids = None
+            if not is_indexed:
+                try:
+                    track_ids = service.get_track_ids_in_playlist(playlist=pl)
+                except Exception as e:
+                    logger.error("Failed to index playlist %s: %s" % (pl.id, str(e)))
+
+            if track_ids is not None and track_info.track_id in track_ids:
+                return is_indexed, track_ids, (False, DUPLICATE_TRACK)
+
+            try:
+                # an indexed playlist has already been checked for duplicates
+                return is_indexed, track_ids, service.add_track_to_playlist(
+                    track_info=track_info,
+                    playlist=pl,
+                    check_duplicates=not is_indexed and track_ids is None
+                )
+            except Exception as e:
+                return is_indexed, track_ids, (False, str(e))
+
+    results = map_concurrently(
+        add_to_playlist,
+        playlists,
+        indexed,
+        indexed_snapshot_ids,
+        duplicate,
+        max_workers=max_workers
+    )
+
+    successes = []
+    failures = []
+    for pl, (is_indexed, track_ids, (success, error_message)) in zip(playlists, results):
+        # the snapshot the service fetched before paging, or got back from the insert
+        snapshot_id = services_by_user[pl.user_id].known_snapshot_id(playlist=pl)
+        if track_ids is not None:
+            if success:
+                track_ids = set(track_ids) | {track_info.track_id}
+            pl.reconcile_track_index(track_ids, snapshot_id=snapshot_id)
+        elif is_indexed and success:
+            pl.index_track(track_info.track_id, snapshot_id=snapshot_id)
 
-        success, error_message = pl_service.add_track_to_playlist(
-            track_info=track_info,
-            playlist=pl
-        )
         # NOTE: Error message will be None if success == True
         # Don't do anything fancy (like schedle a retry) on failure here
         # because same-service failures are probably
@@ -61,3 +470,46 @@ def add_track_to_playlists(track_info, playlists):
             failures.append((pl, error_message))
 
     return successes, failures
+
+
+def add_tracks_to_playlists(track_infos, playlists):
+    """
+    Bulk version of add_track_to_playlists.
+    Returns a list of (playlist, successes, failures), where successes and failures
+    are lists of (track_info, error_message)
+    """
+    results = []
+    services_by_user = {}
+    for pl in playlists:
+        pl_service = services_by_user.get(pl.user)
+        if not pl_service:
+            pl_service = service_for_playlist(pl)
+            services_by_user[pl.user] = pl_service
+
+        indexed = ensure_playlist_index(playlist=pl, service=pl_service)
+        new_tracks = track_infos
+        failures = []
+        if indexed:
+            new_tracks = []
+            for track_info in track_infos:
+                if pl.has_track(track_info.track_id):
+                    failures.append((track_info, DUPLICATE_TRACK))
+                else:
+                    new_tracks.append(track_info)
+
+        successes, add_failures = pl_service.add_tracks_to_playlist(
+            track_infos=new_tracks,
+            playlist=pl,
+            check_duplicates=not indexed
+        )
+        failures.extend(add_failures)
+
+        if indexed:
+            pl.index_tracks(
+                (t.track_id for t, _ in successes),
+                snapshot_id=pl_service.known_snapshot_id(playlist=pl)
+            )
+
+        results.append((pl, successes, failures))
+
+    return results
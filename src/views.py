@@ -1,6 +1,8 @@
 import json
+import time
 import requests
 
+from contextlib import contextmanager
 from flask import render_template, jsonify, redirect, request, url_for
 from functools import wraps
 
@@ -13,11 +15,49 @@ from settings import (
 )
 
 from app import application, logger
+from .cache import TTLSet
 from .constants import InvalidEnumException, Platform, SlackUrl
+from .links import link_key
 from .message_formatters import SlackMessageFormatter
-from .models import Credential, Playlist, User
-from .music_services import ServiceFactory
-from .tasks import add_link_to_playlists, add_manual_track_to_playlists
+from .metrics import LatencyRecorders
+from .models import ChannelBackfill, Credential, Playlist, User
+from .music_services import ServiceFactory, forget_playlist_index
+from .tasks import (
+    add_links_to_playlists,
+    add_manual_track_to_playlists,
+    create_playlist_from_command,
+    delete_playlist_from_command,
+    scrape_channel_history
+)
+
+# how long slack event ids, and links shared in a channel, are remembered to drop repeats
+SLACK_EVENT_TTL = 60 * 60
+SHARED_LINK_TTL = 60 * 10
+SEEN_KEYS_CACHE_SIZE = 4096
+
+seen_slack_events = TTLSet(namespace='slack_event', maxsize=SEEN_KEYS_CACHE_SIZE, ttl=SLACK_EVENT_TTL)
+seen_shared_links = TTLSet(namespace='shared_link', maxsize=SEEN_KEYS_CACHE_SIZE, ttl=SHARED_LINK_TTL)
+
+# seconds to ack each slash command; slack gives up on us after 3
+command_ack_latency = LatencyRecorders()
+
+
+@contextmanager
+def timed_ack(command):
+    """
+    Records how long the view took to ack command, and logs the running percentiles
+    """
+    try:
+        with command_ack_latency.timed(command):
+            yield
+    finally:
+        summary = command_ack_latency.get(command).summary()
+        logger.info("/%s acked (p50 %.3fs, p99 %.3fs over %s)" % (
+            command,
+            summary['p50'],
+            summary['p99'],
+            summary['count']
+        ))
 
 
 # UTILITY DECORATOR
@@ -111,6 +151,7 @@ def credential_exchange(platform_enum):
         user_credentials = creds[0]
         user_credentials.credentials = credentials.to_json()
     user_credentials.save()
+    forget_playlist_index(platform=platform_enum, owner_id=user.id)
 
     return jsonify("Succesfully authed with %s!" % platform_enum.name.title(), 200)
 
@@ -152,34 +193,36 @@ def list_playlists():
 @application.route('/create_playlist/', methods=['POST'])
 @verified_slack_request
 def create_playlist():
-    if request.form.get('channel_name') == 'directmessage':
-        return "Can't init playlist from private channel", 200
-
-    channel_id = request.form['channel_id']
-    channel_name = request.form['channel_name']
-    slack_user_id = request.form['user_id']
-    slack_user_name = request.form['user_name']
-    command_text_args = request.form['text'].split()
-
-    # defaults
-    playlist_name = "%s_%s" % (channel_name, slack_user_name)
-    platform_enum = Platform.YOUTUBE
-    if command_text_args:
-        args_len = len(command_text_args)
-        if args_len > 0:
-            playlist_name = command_text_args[0]
-        if args_len > 1:
-            try:
-                platform_enum = Platform.from_string(command_text_args[1])
-            except InvalidEnumException:
-                pass
-
-    user = User.query.filter_by(slack_id=slack_user_id).first()
-    if not user:
-        # prompt them to auth on the website
+    """
+    Acks right away; create_playlist_from_command talks to the platform
+    and replies through the command's response_url
+    """
+    with timed_ack('create_playlist'):
+        if request.form.get('channel_name') == 'directmessage':
+            return "Can't init playlist from private channel", 200
+
+        channel_id = request.form['channel_id']
+        channel_name = request.form['channel_name']
+        slack_user_id = request.form['user_id']
+        slack_user_name = request.form['user_name']
+        command_text_args = request.form['text'].split()
+
+        # defaults
+        playlist_name = "%s_%s" % (channel_name, slack_user_name)
+        platform_enum = Platform.YOUTUBE
+        if command_text_args:
+            args_len = len(command_text_args)
+            if args_len > 0:
+                playlist_name = command_text_args[0]
+            if args_len > 1:
+                try:
+                    platform_enum = Platform.from_string(command_text_args[1])
+                except InvalidEnumException:
+                    pass
+
+        # in case they haven't authed; the task has no request to build urls from
         state = "%s:%s" % (slack_user_id, slack_user_name)
-        return "No verified auth for %s. Please go to %s%s and allow access" % (
-            slack_user_name,
+        auth_url = "%s%s" % (
             BASE_URI,
             url_for(
                 'auth',
@@ -188,114 +231,82 @@ def create_playlist():
             )
         )
 
-    credentials = user.credentials_for_platform(platform=platform_enum)
-    if not credentials:
-        # prompt them to auth on the website
-        state = "%s:%s" % (slack_user_id, slack_user_name)
-        return "No verified auth for %s. Please go to %s%s and allow access" % (
-            slack_user_name,
-            BASE_URI,
-            url_for(
-                'auth',
-                platform_str=platform_enum.name.lower(),
-                userdata=state
-            )
+        # CELERY
+        create_playlist_from_command.delay(
+            channel_id=channel_id,
+            slack_user_id=slack_user_id,
+            slack_user_name=slack_user_name,
+            playlist_name=playlist_name,
+            platform=platform_enum.name,
+            auth_url=auth_url,
+            response_url=request.form['response_url'],
+            received_at=time.time()
         )
 
-    music_service = ServiceFactory.from_enum(platform_enum)(credentials=credentials)
-
-    playlist = Playlist.query.filter_by(
-        user_id=user.id,
-        name=playlist_name,
-        platform=platform_enum,
-        channel_id=channel_id
-    ).first()
-    if playlist:
-        return "Found a playlist %s (%s) for %s in this channel already" % (
-            playlist_name, platform_enum.name.title(), slack_user_name)
-
-    success, playlist_snippet = music_service.create_playlist(playlist_name=playlist_name)
-    if not success:
-        return "Unable to create playlist", 200
-
-    playlist = Playlist(
-        name=playlist_name,
-        channel_id=channel_id,
-        platform=platform_enum,
-        platform_id=playlist_snippet['id'],
-        user_id=user.id
-    )
-    playlist.save()
-
-    return "Created playlist %s for %s in this channel!" % (
-        playlist_name, slack_user_name), 200
+        return "Creating %s playlist %s..." % (platform_enum.name.title(), playlist_name), 200
 
 
-# NOTE: no longer supporting this
 @application.route('/scrape_music/', methods=['POST'])
 @verified_slack_request
 def scrape_music():
-    # TODO
-    return "Not yet supported in Slacktunes V3", 200
-
+    if request.form.get('channel_name') == 'directmessage':
+        return "Can't scrape music in private channel", 200
 
-@application.route("/delete_playlist/", methods=['POST'])
-@verified_slack_request
-def delete_playlist():
     channel_id = request.form['channel_id']
-    channel_name = request.form['channel_name']
-    slack_user_id = request.form['user_id']
-    command_text_args = request.form['text'].split()
-
-    if channel_name == 'directmessage':
-        return "Can't delete playlist in private channel", 200
+    if not Playlist.query.filter_by(channel_id=channel_id).first():
+        return "No playlists in this channel to add music to", 200
 
-    if not command_text_args:
-        return "Specify the name and platform of the playlist to delete", 200
+    backfill = ChannelBackfill.query.filter_by(channel_id=channel_id).first()
+    if backfill and backfill.is_finished:
+        return "Already scraped the history of this channel", 200
 
-    playlist_name = command_text_args[0]
-    user = User.query.filter_by(slack_id=slack_user_id).first()
-    if not user:
-        return "No record of you, %s. Are you sure you have a playlist in this channel?", 200
+    run_id = ChannelBackfill.claim_run(channel_id)
+    if not run_id:
+        return "Already scraping the history of this channel", 200
 
-    playlists = Playlist.query.filter_by(user_id=user.id, channel_id=channel_id)
-    if not playlists:
-        return "No playlists found in this channel that belong to you", 200
+    # CELERY
+    scrape_channel_history.delay(channel=channel_id, run_id=run_id)
 
-    playlist_to_delete = [pl for pl in playlists if pl.name == playlist_name]
+    return "Scraping channel history for music. This might take a while...", 200
 
-    if len(command_text_args) > 1:
-        platform_name = command_text_args[1]
-        platform_enum = Platform.from_string(platform_name)
-        playlist_to_delete = [pl for pl in playlist_to_delete if pl.platform is platform_enum]
 
-    if not playlist_to_delete:
-        existing_in_channel = "\n".join(
-            "%s (%s)" % (p.name, p.platform.name.title())
-            for p in playlists
-        )
-        return (
-            "Couldn't find a playlist named %s... I see these: \n%s" % (
-                playlist_name,
-                existing_in_channel
-            ),
-            200
-        )
+@application.route("/delete_playlist/", methods=['POST'])
+@verified_slack_request
+def delete_playlist():
+    """
+    Acks right away; delete_playlist_from_command replies through the command's response_url
+    """
+    with timed_ack('delete_playlist'):
+        channel_id = request.form['channel_id']
+        channel_name = request.form['channel_name']
+        command_text_args = request.form['text'].split()
 
-    if len(playlist_to_delete) > 1:
-        return (
-            "More than one playlist matching name %s ... Try specifying the platform" % playlist_name,
-            200
-        )
+        if channel_name == 'directmessage':
+            return "Can't delete playlist in private channel", 200
 
-    playlist_to_delete = playlist_to_delete[0]
+        if not command_text_args:
+            return "Specify the name and platform of the playlist to delete", 200
 
-    platform = playlist_to_delete.platform
-    playlist_to_delete.delete()
+        platform_name = None
+        if len(command_text_args) > 1:
+            try:
+                platform_name = Platform.from_string(command_text_args[1]).name
+            except InvalidEnumException:
+                return "Unknown platform %s" % command_text_args[1], 200
+
+        # CELERY
+        delete_playlist_from_command.delay(
+            channel_id=channel_id,
+            channel_name=channel_name,
+            slack_user_id=request.form['user_id'],
+            slack_user_name=request.form['user_name'],
+            playlist_name=command_text_args[0],
+            platform=platform_name,
+            response_url=request.form['response_url'],
+            received_at=time.time()
+        )
 
-    return "Deleted slacktunes record of *%s* in channel *%s* \n" \
-        "Keep in mind, this won't delete the %s version, it'll only stop slacktunes" \
-        "from posting links to it" % (playlist_name, channel_name, platform.name.title()), 200
+        return "Deleting playlist %s..." % command_text_args[0], 200
 
 
 @application.route("/add_track/", methods=['POST'])
@@ -382,13 +393,32 @@ def slack_events():
     if not links:
         return "No links in event", 200
 
-    link = links[0].get('url')
+    links = [l.get('url') for l in links if l.get('url')]
+
+    # slack retries events it thinks we were too slow to ack
+    event_id = request_data_dict.get('event_id')
+    if event_id and not seen_slack_events.add(event_id):
+        print("Dropping retried event %s" % event_id)
+        return "Ok", 200
+
+    # and the same track can be shared again (or unfurled twice) in quick succession
+    links = [l for l in links if seen_shared_links.add((channel, link_key(l)))]
+    if not links:
+        return "Ok", 200
 
     # CELERY
-    print("Adding link %s to playilists" % link)
-    add_link_to_playlists.delay(
-        link=link,
-        channel=channel
-    )
+    print("Adding links %s to playilists" % ", ".join(links))
+    try:
+        add_links_to_playlists.delay(
+            links=links,
+            channel=channel
+        )
+    except Exception:
+        # so slack's retry isn't dropped as a repeat
+        if event_id:
+            seen_slack_events.discard(event_id)
+        for l in links:
+            seen_shared_links.discard((channel, link_key(l)))
+        raise
 
     return "Ok", 200
@@ -1,7 +1,15 @@
+import asyncio
 import copy
 
+import httplib2
+import redis
+from aiohttp import web
+from apiclient.errors import HttpError
+from spotipy.client import SpotifyException
+
 from .json_fakes import (
     SPOTIFY_ADD_TRACK_RESPONSE,
+    SPOTIFY_PLAYLIST_SNAPSHOT_RESP,
     SPOTIFY_PLAYLIST_TRACKS_RESP,
     SPOTIFY_SEARCH_RESULTS,
     SPOTIFY_TRACK_RESP,
@@ -29,13 +37,41 @@ def get_yerself_an_executor(expected, default):
 
     return FakeExecutor
 
+
+class FakeConditionalRequest(object):
+    """
+    An executor that answers like youtube does to an If-None-Match header matching the response's etag
+    """
+
+    def __init__(self, expected, default):
+        self.expected = expected
+        self.default = default
+        self.headers = {}
+
+    def execute(self):
+        response = self.default
+        if self.expected:
+            if callable(self.expected):
+                self.expected()
+            response = self.expected
+
+        etag = response.get('etag')
+        if etag and self.headers.get('If-None-Match') == etag:
+            raise HttpError(httplib2.Response({'status': 304}), b'')
+
+        return response
+
+
 class FakeYoutubeClient(object):
     def __init__(self, *args, **kwargs):
         expected_responses = kwargs.pop('expected_responses', {})
 
         self.expected_responses = expected_responses
+        self.playlist_item_list_calls = []
         self.playlist_item_insert_calls = []
         self.playlist_insert_calls = []
+        self.playlists_list_calls = []
+        self.channels_list_calls = 0
 
     def videos(self):
         expected_response = self.expected_responses.get('videos_list')
@@ -59,6 +95,8 @@ class FakeYoutubeClient(object):
 
             @classmethod
             def list(cls, **kwargs):
+                self.playlist_item_list_calls.append(kwargs)
+
                 return get_yerself_an_executor(
                     expected=expected_list_response,
                     default=YOUTUBE_PLAYLIST_ITEMS_LIST_RESPONSE
@@ -104,6 +142,7 @@ class FakeYoutubeClient(object):
         class FakeList(object):
             @classmethod
             def list(cls, part, mine):
+                self.channels_list_calls += 1
                 return get_yerself_an_executor(
                     expected=expected_list_response,
                     default={"items": [{"id": 123}]}
@@ -118,11 +157,22 @@ class FakeYoutubeClient(object):
         class FakePlaylists(object):
             @classmethod
             def list(cls, *args, **kwargs):
-                return get_yerself_an_executor(
+                self.playlists_list_calls.append(kwargs)
+                if 'id' in kwargs:
+                    return get_yerself_an_executor(
+                        expected=self.expected_responses.get('playlists_list_by_id'),
+                        default={'items': [
+                            {'id': kwargs['id'], 'snippet': {'title': title}}
+                            for playlist_id, title in (('playlist1id', 'Playlist1'), ('playlist2id', 'Playlist2'))
+                            if playlist_id == kwargs['id']
+                        ]}
+                    )
+
+                return FakeConditionalRequest(
                     expected=expected_list_response,
-                    default={'items': [
-                        {'snippet': {'title': 'Playlist1'}},
-                        {'snippet': {'title': 'Playlist2'}},
+                    default={'etag': 'playlists-etag', 'items': [
+                        {'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}},
+                        {'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}},
                     ]}
                 )
 
@@ -154,6 +204,9 @@ class FakeSpotifyClient(object):
         self.nexted = False
         self.expected_responses = expected_responses
         self.add_track_calls = []
+        self.user_playlist_calls = []
+        self.user_playlist_tracks_calls = []
+        self.user_playlists_calls = 0
 
     def me(self):
         expected_response = self.expected_responses.get('me')
@@ -182,8 +235,10 @@ class FakeSpotifyClient(object):
                 return expected_response
             return expected_response
 
+        self.user_playlists_calls += 1
+
         # TODO: improve if you care
-        return {'items': [{'name': 'Playlist1'}, {'name': 'Playlist2'}]}
+        return {'items': [{'id': 'playlist1id', 'name': 'Playlist1'}, {'id': 'playlist2id', 'name': 'Playlist2'}]}
 
     def user_playlist_create(self, user, name):
         expected_response = self.expected_responses.get('user_playlist_create')
@@ -192,10 +247,29 @@ class FakeSpotifyClient(object):
                 return expected_response()
             return expected_response
 
-        return {'name': name}
+        return {'id': 'newplaylistid', 'name': name}
+
+    def user_playlist(self, user, playlist_id, fields=None):
+        expected_response = self.expected_responses.get('user_playlist')
+        self.user_playlist_calls.append(playlist_id)
+
+        if 'user_playlist' in self.expected_responses:
+            # might be an exception
+            if callable(expected_response):
+                expected_response()
+            return expected_response
+
+        if fields == 'name':
+            names = {'playlist1id': 'Playlist1', 'playlist2id': 'Playlist2'}
+            if playlist_id not in names:
+                raise SpotifyException(404, -1, 'Not found')
+            return {'name': names[playlist_id]}
+
+        return SPOTIFY_PLAYLIST_SNAPSHOT_RESP
 
     def user_playlist_tracks(self, user, playlist_id):
         expected_response = self.expected_responses.get('user_playlist_tracks')
+        self.user_playlist_tracks_calls.append(playlist_id)
         if 'user_playlist_tracks' in self.expected_responses:
             # might be an exception
             if callable(expected_response):
@@ -242,3 +316,210 @@ class FakeSpotifyClient(object):
         self.nexted = True
 
         return SPOTIFY_PLAYLIST_TRACKS_RESP
+
+
+class FakeRedis(object):
+    """
+    Only keys set with px expire, and only if there's a clock (in seconds) to expire them by
+    """
+
+    def __init__(self, fail=False, clock=None):
+        self.data = {}
+        self.fail = fail
+        self.clock = clock
+        self.expires_at = {}
+
+    def _expire_keys(self):
+        if not self.clock:
+            return
+        for key, expires_at in list(self.expires_at.items()):
+            if self.clock() >= expires_at:
+                self.data.pop(key, None)
+                self.expires_at.pop(key)
+
+    def get(self, key):
+        if self.fail:
+            raise redis.ConnectionError('nope')
+        self._expire_keys()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        if self.fail:
+            raise redis.ConnectionError('nope')
+        self._expire_keys()
+        if nx and key in self.data:
+            return None
+        self.data[key] = value.encode('utf-8')
+        self.expires_at.pop(key, None)
+        if px and self.clock:
+            self.expires_at[key] = self.clock() + px / 1000.0
+        return True
+
+    def pttl(self, key):
+        if self.fail:
+            raise redis.ConnectionError('nope')
+        self._expire_keys()
+        if key not in self.data:
+            return -2
+        if key not in self.expires_at:
+            return -1
+        return int(round((self.expires_at[key] - self.clock()) * 1000))
+
+    def pexpire(self, key, milliseconds):
+        if self.clock and key in self.data:
+            self.expires_at[key] = self.clock() + milliseconds / 1000.0
+        return key in self.data
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incrby(self, key, amount):
+        if self.fail:
+            raise redis.ConnectionError('nope')
+        value = int(self.data.get(key, 0)) + amount
+        self.data[key] = str(value).encode('utf-8')
+        return value
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def pipeline(self):
+        return FakeRedisPipeline(self)
+
+
+class FakeRedisPipeline(object):
+    def __init__(self, fake_redis):
+        self.fake_redis = fake_redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.fake_redis, name), args, kwargs))
+        return queue
+
+    def execute(self):
+        return [func(*args, **kwargs) for func, args, kwargs in self.calls]
+
+
+class FakeAPIServer(object):
+    """
+    An aiohttp app serving canned json for the async services. routes maps
+    (method, path) to a response dict, or to fn(request, body) returning one
+    (or an aiohttp response). Every request is recorded.
+    """
+
+    def __init__(self, routes, delay=0):
+        self.requests = []
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = web.Application()
+        for (method, path), response in routes.items():
+            self.app.router.add_route(method, path, self._handler(response))
+
+    def _handler(self, response):
+        async def handle(request):
+            body = await request.json() if request.can_read_body else None
+            self.requests.append(FakeAPIRequest(request, body))
+
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+            finally:
+                self.in_flight -= 1
+
+            resp = response(request, body) if callable(response) else response
+            if isinstance(resp, web.StreamResponse):
+                return resp
+
+            return web.json_response(resp)
+
+        return handle
+
+    def requests_to(self, method, path):
+        return [r for r in self.requests if (r.method, r.path) == (method, path)]
+
+
+class FakeAPIRequest(object):
+    def __init__(self, request, body):
+        self.method = request.method
+        self.path = request.path
+        self.query = dict(request.query)
+        self.headers = dict(request.headers)
+        self.body = body
+
+
+def fake_youtube_server(overrides=None, delay=0):
+    def playlists_list(request, body):
+        if 'id' in request.query:
+            return {'items': [{'id': request.query['id'], 'snippet': {'title': 'Playlist1'}}]}
+
+        if request.headers.get('If-None-Match') == 'playlists-etag':
+            return web.Response(status=304)
+
+        return {'etag': 'playlists-etag', 'items': [
+            {'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}},
+            {'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}},
+        ]}
+
+    def playlists_insert(request, body):
+        response = copy.deepcopy(YOUTUBE_PLAYLIST_INSERT_RESPONSE)
+        response['snippet']['title'] = body['snippet']['title']
+        return response
+
+    routes = {
+        ('GET', '/youtube/v3/videos'): YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE,
+        ('GET', '/youtube/v3/playlistItems'): YOUTUBE_PLAYLIST_ITEMS_LIST_RESPONSE,
+        ('POST', '/youtube/v3/playlistItems'): {'kind': 'youtube#playlistItem'},
+        ('GET', '/youtube/v3/search'): YOTUBE_SEARCH_LIST_RESPONSE,
+        ('GET', '/youtube/v3/channels'): {'items': [{'id': 'UC123'}]},
+        ('GET', '/youtube/v3/playlists'): playlists_list,
+        ('POST', '/youtube/v3/playlists'): playlists_insert,
+    }
+    routes.update(overrides or {})
+
+    return FakeAPIServer(routes, delay=delay)
+
+
+def fake_spotify_server(overrides=None, delay=0):
+    search_results = copy.deepcopy(SPOTIFY_SEARCH_RESULTS)
+    # no more pages
+    search_results['tracks']['next'] = None
+
+    def add_tracks(request, body):
+        return web.json_response(SPOTIFY_ADD_TRACK_RESPONSE, status=201)
+
+    playlist_names = {'playlist1id': 'Playlist1', 'playlist2id': 'Playlist2'}
+
+    def get_playlist(request, body):
+        if request.query.get('fields') != 'name':
+            return SPOTIFY_PLAYLIST_SNAPSHOT_RESP
+
+        playlist_id = request.match_info['playlist_id']
+        if playlist_id not in playlist_names:
+            return web.json_response({'error': {'status': 404, 'message': 'Not found.'}}, status=404)
+        return {'name': playlist_names[playlist_id]}
+
+    def create_playlist(request, body):
+        playlist_names['newplaylistid'] = body['name']
+        return web.json_response({'id': 'newplaylistid', 'name': body['name']}, status=201)
+
+    routes = {
+        ('GET', '/v1/me'): SPOTIFY_USER_RESP,
+        ('GET', '/v1/tracks/{track_id}'): SPOTIFY_TRACK_RESP,
+        ('GET', '/v1/playlists/{playlist_id}'): get_playlist,
+        ('GET', '/v1/playlists/{playlist_id}/tracks'): SPOTIFY_PLAYLIST_TRACKS_RESP,
+        ('POST', '/v1/playlists/{playlist_id}/tracks'): add_tracks,
+        ('GET', '/v1/search'): search_results,
+        ('GET', '/v1/users/{user_id}/playlists'): {'next': None, 'items': [
+            {'id': 'playlist1id', 'name': 'Playlist1'},
+            {'id': 'playlist2id', 'name': 'Playlist2'},
+        ]},
+        ('POST', '/v1/users/{user_id}/playlists'): create_playlist,
+    }
+    routes.update(overrides or {})
+
+    return FakeAPIServer(routes, delay=delay)
+
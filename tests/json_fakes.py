@@ -122,6 +122,10 @@ SPOTIFY_ADD_TRACK_RESPONSE = {
   "snapshot_id": "NTEsZDU1YTRlZjRhNThhZGYzOGQzMjU3MDI4Njg2ODE3YmI2MWRkMGY3OQ=="
 }
 
+SPOTIFY_PLAYLIST_SNAPSHOT_RESP = {
+  "snapshot_id": "NTAsMmQ0YjFmZjA2YzlkNDc1ZjNmYTc4ZGYxNzI0MzU1ZDc5YzZlZmU1Mw=="
+}
+
 SPOTIFY_SEARCH_RESULTS = {
   "tracks": {
     "href": "https://api.spotify.com/v1/search?query=this+love&type=track&market=US&offset=0&limit=3",
@@ -485,6 +489,10 @@ YOUTUBE_PLAYLIST_ITEMS_LIST_RESPONSE = {
                 "kind": "youtube#video",
                 "videoId": "XPpTgCho5ZA"
             }
+        },
+        "contentDetails": {
+            "videoId": "XPpTgCho5ZA",
+            "videoPublishedAt": "2009-06-17T05:22:13.000Z"
         }
     }]
 }
@@ -642,3 +650,452 @@ YOUTUBE_PLAYLIST_INSERT_RESPONSE = {
             "privacyStatus": "private"
     }
 }
+
+
+# recorded Spotify searches (trimmed to the fields best_match uses) for scoring regressions
+SPOTIFY_SEARCH_REGRESSION_CORPUS = [
+    {
+        "target": "Maroon 5 - This Love (Official Music Video)",
+        "description": "Maroon 5 - This Love (Official Music Video) Songs About Jane",
+        "channel_title": "Maroon5VEVO",
+        "items": [
+            {
+                "id": "6ECp64rv50XVz93WvxXMGF",
+                "name": "This Love",
+                "artists": [
+                    {
+                        "name": "Maroon 5"
+                    }
+                ],
+                "popularity": 75
+            },
+            {
+                "id": "4Y45aqo9QMa57rDsAJv40A",
+                "name": "This Love - Live",
+                "artists": [
+                    {
+                        "name": "Maroon 5"
+                    }
+                ],
+                "popularity": 41
+            },
+            {
+                "id": "0D2nxvrXgMOOplH3xA3jzq",
+                "name": "This Love",
+                "artists": [
+                    {
+                        "name": "Taylor Swift"
+                    }
+                ],
+                "popularity": 62
+            },
+            {
+                "id": "2S1LebN6AXXQqJolBxlWgO",
+                "name": "Kill This Love",
+                "artists": [
+                    {
+                        "name": "BLACKPINK"
+                    }
+                ],
+                "popularity": 81
+            }
+        ]
+    },
+    {
+        "target": "Daft Punk - Get Lucky (Official Audio) ft. Pharrell Williams, Nile Rodgers",
+        "description": "Daft Punk's official audio for Get Lucky featuring Pharrell Williams and Nile Rodgers",
+        "channel_title": "DaftPunkVEVO",
+        "items": [
+            {
+                "id": "69kOkLUCkxIZYexIgSG8rq",
+                "name": "Get Lucky (feat. Pharrell Williams & Nile Rodgers)",
+                "artists": [
+                    {
+                        "name": "Daft Punk"
+                    },
+                    {
+                        "name": "Pharrell Williams"
+                    },
+                    {
+                        "name": "Nile Rodgers"
+                    }
+                ],
+                "popularity": 80
+            },
+            {
+                "id": "2Foc5Q5nqNiosCNqttzHof",
+                "name": "Get Lucky (Radio Edit) [feat. Pharrell Williams and Nile Rodgers]",
+                "artists": [
+                    {
+                        "name": "Daft Punk"
+                    },
+                    {
+                        "name": "Pharrell Williams"
+                    },
+                    {
+                        "name": "Nile Rodgers"
+                    }
+                ],
+                "popularity": 79
+            },
+            {
+                "id": "5nNmj1cLH3r4aA4XDJ2bgY",
+                "name": "Get Lucky",
+                "artists": [
+                    {
+                        "name": "Daft Punk"
+                    }
+                ],
+                "popularity": 55
+            },
+            {
+                "id": "1ZvOc3t9gG0H2zZkhCMhU4",
+                "name": "Get Lucky - Cover",
+                "artists": [
+                    {
+                        "name": "Karaoke Kings"
+                    }
+                ],
+                "popularity": 4
+            }
+        ]
+    },
+    {
+        "target": "Queen - Don't Stop Me Now (Official Video)",
+        "description": "Taken from Jazz, 1978",
+        "channel_title": "Queen Official",
+        "items": [
+            {
+                "id": "5T8EDUDqKcs6OSOwEsfqG7",
+                "name": "Don't Stop Me Now - Remastered 2011",
+                "artists": [
+                    {
+                        "name": "Queen"
+                    }
+                ],
+                "popularity": 84
+            },
+            {
+                "id": "7hQJA50XrCWABAu5v6QZ4i",
+                "name": "Don't Stop Me Now",
+                "artists": [
+                    {
+                        "name": "Queen"
+                    }
+                ],
+                "popularity": 66
+            },
+            {
+                "id": "0YjW3iCKb8c4VQMZYoJQU6",
+                "name": "Don't Stop Me Now",
+                "artists": [
+                    {
+                        "name": "Glee Cast"
+                    }
+                ],
+                "popularity": 48
+            },
+            {
+                "id": "1PX4G3wJ7s1uN1JtYc0j8w",
+                "name": "Dont Stop Me Now",
+                "artists": [
+                    {
+                        "name": "McFly"
+                    }
+                ],
+                "popularity": 30
+            }
+        ]
+    },
+    {
+        "target": "Bob Marley - Is This Love",
+        "description": "Bob Marley & The Wailers - Is This Love from Kaya",
+        "channel_title": "BobMarleyVEVO",
+        "items": [
+            {
+                "id": "6JRLFiX9NJSoRRKxowlBYr",
+                "name": "Is This Love",
+                "artists": [
+                    {
+                        "name": "Bob Marley & The Wailers"
+                    }
+                ],
+                "popularity": 74
+            },
+            {
+                "id": "5mgrlpzVrVwNOX1R2YMJN0",
+                "name": "Is This Love",
+                "artists": [
+                    {
+                        "name": "Whitesnake"
+                    }
+                ],
+                "popularity": 64
+            },
+            {
+                "id": "3gg6W1BRzGTHrT0Jb5Xwji",
+                "name": "Is This Love - Live",
+                "artists": [
+                    {
+                        "name": "Bob Marley & The Wailers"
+                    }
+                ],
+                "popularity": 33
+            }
+        ]
+    },
+    {
+        "target": "Fleetwood Mac - Dreams (Official Music Video) [HD Remaster]",
+        "description": "",
+        "channel_title": "Fleetwood Mac",
+        "items": [
+            {
+                "id": "0ofHAoxe9vBkTCp2UQIavz",
+                "name": "Dreams - 2004 Remaster",
+                "artists": [
+                    {
+                        "name": "Fleetwood Mac"
+                    }
+                ],
+                "popularity": 86
+            },
+            {
+                "id": "4kDdbV3ygyCfn3pCBJxZjq",
+                "name": "Dreams",
+                "artists": [
+                    {
+                        "name": "The Cranberries"
+                    }
+                ],
+                "popularity": 71
+            },
+            {
+                "id": "6kUYYkNLCx9DjwQOQ6iNn8",
+                "name": "Dreams",
+                "artists": [
+                    {
+                        "name": "Fleetwood Mac"
+                    }
+                ],
+                "popularity": 58
+            },
+            {
+                "id": "2eCL3d0hHiZcmOTOFfEazr",
+                "name": "Dreams",
+                "artists": [
+                    {
+                        "name": "Fleetwood Mac"
+                    }
+                ],
+                "popularity": 12
+            }
+        ]
+    },
+    {
+        "target": "Tame Impala | The Less I Know The Better (Official Video)",
+        "description": "The Less I Know The Better by Tame Impala from Currents",
+        "channel_title": "tameimpalaVEVO",
+        "items": [
+            {
+                "id": "6K4t31amVTZDgR3sKmwUJJ",
+                "name": "The Less I Know The Better",
+                "artists": [
+                    {
+                        "name": "Tame Impala"
+                    }
+                ],
+                "popularity": 85
+            },
+            {
+                "id": "3mnbqSvS1dgwFJbvJUOrIa",
+                "name": "The Less I Know the Better - Mild High Club Remix",
+                "artists": [
+                    {
+                        "name": "Tame Impala"
+                    },
+                    {
+                        "name": "Mild High Club"
+                    }
+                ],
+                "popularity": 45
+            }
+        ]
+    },
+    {
+        "target": "Dreams",
+        "description": "",
+        "channel_title": "",
+        "items": [
+            {
+                "id": "0ofHAoxe9vBkTCp2UQIavz",
+                "name": "Dreams - 2004 Remaster",
+                "artists": [
+                    {
+                        "name": "Fleetwood Mac"
+                    }
+                ],
+                "popularity": 86
+            },
+            {
+                "id": "4kDdbV3ygyCfn3pCBJxZjq",
+                "name": "Dreams",
+                "artists": [
+                    {
+                        "name": "The Cranberries"
+                    }
+                ],
+                "popularity": 71
+            },
+            {
+                "id": "5gPDfyfuC7GOaE3XGBAwkx",
+                "name": "Dreams",
+                "artists": [
+                    {
+                        "name": "Beck"
+                    }
+                ],
+                "popularity": 40
+            }
+        ]
+    },
+    {
+        "target": "Kacey Musgraves - Slow Burn (Audio)",
+        "description": "Music video by Kacey Musgraves performing Slow Burn",
+        "channel_title": "KaceyMusgravesVEVO",
+        "items": [
+            {
+                "id": "6ilc4vQcwMPlvAHFfsTGng",
+                "name": "Slow Burn",
+                "artists": [
+                    {
+                        "name": "Kacey Musgraves"
+                    }
+                ],
+                "popularity": 63
+            },
+            {
+                "id": "0aBCw0iT9hJ8sp1A7GDjcr",
+                "name": "Slow Burn",
+                "artists": [
+                    {
+                        "name": "David Bowie"
+                    }
+                ],
+                "popularity": 35
+            },
+            {
+                "id": "2JtRZMWcYzRPN5GNYhh8B3",
+                "name": "Slow Burn",
+                "artists": [
+                    {
+                        "name": "Kacey Musgraves"
+                    }
+                ],
+                "popularity": 20
+            }
+        ]
+    },
+    {
+        "target": "Mitski - Nobody (Official Video)",
+        "description": "",
+        "channel_title": "Mitski",
+        "items": [
+            {
+                "id": "2P5yIMu2DNeMXTyOANKS6k",
+                "name": "Nobody",
+                "artists": [
+                    {
+                        "name": "Mitski"
+                    }
+                ],
+                "popularity": 78
+            },
+            {
+                "id": "1ZtCjaBEebC9ecAzMyWUAx",
+                "name": "Nobody",
+                "artists": [
+                    {
+                        "name": "Keith Sweat"
+                    },
+                    {
+                        "name": "Athena Cage"
+                    }
+                ],
+                "popularity": 50
+            },
+            {
+                "id": "0XBYGx5pjUdo7YW3gPBORm",
+                "name": "Nobody But Me",
+                "artists": [
+                    {
+                        "name": "Michael Bublé"
+                    }
+                ],
+                "popularity": 55
+            }
+        ]
+    },
+    {
+        "target": "Björk - Army of Me (Official Music Video) HD",
+        "description": "Björk's video for Army of Me from Post",
+        "channel_title": "björk",
+        "items": [
+            {
+                "id": "4c3nMJPXtbYC6khy2hzJlo",
+                "name": "Army of Me",
+                "artists": [
+                    {
+                        "name": "Björk"
+                    }
+                ],
+                "popularity": 52
+            },
+            {
+                "id": "2vb1ZEdrDEBKaq2L6EAOhe",
+                "name": "Army Of Me",
+                "artists": [
+                    {
+                        "name": "Bjork"
+                    }
+                ],
+                "popularity": 10
+            }
+        ]
+    }
+]
+
+# recorded Youtube search titles for scoring regressions
+YOUTUBE_SEARCH_REGRESSION_CORPUS = [
+    {
+        "target": "This Love Maroon 5",
+        "titles": [
+            "Maroon 5 - This Love (Official Music Video)",
+            "Maroon 5 - This Love (lyrics)",
+            "This Love - Maroon 5",
+            "Kill This Love - BLACKPINK"
+        ]
+    },
+    {
+        "target": "Get Lucky Daft Punk Pharrell Williams Nile Rodgers",
+        "titles": [
+            "Daft Punk - Get Lucky (Official Audio) ft. Pharrell Williams, Nile Rodgers",
+            "Get Lucky - Daft Punk (Lyrics)",
+            "Daft Punk - Get Lucky (Full Video)"
+        ]
+    },
+    {
+        "target": "Dreams Fleetwood Mac",
+        "titles": [
+            "The Cranberries - Dreams (Official Music Video)",
+            "Fleetwood Mac - Dreams (Official Music Video)",
+            "Dreams - Fleetwood Mac (Lyrics)"
+        ]
+    },
+    {
+        "target": "Army of Me Björk",
+        "titles": [
+            "Björk - Army of Me (Official Music Video) HD",
+            "bjork army of me live"
+        ]
+    }
+]
@@ -0,0 +1,459 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from oauth2client.client import AccessTokenCredentials
+
+from src.async_music_services import (
+    AsyncSpotifyService,
+    AsyncYoutubeService,
+    client_session,
+    gather_limited,
+)
+from src.cache import TieredCache
+from src.constants import DUPLICATE_TRACK, Platform
+from src.models import Playlist
+from src.music_services import SpotifyService, TrackInfo, YoutubeService
+from src.quota import QuotaAccountant, QuotaExhaustedError
+from tests.fakes import FakeSpotifyClient, FakeYoutubeClient, fake_spotify_server, fake_youtube_server
+from tests.json_fakes import SPOTIFY_ADD_TRACK_RESPONSE, YOUTUBE_PLAYLIST_INSERT_RESPONSE
+
+YOUTUBE_LINK = "https://youtu.be/XPpTgCho5ZA"
+SPOTIFY_LINK = "https://open.spotify.com/track/6ECp64rv50XVz93WvxXMGF"
+
+
+class AsyncServiceTestBase(unittest.TestCase):
+    def setUp(self):
+        self.cache_patcher = patch(
+            'src.music_services.playlist_index_cache',
+            TieredCache(namespace='test', maxsize=10, ttl=60, use_redis=False)
+        )
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def run_against(self, server, test):
+        """
+        Runs test(service) against server on a fresh event loop
+        """
+        async def run():
+            test_server = TestServer(server.app)
+            await test_server.start_server()
+            try:
+                async with client_session() as session:
+                    return await test(self.make_service(session, str(test_server.make_url(self.API_PATH))))
+            finally:
+                await test_server.close()
+
+        return asyncio.run(run())
+
+
+class AsyncYoutubeServiceTestCase(AsyncServiceTestBase):
+    API_PATH = '/youtube/v3'
+
+    def setUp(self):
+        super(AsyncYoutubeServiceTestCase, self).setUp()
+
+        self.quota = QuotaAccountant(namespace='yt', daily_budget=1000, use_redis=False)
+        self.quota_patcher = patch('src.async_music_services.youtube_quota', self.quota)
+        self.quota_patcher.start()
+
+        self.playlist = Playlist(
+            name='yt',
+            channel_id='123',
+            platform=Platform.YOUTUBE,
+            platform_id='abc123',
+            user_id=1
+        )
+
+    def tearDown(self):
+        super(AsyncYoutubeServiceTestCase, self).tearDown()
+
+        self.quota_patcher.stop()
+
+    def make_service(self, session, base_url):
+        return AsyncYoutubeService(
+            credentials=AccessTokenCredentials('token', 'slacktunes-tests'),
+            session=session,
+            base_url=base_url,
+            owner_id=1
+        )
+
+    def test_get_track_info_from_link(self):
+        server = fake_youtube_server()
+
+        track_info = self.run_against(server, lambda service: service.get_track_info_from_link(YOUTUBE_LINK))
+
+        self.assertEqual(track_info.track_id, 'XPpTgCho5ZA')
+        self.assertEqual(track_info.name, 'Maroon 5 - This Love (Official Music Video)')
+        self.assertEqual(server.requests[0].headers['Authorization'], 'Bearer token')
+        self.assertEqual(self.quota.used(), 1)
+
+    def test_quota_charged_off_the_event_loop(self):
+        charge_threads = []
+        charge = self.quota.charge
+
+        def record_thread(cost):
+            charge_threads.append(threading.current_thread())
+            return charge(cost)
+
+        with patch.object(self.quota, 'charge', side_effect=record_thread):
+            self.run_against(fake_youtube_server(), lambda service: service.get_track_info_from_link(YOUTUBE_LINK))
+
+        # asyncio.run runs the loop on this thread
+        self.assertEqual(len(charge_threads), 1)
+        self.assertIsNot(charge_threads[0], threading.current_thread())
+        self.assertEqual(self.quota.used(), 1)
+
+    def test_get_track_ids_in_playlist_pages(self):
+        def playlist_items(request, body):
+            if request.query.get('pageToken') == 'page2':
+                return {'items': [{'contentDetails': {'videoId': 'bbbbbbbbbbb'}}]}
+
+            return {'nextPageToken': 'page2', 'items': [{'contentDetails': {'videoId': 'aaaaaaaaaaa'}}]}
+
+        server = fake_youtube_server(overrides={('GET', '/youtube/v3/playlistItems'): playlist_items})
+
+        track_ids = self.run_against(server, lambda service: service.get_track_ids_in_playlist(self.playlist))
+
+        self.assertEqual(track_ids, {'aaaaaaaaaaa', 'bbbbbbbbbbb'})
+        self.assertEqual(server.requests[0].query['fields'], 'nextPageToken,items/contentDetails/videoId')
+
+    def test_add_tracks_to_playlist(self):
+        server = fake_youtube_server()
+        duplicate = TrackInfo(name='dupe', platform=Platform.YOUTUBE, track_id='XPpTgCho5ZA')
+        new_track = TrackInfo(name='new', platform=Platform.YOUTUBE, track_id='aaaaaaaaaaa')
+
+        successes, failures = self.run_against(server, lambda service: service.add_tracks_to_playlist(
+            track_infos=[duplicate, new_track, new_track],
+            playlist=self.playlist
+        ))
+
+        self.assertEqual(successes, [(new_track, None)])
+        self.assertEqual(failures, [(duplicate, DUPLICATE_TRACK), (new_track, DUPLICATE_TRACK)])
+
+        inserts = server.requests_to('POST', '/youtube/v3/playlistItems')
+        self.assertEqual(
+            [r.body['snippet']['resourceId']['videoId'] for r in inserts],
+            ['aaaaaaaaaaa']
+        )
+        self.assertEqual(self.quota.used(), 51)
+
+    def test_fuzzy_search_matches_sync_service(self):
+        expected = YoutubeService(credentials=True, client=FakeYoutubeClient()).fuzzy_search(track_name='this love')
+
+        match = self.run_against(fake_youtube_server(), lambda service: service.fuzzy_search(track_name='this love'))
+
+        self.assertEqual((match.track_id, match.match_score), (expected.track_id, expected.match_score))
+
+    def test_quota_exceeded(self):
+        server = fake_youtube_server(overrides={
+            ('GET', '/youtube/v3/search'): lambda request, body: web.json_response(
+                {'error': {'errors': [{'reason': 'quotaExceeded'}]}}, status=403)
+        })
+
+        with self.assertRaises(QuotaExhaustedError):
+            self.run_against(server, lambda service: service.fuzzy_search(track_name='this love'))
+        self.assertEqual(self.quota.remaining(), 0)
+
+    def test_create_playlist_revalidates_index(self):
+        server = fake_youtube_server()
+
+        async def create_twice(service):
+            return (
+                await service.create_playlist(playlist_name='sure thing'),
+                await service.create_playlist(playlist_name='sure thing'),
+            )
+
+        created, found = self.run_against(server, create_twice)
+
+        self.assertEqual(created[1]['id'], YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'])
+        self.assertEqual(found, (True, {'id': YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'], 'snippet': {'title': 'sure thing'}}))
+        self.assertEqual(len(server.requests_to('GET', '/youtube/v3/channels')), 1)
+        self.assertEqual(len(server.requests_to('POST', '/youtube/v3/playlists')), 1)
+        self.assertEqual(
+            server.requests_to('GET', '/youtube/v3/playlists')[1].headers['If-None-Match'],
+            'playlists-etag'
+        )
+
+    def test_multi_page_index_is_relisted(self):
+        def playlists_list(request, body):
+            if request.query.get('pageToken') == 'page2':
+                return {'items': [{'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}}]}
+
+            return {
+                'etag': 'page1-etag',
+                'nextPageToken': 'page2',
+                'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+            }
+
+        server = fake_youtube_server(overrides={('GET', '/youtube/v3/playlists'): playlists_list})
+
+        async def index_twice(service):
+            await service.get_playlist_index()
+            return await service.get_playlist_index()
+
+        index = self.run_against(server, index_twice)
+
+        self.assertEqual(sorted(index['playlists']), ['Playlist1', 'Playlist2'])
+        self.assertIsNone(index['etag'])
+        first_pages = [r for r in server.requests_to('GET', '/youtube/v3/playlists') if 'pageToken' not in r.query]
+        self.assertEqual(len(first_pages), 2)
+        self.assertNotIn('If-None-Match', first_pages[1].headers)
+
+    def test_multi_page_create_checks_hit(self):
+        def playlists_list(request, body):
+            if 'id' in request.query:
+                return {'items': [{'id': request.query['id'], 'snippet': {'title': 'Playlist1'}}]}
+            if request.query.get('pageToken') == 'page2':
+                return {'items': [{'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}}]}
+
+            return {
+                'etag': 'page1-etag',
+                'nextPageToken': 'page2',
+                'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+            }
+
+        server = fake_youtube_server(overrides={('GET', '/youtube/v3/playlists'): playlists_list})
+
+        async def index_then_create(service):
+            await service.get_playlist_index()
+            return await service.create_playlist(playlist_name='Playlist1')
+
+        result = self.run_against(server, index_then_create)
+
+        self.assertEqual(result, (True, {'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}))
+        lists = server.requests_to('GET', '/youtube/v3/playlists')
+        # two pages, then the one check by id
+        self.assertEqual(len(lists), 3)
+        self.assertEqual(lists[2].query['id'], 'playlist1id')
+
+    def paged_playlists_list(self, hit_title='Playlist1'):
+        def playlists_list(request, body):
+            if 'id' in request.query:
+                if not hit_title:
+                    return {'items': []}
+                return {'items': [{'id': request.query['id'], 'snippet': {'title': hit_title}}]}
+            if request.query.get('pageToken') == 'page2':
+                return {'items': [{'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}}]}
+
+            return {
+                'etag': 'page1-etag',
+                'nextPageToken': 'page2',
+                'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+            }
+
+        return playlists_list
+
+    def test_multi_page_create_miss_without_relisting(self):
+        server = fake_youtube_server(overrides={('GET', '/youtube/v3/playlists'): self.paged_playlists_list()})
+
+        async def index_then_create(service):
+            await service.get_playlist_index()
+            return await service.create_playlist(playlist_name='sure thing'), service.sync_service.cached_playlist_index()
+
+        (success, playlist), index = self.run_against(server, index_then_create)
+
+        self.assertTrue(success)
+        self.assertEqual(playlist['id'], YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'])
+        # just the two pages the index was built from
+        self.assertEqual(len(server.requests_to('GET', '/youtube/v3/playlists')), 2)
+        self.assertEqual(len(server.requests_to('POST', '/youtube/v3/playlists')), 1)
+        self.assertIn('sure thing', index['playlists'])
+
+    def test_multi_page_stale_hit_is_replaced(self):
+        # deleted since it was indexed
+        server = fake_youtube_server(overrides={
+            ('GET', '/youtube/v3/playlists'): self.paged_playlists_list(hit_title=None)
+        })
+
+        async def index_then_create(service):
+            await service.get_playlist_index()
+            return await service.create_playlist(playlist_name='Playlist1'), service.sync_service.cached_playlist_index()
+
+        (success, _), index = self.run_against(server, index_then_create)
+
+        self.assertTrue(success)
+        lists = server.requests_to('GET', '/youtube/v3/playlists')
+        # two pages, then the one check by id
+        self.assertEqual(len(lists), 3)
+        self.assertEqual(len(server.requests_to('POST', '/youtube/v3/playlists')), 1)
+        self.assertEqual(index['playlists']['Playlist1']['id'], YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'])
+
+    def test_lookups_overlap(self):
+        server = fake_youtube_server(delay=0.05)
+
+        results = self.run_against(server, lambda service: gather_limited(
+            [service.get_track_info_from_link(YOUTUBE_LINK) for _ in range(5)],
+            limit=5
+        ))
+
+        self.assertEqual([r.track_id for r in results], ['XPpTgCho5ZA'] * 5)
+        self.assertEqual(server.max_in_flight, 5)
+
+
+class AsyncSpotifyServiceTestCase(AsyncServiceTestBase):
+    API_PATH = '/v1'
+
+    def setUp(self):
+        super(AsyncSpotifyServiceTestCase, self).setUp()
+
+        self.playlist = Playlist(
+            name="Spot",
+            platform=Platform.SPOTIFY,
+            platform_id='abc123',
+            user_id=1,
+            channel_id='123'
+        )
+
+    def make_service(self, session, base_url):
+        return AsyncSpotifyService(
+            credentials={'access_token': 'token', 'expires_at': int(time.time()) + 3600},
+            session=session,
+            base_url=base_url,
+            owner_id=1
+        )
+
+    def sync_service(self):
+        fake_client = FakeSpotifyClient()
+        # don't want results from .next()
+        fake_client.nexted = True
+        return SpotifyService(credentials=True, client=fake_client)
+
+    def test_get_track_info_from_link(self):
+        server = fake_spotify_server()
+
+        track_info = self.run_against(server, lambda service: service.get_track_info_from_link(SPOTIFY_LINK))
+
+        self.assertEqual(track_info.name, 'This Love')
+        self.assertEqual(server.requests[0].path, '/v1/tracks/6ECp64rv50XVz93WvxXMGF')
+        self.assertEqual(server.requests[0].headers['Authorization'], 'Bearer token')
+
+    def test_get_track_ids_in_playlist_matches_sync_service(self):
+        track_ids = self.run_against(
+            fake_spotify_server(), lambda service: service.get_track_ids_in_playlist(self.playlist))
+
+        self.assertEqual(track_ids, self.sync_service().get_track_ids_in_playlist(self.playlist))
+
+    def test_get_track_ids_in_playlist_follows_next(self):
+        def tracks(request, body):
+            if request.query.get('offset'):
+                return {'next': None, 'items': [{'track': {'id': 'bbb'}}]}
+
+            return {
+                'next': str(request.url.with_query({'offset': 1})),
+                'items': [{'track': {'id': 'aaa'}}]
+            }
+
+        server = fake_spotify_server(overrides={('GET', '/v1/playlists/{playlist_id}/tracks'): tracks})
+
+        track_ids = self.run_against(server, lambda service: service.get_track_ids_in_playlist(self.playlist))
+
+        self.assertEqual(track_ids, {'aaa', 'bbb'})
+
+    def test_add_tracks_to_playlist_batches(self):
+        server = fake_spotify_server()
+        track_infos = [
+            TrackInfo(name=str(i), platform=Platform.SPOTIFY, track_id='track%s' % i)
+            for i in range(150)
+        ]
+
+        async def add(service):
+            result = await service.add_tracks_to_playlist(track_infos=track_infos, playlist=self.playlist)
+            return result, service.known_snapshot_id(self.playlist)
+
+        (successes, failures), snapshot_id = self.run_against(server, add)
+
+        self.assertEqual(len(successes), 150)
+        self.assertEqual(failures, [])
+        self.assertEqual(snapshot_id, SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id'])
+
+        inserts = server.requests_to('POST', '/v1/playlists/abc123/tracks')
+        self.assertEqual([len(r.body['uris']) for r in inserts], [100, 50])
+        self.assertEqual(inserts[0].body['uris'][0], 'spotify:track:track0')
+
+    def test_add_track_to_playlist_error(self):
+        server = fake_spotify_server(overrides={
+            ('POST', '/v1/playlists/{playlist_id}/tracks'): lambda request, body: web.json_response(
+                {'error': {'status': 403, 'message': 'You cannot add tracks to a playlist you don\'t own.'}},
+                status=403
+            )
+        })
+        track_info = TrackInfo(name='new', platform=Platform.SPOTIFY, track_id='aaa')
+
+        result = self.run_against(server, lambda service: service.add_track_to_playlist(
+            track_info=track_info, playlist=self.playlist))
+
+        self.assertEqual(result, (False, "You cannot add tracks to a playlist you don't own."))
+
+    def test_fuzzy_search_from_track_info_matches_sync_service(self):
+        track_info = TrackInfo(
+            name="Maroon 5 - This Love (Official Music Video)",
+            platform=Platform.YOUTUBE,
+            track_id="XPpTgCho5ZA"
+        )
+        expected = self.sync_service().fuzzy_search_from_track_info(track_info)
+
+        match = self.run_against(
+            fake_spotify_server(), lambda service: service.fuzzy_search_from_track_info(track_info))
+
+        self.assertEqual((match.track_id, match.match_score), (expected.track_id, expected.match_score))
+
+    def test_token_refresh_runs_off_the_loop(self):
+        refresh_threads = []
+
+        def fresh_spotify_credentials(credentials):
+            refresh_threads.append(threading.current_thread())
+            return dict(credentials, access_token='new', expires_at=int(time.time()) + 3600)
+
+        async def expired_token(service):
+            service.credentials_manager.credentials = {'access_token': 'old', 'expires_at': 0}
+            return await service.get_access_token()
+
+        with patch('src.oauth_wrappers.fresh_spotify_credentials', side_effect=fresh_spotify_credentials):
+            token = self.run_against(fake_spotify_server(), expired_token)
+
+        self.assertEqual(token, 'new')
+        self.assertIsNot(refresh_threads[0], threading.current_thread())
+
+    def test_create_playlist(self):
+        server = fake_spotify_server()
+
+        async def create(service):
+            return (
+                await service.create_playlist(playlist_name='Playlist1'),
+                await service.create_playlist(playlist_name='ok'),
+                await service.create_playlist(playlist_name='ok'),
+            )
+
+        existing, created, found = self.run_against(server, create)
+
+        self.assertEqual(existing, (True, {'id': 'playlist1id', 'name': 'Playlist1'}))
+        self.assertEqual(created, (True, {'id': 'newplaylistid', 'name': 'ok'}))
+        self.assertEqual(found, created)
+        self.assertEqual(len(server.requests_to('GET', '/v1/me')), 1)
+        self.assertEqual(
+            [r.body for r in server.requests_to('POST', '/v1/users/1213767627/playlists')],
+            [{'name': 'ok', 'public': True}]
+        )
+
+    def test_create_playlist_stale_hit_is_relisted(self):
+        server = fake_spotify_server()
+
+        async def create(service):
+            # deleted since it was indexed
+            service.sync_service.cache_playlist_index({
+                'user_id': '1213767627',
+                'playlists': {'Playlist1': {'id': 'deletedid', 'name': 'Playlist1'}},
+            })
+            return await service.create_playlist(playlist_name='Playlist1')
+
+        self.assertEqual(self.run_against(server, create), (True, {'id': 'playlist1id', 'name': 'Playlist1'}))
+        self.assertEqual(server.requests_to('GET', '/v1/playlists/deletedid')[0].query['fields'], 'name')
+        self.assertEqual(len(server.requests_to('GET', '/v1/users/1213767627/playlists')), 1)
+        self.assertEqual(server.requests_to('POST', '/v1/users/1213767627/playlists'), [])
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+
+from src.cache import TieredCache, TTLSet
+from tests.fakes import FakeRedis
+
+
+class TieredCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.fake_redis = FakeRedis()
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+
+        self.cache = TieredCache(namespace='test', maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def tearDown(self):
+        self.redis_patcher.stop()
+
+    def test_local_hit(self):
+        self.cache.set(('YOUTUBE', 'abc'), {'name': 'ok'})
+
+        self.assertEqual(self.cache.get(('YOUTUBE', 'abc')), {'name': 'ok'})
+        self.assertEqual(self.fake_redis.data, {'test:YOUTUBE:abc': b'{"name":"ok"}'})
+        self.assertEqual(self.cache.stats()['local_hits'], 1)
+
+    def test_redis_hit(self):
+        self.fake_redis.data['test:YOUTUBE:abc'] = b'{"name":"ok"}'
+
+        self.assertEqual(self.cache.get(('YOUTUBE', 'abc')), {'name': 'ok'})
+        self.assertEqual(self.cache.get(('YOUTUBE', 'abc')), {'name': 'ok'})
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['redis_hits'], 1)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['misses'], 0)
+
+    def test_local_ttl_and_lru(self):
+        self.cache.use_redis = False
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        # evicts b, the least recently used
+        self.cache.set('c', 3)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_redis_failure_is_a_miss(self):
+        self.fake_redis.fail = True
+
+        self.cache.set('a', 1)
+        self.cache.clear()
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+
+class TTLSetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.fake_redis = FakeRedis()
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+
+        self.seen = TTLSet(namespace='seen', maxsize=10, ttl=10, timer=lambda: self.now)
+
+    def tearDown(self):
+        self.redis_patcher.stop()
+
+    def test_add(self):
+        self.assertTrue(self.seen.add(('C123', 'YOUTUBE:abc')))
+        self.assertFalse(self.seen.add(('C123', 'YOUTUBE:abc')))
+        self.assertTrue(self.seen.add(('C456', 'YOUTUBE:abc')))
+
+        self.now = 11
+        # still in redis, which is what another worker would see
+        self.assertFalse(self.seen.add(('C123', 'YOUTUBE:abc')))
+
+        # expired everywhere
+        self.now = 22
+        self.fake_redis.data.clear()
+        self.assertTrue(self.seen.add(('C123', 'YOUTUBE:abc')))
+
+    def test_discard(self):
+        self.assertTrue(self.seen.add(('C123', 'YOUTUBE:abc')))
+        self.seen.discard(('C123', 'YOUTUBE:abc'))
+
+        self.assertEqual(self.fake_redis.data, {})
+        self.assertTrue(self.seen.add(('C123', 'YOUTUBE:abc')))
+
+    def test_redis_failure_falls_back_to_local(self):
+        self.fake_redis.fail = True
+
+        self.assertTrue(self.seen.add('Ev123'))
+        self.assertFalse(self.seen.add('Ev123'))
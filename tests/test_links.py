@@ -0,0 +1,85 @@
+import unittest
+
+from src.constants import LinkKind, Platform
+from src.links import ParsedLink, link_key, link_platform, parse_link, track_id_from_link
+
+YT_ID = 'XPpTgCho5ZA'
+SP_ID = '6ECp64rv50XVz93WvxXMGF'
+
+
+class ParseLinkTestCase(unittest.TestCase):
+    def test_youtube_videos(self):
+        for link in [
+            'https://www.youtube.com/watch?v=%s' % YT_ID,
+            'https://youtube.com/watch?feature=share&v=%s&t=42' % YT_ID,
+            'http://m.youtube.com/watch?v=%s#comments' % YT_ID,
+            'https://music.youtube.com/watch?v=%s&list=RDAMVM%s' % (YT_ID, YT_ID),
+            'https://youtu.be/%s' % YT_ID,
+            'https://youtu.be/%s?si=abcDEF123' % YT_ID,
+            'https://www.youtube.com/shorts/%s' % YT_ID,
+            'https://www.youtube-nocookie.com/embed/%s' % YT_ID,
+            'check this out youtu.be/%s' % YT_ID,
+            'https://gaming.youtube.com/watch?v=%s' % YT_ID,
+        ]:
+            self.assertEqual(parse_link(link), ParsedLink(Platform.YOUTUBE, LinkKind.TRACK, YT_ID), link)
+
+    def test_youtube_playlist(self):
+        self.assertEqual(
+            parse_link('https://www.youtube.com/playlist?list=PLvIunE2r3OATmPIgd9IhydYCWbZj29kP-'),
+            ParsedLink(Platform.YOUTUBE, LinkKind.PLAYLIST, 'PLvIunE2r3OATmPIgd9IhydYCWbZj29kP-')
+        )
+
+    def test_spotify(self):
+        for link, kind in [
+            ('https://open.spotify.com/track/%s' % SP_ID, LinkKind.TRACK),
+            ('https://open.spotify.com/track/%s?si=lJluQIadSSaeutkEbIWquQ' % SP_ID, LinkKind.TRACK),
+            ('https://open.spotify.com/intl-de/track/%s' % SP_ID, LinkKind.TRACK),
+            ('https://open.spotify.com/intl-pt-br/track/%s' % SP_ID, LinkKind.TRACK),
+            ('https://open.spotify.com/embed/track/%s' % SP_ID, LinkKind.TRACK),
+            ('spotify:track:%s' % SP_ID, LinkKind.TRACK),
+            ('https://open.spotify.com/album/%s' % SP_ID, LinkKind.ALBUM),
+            ('https://open.spotify.com/user/someone/playlist/%s' % SP_ID, LinkKind.PLAYLIST),
+            ('spotify:user:someone:playlist:%s' % SP_ID, LinkKind.PLAYLIST),
+        ]:
+            self.assertEqual(parse_link(link), ParsedLink(Platform.SPOTIFY, kind, SP_ID), link)
+
+    def test_not_music(self):
+        for link in [
+            'https://example.com/watch?v=%s' % YT_ID,
+            'https://notyoutube.com/watch?v=%s' % YT_ID,
+            'check this out https://fakeyoutu.be/%s' % YT_ID,
+            'https://my-open.spotify.com/track/%s' % SP_ID,
+            'notspotify:track:%s' % SP_ID,
+            'https://www.youtube.com/watch?v=short',
+            'https://open.spotify.com/track/tooshort',
+            '',
+        ]:
+            self.assertIsNone(parse_link(link), link)
+
+    def test_helpers(self):
+        album = 'https://open.spotify.com/album/%s' % SP_ID
+
+        self.assertEqual(track_id_from_link('https://youtu.be/%s' % YT_ID), YT_ID)
+        self.assertIsNone(track_id_from_link('https://youtu.be/%s' % YT_ID, platform=Platform.SPOTIFY))
+        self.assertIsNone(track_id_from_link(album))
+
+        self.assertEqual(
+            link_key('https://youtu.be/%s' % YT_ID),
+            link_key('https://www.youtube.com/watch?v=%s' % YT_ID)
+        )
+        self.assertEqual(link_key(album), 'SPOTIFY:album:%s' % SP_ID)
+
+        self.assertIs(link_platform('https://youtu.be/%s' % YT_ID), Platform.YOUTUBE)
+        self.assertIs(link_platform('spotify:track:%s' % SP_ID), Platform.SPOTIFY)
+        self.assertIsNone(link_platform('https://example.com'))
+
+    def test_lookalike_hosts(self):
+        for link in [
+            'https://notyoutube.com/watch?v=%s' % YT_ID,
+            'https://youtube.com.evil.com/watch?v=%s' % YT_ID,
+            'https://youtu.be.evil.com/%s' % YT_ID,
+            'https://notspotify.com/track/%s' % SP_ID,
+            'https://open.spotify.com.evil.com/track/%s' % SP_ID,
+        ]:
+            self.assertIsNone(link_platform(link), link)
+            self.assertIsNone(track_id_from_link(link), link)
@@ -0,0 +1,65 @@
+import unittest
+
+from src.constants import Platform
+from src.message_formatters import SLACK_MAX_BLOCKS, SlackMessageFormatter
+from src.models import Playlist
+from src.music_services import TrackInfo
+
+
+class FormatAddTracksResultsMessagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.playlist = Playlist(
+            name='yt',
+            channel_id='123',
+            platform=Platform.YOUTUBE,
+            platform_id='abc123',
+            user_id=1
+        )
+
+    def track_info(self, i):
+        return TrackInfo(name='Track %s' % i, platform=Platform.YOUTUBE, track_id='track%s' % i)
+
+    def test_nothing_to_post(self):
+        self.assertEqual(
+            SlackMessageFormatter.format_add_tracks_results_messages(
+                results=[('link', self.track_info(0), [], [])],
+                failed_searches=[]
+            ),
+            []
+        )
+
+    def test_failed_search_without_platform(self):
+        message = SlackMessageFormatter.format_failed_search_results_message(
+            origin='https://example.com',
+            target_platform=None
+        )
+
+        self.assertEqual(message['blocks'][0]['text']['text'], 'Unable to find info for link https://example.com')
+
+    def test_one_message(self):
+        messages = SlackMessageFormatter.format_add_tracks_results_messages(
+            results=[('link', self.track_info(0), [(self.playlist, None)], [])],
+            failed_searches=[('https://youtu.be/XPpTgCho5ZA', Platform.SPOTIFY)]
+        )
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(len(messages[0]['blocks']), 5)
+        self.assertEqual(messages[0]['text'], 'Playlist results for 2 tracks')
+
+    def test_split_at_block_limit(self):
+        # 3 blocks per result and 2 per failed search
+        results = [('link', self.track_info(i), [(self.playlist, None)], []) for i in range(20)]
+        failed_searches = [(self.track_info(i), Platform.SPOTIFY) for i in range(10)]
+
+        messages = SlackMessageFormatter.format_add_tracks_results_messages(
+            results=results,
+            failed_searches=failed_searches
+        )
+
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(all(len(m['blocks']) <= SLACK_MAX_BLOCKS for m in messages))
+        self.assertEqual(sum(len(m['blocks']) for m in messages), 20 * 3 + 10 * 2)
+        # a track's blocks aren't split across messages
+        self.assertEqual(len(messages[0]['blocks']), 48)
+        self.assertEqual(messages[0]['text'], 'Playlist results for 16 tracks')
+        self.assertEqual(messages[1]['text'], 'Playlist results for 14 tracks')
@@ -1,23 +1,36 @@
 import copy
 import unittest
+from unittest.mock import Mock, patch
 
+from oauth2client.client import OAuth2Credentials
 from spotipy.client import SpotifyException
 from fuzzywuzzy import fuzz
 
+from src.cache import TieredCache
+from src.client_pool import DiscoveryClientPool
 from src.constants import BAD_WORDS, DUPLICATE_TRACK, Platform
-from src.models import Playlist
+from src.models import Credential, Playlist
 from src.music_services import (
     ServiceFactory,
     SpotifyService,
     TrackInfo,
     YoutubeService,
+    forget_playlist_index,
+    SPOTIFY_MAX_TRACKS_PER_INSERT,
+    YOUTUBE_PLAYLIST_INDEX_FIELDS,
+    YOUTUBE_PLAYLIST_ITEM_FIELDS,
+    YOUTUBE_PLAYLIST_ITEM_PART,
+    YOUTUBE_PLAYLIST_TITLE_FIELDS,
     YOUTUBE_TOKEN_SET_THRESHHOLD,
 )
+from src.tokens import OAuth2CredentialStorage
 from tests.fakes import FakeSpotifyClient, FakeYoutubeClient
 from tests.json_fakes import (
     YOUTUBE_PLAYLIST_INSERT_RESPONSE,
     YOTUBE_SEARCH_LIST_RESPONSE,
     YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE,
+    SPOTIFY_ADD_TRACK_RESPONSE,
+    SPOTIFY_PLAYLIST_SNAPSHOT_RESP,
     SPOTIFY_TRACK_RESP,
     SPOTIFY_PLAYLIST_TRACKS_RESP,
 )
@@ -189,6 +202,34 @@ class TrackInfoTestCase(unittest.TestCase):
             "https://i.scdn.co/image/6ecbb6e0db1a5093bc58169b87beb19d2947ebdd"
         )
 
+    def test_artists_from_raw_json(self):
+        self.assertEqual(
+            TrackInfo(
+                platform=Platform.SPOTIFY,
+                name="ok",
+                track_id='123',
+                raw_json=SPOTIFY_TRACK_RESP
+            ).artists,
+            [a['name'] for a in SPOTIFY_TRACK_RESP['artists']]
+        )
+
+    def test_wire_round_trip(self):
+        track_info = TrackInfo(
+            platform=Platform.YOUTUBE,
+            name="ok",
+            track_id='123',
+            link='https://youtu.be/123',
+            raw_json=YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE['items'][0]['snippet']
+        )
+
+        wired = TrackInfo.from_wire(track_info.to_wire())
+
+        self.assertEqual(wired.to_wire(), track_info.to_wire())
+        self.assertEqual(wired.to_cache_dict(), track_info.to_cache_dict())
+        self.assertEqual(wired.description(), "It's fuckin' Maroon 5!")
+        self.assertEqual(wired.channel_title(), "Maroon5VEVO")
+        self.assertEqual(wired.track_image_url(), "https://i.ytimg.com/vi/XPpTgCho5ZA/default.jpg")
+
     def test_sanitized_track_name(self):
         base_str = "Maroon  5 (YES) [123]"
         for word in BAD_WORDS:
@@ -243,6 +284,90 @@ class ServiceFactoryTestCase(unittest.TestCase):
         )
 
 
+class DiscoveryClientPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.build_patcher = patch('src.client_pool.build_from_document', side_effect=lambda doc, http: Mock())
+        self.build_mock = self.build_patcher.start()
+
+        self.fake_http = Mock()
+        self.fake_http.request.return_value = (Mock(status=200), b'{"discovery": "doc"}')
+        self.pool = DiscoveryClientPool()
+        self.pool.get_discovery_document('youtube', 'v3', http=self.fake_http)
+
+    def tearDown(self):
+        self.build_patcher.stop()
+
+    def make_creds(self, row_id, refresh_token='refresh'):
+        creds = OAuth2Credentials(
+            access_token='access',
+            client_id='client',
+            client_secret='secret',
+            refresh_token=refresh_token,
+            token_expiry=None,
+            token_uri='https://oauth2.googleapis.com/token',
+            user_agent=None
+        )
+        if refresh_token:
+            creds.set_store(OAuth2CredentialStorage(
+                model=None, row_id=row_id, credentials_json=None, refresh_token=refresh_token))
+        return creds
+
+    def test_get_client(self):
+        creds = self.make_creds(row_id=1)
+        other_creds = self.make_creds(row_id=2)
+
+        client = self.pool.get_client('youtube', 'v3', credentials=creds)
+
+        self.assertIs(self.pool.get_client('youtube', 'v3', credentials=creds), client)
+        self.assertIsNot(self.pool.get_client('youtube', 'v3', credentials=other_creds), client)
+        self.assertEqual(self.fake_http.request.call_count, 1)
+        self.assertEqual(self.build_mock.call_count, 2)
+
+    def test_new_credentials_object_reauthorizes(self):
+        creds = self.make_creds(row_id=1)
+        client = self.pool.get_client('youtube', 'v3', credentials=creds)
+
+        # e.g. the row was loaded again after another worker refreshed its token
+        reloaded_creds = self.make_creds(row_id=1)
+        reloaded_creds.access_token = 'refreshed'
+
+        self.assertIs(self.pool.get_client('youtube', 'v3', credentials=reloaded_creds), client)
+        self.assertEqual(self.build_mock.call_count, 1)
+        http = self.build_mock.call_args[1]['http']
+        self.assertIs(http.request.credentials, reloaded_creds)
+
+        with patch('oauth2client.transport.request', return_value=(Mock(status=200), b'{}')) as request_mock:
+            http.request('https://www.googleapis.com/youtube/v3/videos')
+
+        # only the new token is applied, not the old one on top of it
+        self.assertEqual(request_mock.call_count, 1)
+        self.assertEqual(request_mock.call_args[0][4][b'Authorization'], b'Bearer refreshed')
+
+    def test_credential_row_loads_share_client(self):
+        credential = Credential(
+            platform=Platform.YOUTUBE,
+            credentials=self.make_creds(row_id=None).to_json(),
+            user_id=1
+        )
+        credential.id = 1
+
+        client = self.pool.get_client('youtube', 'v3', credentials=credential.to_oauth2_creds())
+
+        self.assertIs(self.pool.get_client('youtube', 'v3', credentials=credential.to_oauth2_creds()), client)
+        self.assertEqual(self.build_mock.call_count, 1)
+
+    def test_no_refresh_token_not_pooled(self):
+        creds = self.make_creds(row_id=1, refresh_token=None)
+        other_user_creds = self.make_creds(row_id=2, refresh_token=None)
+
+        client = self.pool.get_client('youtube', 'v3', credentials=creds)
+        other_user_client = self.pool.get_client('youtube', 'v3', credentials=other_user_creds)
+
+        self.assertIsNot(other_user_client, client)
+        self.assertIsNot(self.pool.get_client('youtube', 'v3', credentials=creds), client)
+        self.assertEqual(self.build_mock.call_count, 3)
+
+
 class YoutubeServiceTestCase(unittest.TestCase):
     def setUp(self):
         super(YoutubeServiceTestCase, self).setUp()
@@ -296,6 +421,43 @@ class YoutubeServiceTestCase(unittest.TestCase):
         expected_track_ids = {self.track_info.track_id, }
 
         self.assertEqual(track_ids, expected_track_ids)
+        self.assertEqual(self.service.client.playlist_item_list_calls, [{
+            'part': YOUTUBE_PLAYLIST_ITEM_PART,
+            'fields': YOUTUBE_PLAYLIST_ITEM_FIELDS,
+            'playlistId': self.playlist.platform_id,
+            'maxResults': 50,
+        }])
+
+    def test_get_track_ids_in_playlist_pages(self):
+        pages = [
+            {'items': [{'contentDetails': {'videoId': 'a'}}, {'contentDetails': {'videoId': 'b'}}]},
+            {'items': [{'contentDetails': {'videoId': 'b'}}, {'contentDetails': {'videoId': 'c'}}]},
+        ]
+        client = Mock()
+        client.playlistItems.return_value.list.return_value.execute.return_value = pages[0]
+        client.playlistItems.return_value.list_next.side_effect = [Mock(execute=Mock(return_value=pages[1])), None]
+        service = YoutubeService(credentials={'ok': True}, client=client)
+
+        self.assertEqual(service.get_track_ids_in_playlist(playlist=self.playlist), {'a', 'b', 'c'})
+        self.assertEqual(client.playlistItems.return_value.list_next.call_count, 2)
+
+    def test_is_track_in_playlist_stops_paging(self):
+        client = Mock()
+        client.playlistItems.return_value.list.return_value.execute.return_value = {
+            'items': [{'contentDetails': {'videoId': self.track_info.track_id}}],
+            'nextPageToken': 'more',
+        }
+        service = YoutubeService(credentials={'ok': True}, client=client)
+
+        self.assertTrue(service.is_track_in_playlist(track_info=self.track_info, playlist=self.playlist))
+        client.playlistItems.return_value.list.assert_called_once_with(
+            part=YOUTUBE_PLAYLIST_ITEM_PART,
+            fields=YOUTUBE_PLAYLIST_ITEM_FIELDS,
+            playlistId=self.playlist.platform_id,
+            maxResults=50,
+            videoId=self.track_info.track_id
+        )
+        client.playlistItems.return_value.list_next.assert_not_called()
 
     def test_is_track_in_playlist_and_it_is(self):
         self.assertTrue(self.service.is_track_in_playlist(
@@ -362,6 +524,26 @@ class YoutubeServiceTestCase(unittest.TestCase):
             }
         )
 
+    def test_add_tracks_to_playlist(self):
+        fake_client = FakeYoutubeClient()
+        service = YoutubeService(credentials={'ok': True}, client=fake_client)
+        new_track = TrackInfo(name='nah', platform=Platform.YOUTUBE, track_id='nah')
+
+        successes, failures = service.add_tracks_to_playlist(
+            track_infos=[self.track_info, new_track, new_track],
+            playlist=self.playlist
+        )
+
+        self.assertEqual(successes, [(new_track, None)])
+        self.assertEqual(
+            failures,
+            [(self.track_info, DUPLICATE_TRACK), (new_track, DUPLICATE_TRACK)]
+        )
+        self.assertEqual(
+            [c['snippet']['resourceId']['videoId'] for c in fake_client.playlist_item_insert_calls],
+            [new_track.track_id]
+        )
+
     def test_best_match_no_results_over_fuzz_limit(self):
         # set up some bad results
         target = "Sure Why not"
@@ -454,6 +636,195 @@ class YoutubeServiceTestCase(unittest.TestCase):
         self.assertEqual((True, expected_res), res)
         self.assertTrue(self.service.client.playlist_insert_calls, [title])
 
+
+class PlaylistIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_patcher = patch(
+            'src.music_services.playlist_index_cache',
+            TieredCache(namespace='test', maxsize=10, ttl=60, use_redis=False)
+        )
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def youtube_service(self, **kwargs):
+        return YoutubeService(credentials=True, client=FakeYoutubeClient(**kwargs), owner_id=1)
+
+    def spotify_service(self):
+        fake_client = FakeSpotifyClient()
+        # don't want results from .next()
+        fake_client.nexted = True
+        return SpotifyService(credentials=True, client=fake_client, owner_id=1)
+
+    def test_youtube_index_projection(self):
+        service = self.youtube_service()
+
+        index = service.get_playlist_index()
+
+        self.assertEqual(index['channel_id'], 123)
+        self.assertEqual(index['etag'], 'playlists-etag')
+        self.assertEqual(sorted(index['playlists']), ['Playlist1', 'Playlist2'])
+        self.assertEqual(service.client.playlists_list_calls[0]['fields'], YOUTUBE_PLAYLIST_INDEX_FIELDS)
+
+    def test_youtube_create_revalidates_cached_index(self):
+        self.youtube_service().create_playlist(playlist_name='sure thing')
+
+        service = self.youtube_service()
+        self.assertEqual(
+            service.create_playlist(playlist_name='sure thing'),
+            (True, {'id': YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'], 'snippet': {'title': 'sure thing'}})
+        )
+        self.assertEqual(
+            service.create_playlist(playlist_name='Playlist2'),
+            (True, {'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}})
+        )
+
+        # one etag'd list per create, answered with a 304, and no channels lookup
+        self.assertEqual(service.client.channels_list_calls, 0)
+        self.assertEqual(len(service.client.playlists_list_calls), 2)
+        self.assertEqual(service.client.playlist_insert_calls, [])
+
+    def test_youtube_changed_playlists_rebuild_index(self):
+        self.youtube_service().get_playlist_index()
+
+        service = self.youtube_service(expected_responses={'playlists_list': {
+            'etag': 'new-etag',
+            'items': [{'id': 'playlist3id', 'snippet': {'title': 'Playlist3'}}],
+        }})
+        index = service.get_playlist_index()
+
+        self.assertEqual(index['etag'], 'new-etag')
+        self.assertEqual(list(index['playlists']), ['Playlist3'])
+        self.assertEqual(service.client.channels_list_calls, 0)
+
+    def test_youtube_multi_page_index_is_relisted(self):
+        first_page = {
+            'etag': 'page1-etag',
+            'nextPageToken': 'page2',
+            'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+        }
+        index = self.youtube_service(expected_responses={'playlists_list': first_page}).get_playlist_index()
+        self.assertIsNone(index['etag'])
+
+        # an older playlist, on a later page, was deleted; the first page and its etag are the same
+        service = self.youtube_service(expected_responses={'playlists_list': dict(first_page, items=[])})
+        index = service.get_playlist_index()
+
+        self.assertEqual(index['playlists'], {})
+        self.assertEqual(service.client.channels_list_calls, 0)
+
+    def test_youtube_multi_page_create_checks_hit(self):
+        paged_response = {
+            'etag': 'page1-etag',
+            'nextPageToken': 'page2',
+            'items': [
+                {'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}},
+                {'id': 'playlist2id', 'snippet': {'title': 'Playlist2'}},
+            ],
+        }
+        self.youtube_service(expected_responses={'playlists_list': paged_response}).get_playlist_index()
+
+        service = self.youtube_service(expected_responses={'playlists_list': paged_response})
+        self.assertEqual(
+            service.create_playlist(playlist_name='Playlist1'),
+            (True, {'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}})
+        )
+        # just the one lookup by id
+        self.assertEqual(service.client.playlists_list_calls, [
+            {'part': 'snippet', 'id': 'playlist1id', 'fields': YOUTUBE_PLAYLIST_TITLE_FIELDS}
+        ])
+
+    def test_youtube_multi_page_stale_hit_is_replaced(self):
+        paged_response = {
+            'etag': 'page1-etag',
+            'nextPageToken': 'page2',
+            'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+        }
+        self.youtube_service(expected_responses={'playlists_list': paged_response}).get_playlist_index()
+
+        # deleted since it was indexed
+        service = self.youtube_service(expected_responses={'playlists_list_by_id': {'items': []}})
+        service.create_playlist(playlist_name='Playlist1')
+
+        # just the lookup by id, not every page again
+        self.assertEqual(len(service.client.playlists_list_calls), 1)
+        self.assertEqual(service.client.playlist_insert_calls, ['Playlist1'])
+        self.assertEqual(
+            service.cached_playlist_index()['playlists']['Playlist1']['id'],
+            YOUTUBE_PLAYLIST_INSERT_RESPONSE['id']
+        )
+
+    def test_youtube_multi_page_miss_is_created(self):
+        paged_response = {
+            'etag': 'page1-etag',
+            'nextPageToken': 'page2',
+            'items': [{'id': 'playlist1id', 'snippet': {'title': 'Playlist1'}}],
+        }
+        self.youtube_service(expected_responses={'playlists_list': paged_response}).get_playlist_index()
+
+        service = self.youtube_service()
+        success, playlist = service.create_playlist(playlist_name='sure thing')
+
+        self.assertTrue(success)
+        self.assertEqual(playlist['id'], YOUTUBE_PLAYLIST_INSERT_RESPONSE['id'])
+        self.assertEqual(service.client.playlists_list_calls, [])
+        self.assertEqual(service.client.channels_list_calls, 0)
+        self.assertEqual(service.client.playlist_insert_calls, ['sure thing'])
+        self.assertIn('sure thing', service.cached_playlist_index()['playlists'])
+
+    def test_spotify_create_uses_cached_index(self):
+        self.spotify_service().create_playlist(playlist_name='ok')
+
+        service = self.spotify_service()
+        with patch.object(service.client, 'me') as me_mock:
+            self.assertEqual(
+                service.create_playlist(playlist_name='Playlist1'),
+                (True, {'id': 'playlist1id', 'name': 'Playlist1'})
+            )
+
+        self.assertEqual(me_mock.call_count, 0)
+        self.assertEqual(service.client.user_playlists_calls, 0)
+        # one lookup to check the hit is still there under that name
+        self.assertEqual(service.client.user_playlist_calls, ['playlist1id'])
+
+    def test_spotify_create_stale_hit_is_relisted(self):
+        self.spotify_service().get_playlist_index()
+
+        # renamed since it was indexed
+        service = self.spotify_service()
+        service.client.expected_responses['user_playlist'] = {'name': 'Renamed'}
+        service.client.expected_responses['user_playlists'] = {
+            'items': [{'id': 'playlist2id', 'name': 'Playlist2'}]
+        }
+
+        self.assertEqual(
+            service.create_playlist(playlist_name='Playlist1'),
+            (True, {'id': 'newplaylistid', 'name': 'Playlist1'})
+        )
+        self.assertEqual(
+            service.cached_playlist_index()['playlists'],
+            {'Playlist2': {'id': 'playlist2id', 'name': 'Playlist2'}, 'Playlist1': {'id': 'newplaylistid', 'name': 'Playlist1'}}
+        )
+
+    def test_forget_playlist_index(self):
+        self.spotify_service().get_playlist_index()
+        forget_playlist_index(platform=Platform.SPOTIFY, owner_id=1)
+
+        service = self.spotify_service()
+        service.get_playlist_index()
+
+        self.assertEqual(service.client.user_playlists_calls, 1)
+
+    def test_no_owner_no_cache(self):
+        YoutubeService(credentials=True, client=FakeYoutubeClient()).get_playlist_index()
+
+        service = self.youtube_service()
+        service.get_playlist_index()
+
+        self.assertEqual(service.client.channels_list_calls, 1)
+
+
 class SpotifyServiceTestCase(unittest.TestCase):
     def setUp(self):
         super(SpotifyServiceTestCase, self).setUp()
@@ -496,6 +867,19 @@ class SpotifyServiceTestCase(unittest.TestCase):
             expected_ids
         )
 
+    def test_get_playlist_snapshot_id(self):
+        self.assertIsNone(self.service.known_snapshot_id(playlist=self.playlist))
+
+        self.assertEqual(
+            self.service.get_playlist_snapshot_id(playlist=self.playlist),
+            SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id']
+        )
+        self.assertEqual(self.fake_client.user_playlist_calls, [self.playlist.platform_id])
+        self.assertEqual(
+            self.service.known_snapshot_id(playlist=self.playlist),
+            SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id']
+        )
+
     def test_is_track_in_playlist_is_in_playlist(self):
         # cheat because I know this id is in the json fakes
         self.track_info.track_id = '6ECp64rv50XVz93WvxXMGF'
@@ -521,7 +905,7 @@ class SpotifyServiceTestCase(unittest.TestCase):
         self.service.client.nexted = True
         # cheating because I know what this returns form the fake client
         self.assertEqual(
-            [{'name': 'Playlist1'}, {'name': 'Playlist2'}],
+            [{'id': 'playlist1id', 'name': 'Playlist1'}, {'id': 'playlist2id', 'name': 'Playlist2'}],
             self.service.list_playlists()
         )
 
@@ -580,6 +964,47 @@ class SpotifyServiceTestCase(unittest.TestCase):
             self.fake_client.add_track_calls,
             [self.track_info.track_id]
         )
+        self.assertEqual(
+            self.service.known_snapshot_id(playlist=self.playlist),
+            SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id']
+        )
+
+    def test_add_tracks_to_playlist(self):
+        # cheat because I know this id is in the json fakes
+        dupe_track = TrackInfo(name='dupe', platform=Platform.SPOTIFY, track_id='6ECp64rv50XVz93WvxXMGF')
+        new_tracks = [
+            TrackInfo(name=str(i), platform=Platform.SPOTIFY, track_id=str(i))
+            for i in range(SPOTIFY_MAX_TRACKS_PER_INSERT + 1)
+        ]
+
+        with patch.object(
+            self.fake_client,
+            'user_playlist_add_tracks',
+            wraps=self.fake_client.user_playlist_add_tracks
+        ) as add_tracks_mock:
+            successes, failures = self.service.add_tracks_to_playlist(
+                track_infos=[dupe_track] + new_tracks,
+                playlist=self.playlist
+            )
+
+        self.assertEqual(successes, [(t, None) for t in new_tracks])
+        self.assertEqual(failures, [(dupe_track, DUPLICATE_TRACK)])
+        self.assertEqual(add_tracks_mock.call_count, 2)
+        self.assertEqual(self.fake_client.add_track_calls, [t.track_id for t in new_tracks])
+
+    def test_add_tracks_to_playlist_exception(self):
+        def s_raiser():
+            raise SpotifyException(code=1, msg='snope', http_status=500)
+
+        fake_client = FakeSpotifyClient(expected_responses={
+            'user_playlist_add_tracks': s_raiser
+        })
+        service = SpotifyService(credentials={'ok': True}, client=fake_client)
+
+        self.assertEqual(
+            ([], [(self.track_info, 'snope')]),
+            service.add_tracks_to_playlist(track_infos=[self.track_info], playlist=self.playlist)
+        )
 
     def test_create_playlist_no_user_info(self):
         fake_client = FakeSpotifyClient(expected_responses={
@@ -595,8 +1020,10 @@ class SpotifyServiceTestCase(unittest.TestCase):
     def test_create_playlist_dupe_playlist(self):
         dupe_name = 'Playlist1'
 
+        # don't want results from .next()
+        self.service.client.nexted = True
         self.assertEqual(
-            (True, {'name': 'Playlist1'}),
+            (True, {'id': 'playlist1id', 'name': 'Playlist1'}),
             self.service.create_playlist(playlist_name=dupe_name)
         )
 
@@ -622,7 +1049,7 @@ class SpotifyServiceTestCase(unittest.TestCase):
         # don't want results from .next()
         self.service.client.nexted = True
         self.assertEqual(
-            (True, {'name': pl_name}),
+            (True, {'id': 'newplaylistid', 'name': pl_name}),
             self.service.create_playlist(playlist_name=pl_name)
         )
 
@@ -0,0 +1,129 @@
+import datetime
+import json
+import unittest
+from unittest.mock import Mock, patch
+
+from apiclient.errors import HttpError
+
+from src.quota import QuotaAccountant, QuotaClient, QuotaExhaustedError
+from tests.fakes import FakeRedis, FakeYoutubeClient
+
+
+class QuotaAccountantTestCase(unittest.TestCase):
+    def setUp(self):
+        # 10am pacific
+        self.now = datetime.datetime(2026, 10, 17, 18, 0, tzinfo=datetime.timezone.utc)
+        self.fake_redis = FakeRedis()
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+
+        self.quota = QuotaAccountant(namespace='yt', daily_budget=1000, clock=lambda: self.now)
+
+    def tearDown(self):
+        self.redis_patcher.stop()
+
+    def test_charge(self):
+        self.quota.charge(100)
+        self.quota.charge(50)
+
+        self.assertEqual(self.fake_redis.data, {'yt:2026-10-17': b'150'})
+        self.assertEqual(self.quota.remaining(), 850)
+        self.assertEqual(self.quota.calls_left(100), 8)
+        self.assertEqual(self.quota.calls_left(100, reserve=200), 6)
+
+    def test_shared_between_processes(self):
+        other = QuotaAccountant(namespace='yt', daily_budget=1000, clock=lambda: self.now)
+
+        self.quota.charge(100)
+        other.charge(100)
+
+        self.assertEqual(self.quota.used(), 200)
+
+    def test_new_day(self):
+        self.quota.charge(900)
+        # 8am utc is midnight pacific standard time
+        self.now = datetime.datetime(2026, 10, 18, 8, 0, 1, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(self.quota.remaining(), 1000)
+
+    def test_seconds_until_reset(self):
+        self.assertEqual(self.quota.seconds_until_reset(), 14 * 60 * 60 + 1)
+
+    def test_exhaust(self):
+        self.quota.charge(100)
+        self.quota.exhaust()
+
+        self.assertEqual(self.quota.remaining(), 0)
+        self.assertEqual(self.quota.calls_left(1), 0)
+
+    def test_redis_failure_counts_locally(self):
+        self.fake_redis.fail = True
+
+        self.quota.charge(100)
+        self.quota.charge(100)
+
+        self.assertEqual(self.quota.remaining(), 800)
+
+
+class QuotaClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.quota = QuotaAccountant(namespace='yt', daily_budget=1000, use_redis=False)
+
+    def test_charges_on_execute(self):
+        client = QuotaClient(FakeYoutubeClient(), accountant=self.quota)
+
+        request = client.search().list(q='this love', part='snippet')
+        self.assertEqual(self.quota.used(), 0)
+
+        request.execute()
+        self.assertEqual(self.quota.used(), 100)
+
+        client.playlistItems().list(part='contentDetails', playlistId='abc').execute()
+        client.playlistItems().insert(part='snippet', body={}).execute()
+        self.assertEqual(self.quota.used(), 151)
+
+    def test_list_next(self):
+        resource = Mock()
+        next_request = Mock()
+        resource.list_next.side_effect = [next_request, None]
+        youtube = Mock()
+        youtube.playlistItems.return_value = resource
+        client = QuotaClient(youtube, accountant=self.quota)
+
+        request = client.playlistItems().list(part='contentDetails')
+        response = request.execute()
+        request = client.playlistItems().list_next(request, response)
+        request.execute()
+
+        # the wrapped request goes to the real list_next
+        resource.list_next.assert_called_once_with(resource.list.return_value, response)
+        self.assertIsNone(client.playlistItems().list_next(request, {}))
+        self.assertEqual(self.quota.used(), 2)
+
+    def test_quota_exceeded(self):
+        content = json.dumps({'error': {'errors': [{'reason': 'quotaExceeded'}]}}).encode('utf-8')
+
+        def raise_quota_exceeded():
+            raise HttpError(Mock(status=403), content)
+
+        client = QuotaClient(
+            FakeYoutubeClient(expected_responses={'search': raise_quota_exceeded}),
+            accountant=self.quota
+        )
+
+        with self.assertRaises(QuotaExhaustedError):
+            client.search().list(q='this love').execute()
+        self.assertEqual(self.quota.remaining(), 0)
+
+    def test_other_http_errors(self):
+        def raise_not_found():
+            raise HttpError(Mock(status=404), b'{}')
+
+        client = QuotaClient(
+            FakeYoutubeClient(expected_responses={'search': raise_not_found}),
+            accountant=self.quota
+        )
+
+        with self.assertRaises(HttpError):
+            client.search().list(q='this love').execute()
+        self.assertEqual(self.quota.remaining(), 900)
@@ -0,0 +1,33 @@
+import unittest
+
+from src.sanitizer import clear_cache, sanitize_title, sanitize_titles
+
+
+class SanitizerTestCase(unittest.TestCase):
+    def setUp(self):
+        clear_cache()
+
+    def test_sanitize_title(self):
+        self.assertEqual(
+            sanitize_title("Maroon 5 - This Love (Official Music Video) [HD]").strip(),
+            'Maroon 5 This Love'
+        )
+        self.assertEqual(sanitize_title("Lyrics by Lyric").strip(), '')
+        # only whole words
+        self.assertEqual(sanitize_title("Epic Fullness"), 'Epic Fullness')
+
+    def test_sanitize_titles(self):
+        titles = [
+            "Daft Punk - Get Lucky (Official Audio) ft. Pharrell Williams",
+            "Don't Stop Me Now [Remastered 2011]",
+            "",
+            "Daft Punk - Get Lucky (Official Audio) ft. Pharrell Williams",
+            "two\nlines (x)",
+            "Tame Impala | The Less I Know The Better (Official Video)",
+        ]
+
+        batched = sanitize_titles(titles)
+        clear_cache()
+
+        self.assertEqual(batched, [sanitize_title(t) for t in titles])
+        self.assertEqual(batched[1], 'Dont Stop Me Now')
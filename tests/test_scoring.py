@@ -0,0 +1,177 @@
+import copy
+import itertools
+import unittest
+from unittest.mock import patch
+
+from fuzzywuzzy import fuzz
+
+from src.constants import Platform
+from src.music_services import (
+    SPOTIFY_TOKEN_SET_THRESHHOLD,
+    SPOTIFY_TOKEN_SORT_THRESHHOLD,
+    YOUTUBE_TOKEN_SET_THRESHHOLD,
+    SpotifyService,
+    TrackInfo,
+    YoutubeService
+)
+from src.scoring import TOKEN_SET, TOKEN_SORT, BatchScorer, batch_scorer
+from tests.json_fakes import SPOTIFY_SEARCH_REGRESSION_CORPUS, YOUTUBE_SEARCH_REGRESSION_CORPUS
+
+
+def legacy_spotify_best_match(target_string, search_results, track_info=None):
+    """
+    SpotifyService.best_match as it was before batch scoring, returning the winning item
+    """
+    contenders = []
+    best_score_so_far = 0
+    for item in search_results:
+        contender_string = ("%s %s" % (item['name'], " ".join(a['name'] for a in item['artists']))).lower()
+        contender_score = fuzz.token_set_ratio(target_string.lower(), contender_string)
+        if contender_score >= best_score_so_far and contender_score > SPOTIFY_TOKEN_SET_THRESHHOLD:
+            best_score_so_far = contender_score
+            contenders.append(item)
+
+    if not contenders:
+        return None
+
+    if len(contenders) == 1:
+        return contenders[0]
+
+    best_sort_score_so_far = 0
+    sort_contenders = []
+    for contender in contenders:
+        contender_string = ("%s %s" % (
+            contender['name'], " ".join(a['name'] for a in contender['artists']))).lower()
+        sort_score = fuzz.token_sort_ratio(target_string.lower(), contender_string)
+        if sort_score >= best_sort_score_so_far and sort_score > SPOTIFY_TOKEN_SORT_THRESHHOLD:
+            contender['sort_score'] = sort_score
+            best_sort_score_so_far = sort_score
+            sort_contenders.append(contender)
+
+    if sort_contenders:
+        highest_sort_score = max(sort_contenders, key=lambda b: b['sort_score'])['sort_score']
+        best_contenders = [c for c in sort_contenders if c['sort_score'] >= highest_sort_score]
+        if len(best_contenders) == 1:
+            return best_contenders[0]
+    else:
+        best_contenders = contenders
+
+    if not track_info:
+        return max(best_contenders, key=lambda sc: sc['popularity'])
+
+    best_results_with_artist = []
+    original_description = track_info.description().lower()
+    for contender in best_contenders:
+        current_score = 0
+        for a in contender['artists']:
+            if a['name'].lower() in original_description:
+                current_score += 10
+            if a['name'].lower() in track_info.channel_title().lower():
+                current_score += 25
+
+        if current_score > 0:
+            contender['with_artist_score'] = current_score
+            best_results_with_artist.append(contender)
+
+    if best_results_with_artist:
+        highest = max(best_results_with_artist, key=lambda b: b['with_artist_score'])['with_artist_score']
+        return max(
+            [c for c in best_results_with_artist if c['with_artist_score'] >= highest],
+            key=lambda bra: bra['popularity']
+        )
+
+    return max(best_contenders, key=lambda bc: bc['popularity'])
+
+
+def legacy_youtube_best_match(target_string, titles):
+    best_result = (None, 0)
+    for title in titles:
+        contender = fuzz.token_set_ratio(target_string, title)
+        if contender > best_result[1] and contender > YOUTUBE_TOKEN_SET_THRESHHOLD:
+            best_result = (title, contender)
+
+    return best_result
+
+
+class BatchScorerTestCase(unittest.TestCase):
+    def test_cdist_matches_fuzz(self):
+        strings = [case['target'] for case in SPOTIFY_SEARCH_REGRESSION_CORPUS]
+        for case in SPOTIFY_SEARCH_REGRESSION_CORPUS:
+            strings.extend(
+                "%s %s" % (item['name'], " ".join(a['name'] for a in item['artists']))
+                for item in case['items']
+            )
+        for case in YOUTUBE_SEARCH_REGRESSION_CORPUS:
+            strings.append(case['target'])
+            strings.extend(case['titles'])
+        strings.extend(['', '!!!'])
+
+        matrices = BatchScorer().cdist(strings, strings, scorers=(TOKEN_SET, TOKEN_SORT))
+
+        for (i, s1), (j, s2) in itertools.product(enumerate(strings), repeat=2):
+            self.assertEqual(matrices[TOKEN_SET][i][j], fuzz.token_set_ratio(s1, s2), (s1, s2))
+            self.assertEqual(matrices[TOKEN_SORT][i][j], fuzz.token_sort_ratio(s1, s2), (s1, s2))
+
+
+class BestMatchRegressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spotify = SpotifyService(credentials={'ok': True})
+        self.youtube = YoutubeService(credentials={'ok': True})
+
+    def test_spotify_best_match(self):
+        # every target against every recorded result set, with and without the video's details
+        for case, results in itertools.product(SPOTIFY_SEARCH_REGRESSION_CORPUS, repeat=2):
+            track_info = TrackInfo(
+                name=case['target'],
+                platform=Platform.YOUTUBE,
+                track_id='123',
+                raw_json={'description': case['description'], 'channelTitle': case['channel_title']}
+            )
+            for ti in (None, track_info):
+                expected = legacy_spotify_best_match(
+                    target_string=case['target'],
+                    search_results=copy.deepcopy(results['items']),
+                    track_info=ti
+                )
+                search_results = copy.deepcopy(results['items'])
+                match = self.spotify.best_match(
+                    target_string=case['target'],
+                    search_results=search_results,
+                    track_info=ti
+                )
+                self.assertEqual(search_results, results['items'])
+
+                if expected is None:
+                    self.assertIsNone(match, case['target'])
+                else:
+                    self.assertEqual(match.track_id, expected['id'], case['target'])
+
+    def test_spotify_token_sort_only_for_contenders(self):
+        for case, results in itertools.product(SPOTIFY_SEARCH_REGRESSION_CORPUS, repeat=2):
+            with patch.object(batch_scorer, 'score', wraps=batch_scorer.score) as score_mock:
+                self.spotify.best_match(target_string=case['target'], search_results=results['items'])
+
+            strings = score_mock.call_args_list[0][0][1]
+            contenders = [
+                s for s in strings
+                if fuzz.token_set_ratio(case['target'].lower(), s) > SPOTIFY_TOKEN_SET_THRESHHOLD
+            ]
+            for call in score_mock.call_args_list[1:]:
+                self.assertEqual(call[1]['scorers'], (TOKEN_SORT, ))
+                self.assertTrue(set(call[0][1]) <= set(contenders))
+
+    def test_youtube_best_match(self):
+        for case, results in itertools.product(YOUTUBE_SEARCH_REGRESSION_CORPUS, repeat=2):
+            expected_title, expected_score = legacy_youtube_best_match(case['target'], results['titles'])
+            match = self.youtube.best_match(
+                target_string=case['target'],
+                search_results=[
+                    {'id': {'videoId': str(i)}, 'snippet': {'title': title}}
+                    for i, title in enumerate(results['titles'])
+                ]
+            )
+
+            if expected_title is None:
+                self.assertIsNone(match)
+            else:
+                self.assertEqual((match.name, match.match_score), (expected_title, expected_score))
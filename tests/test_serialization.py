@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import patch
+
+from kombu.serialization import dumps, loads
+
+from src.constants import Platform
+from src.music_services import TrackInfo
+from src.serialization import CONTENT_TYPE, SERIALIZER, TrackInfoRef, register_serializer
+from tests.json_fakes import YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE
+
+
+class SerializerTestCase(unittest.TestCase):
+    def setUp(self):
+        register_serializer()
+        self.track_info = TrackInfo(
+            name='Maroon 5 - This Love',
+            platform=Platform.YOUTUBE,
+            track_id='XPpTgCho5ZA',
+            raw_json=YOUTUBE_VIDEOS_LIST_SINGLE_RESPONSE['items'][0]['snippet']
+        )
+
+    def _round_trip(self, body):
+        content_type, content_encoding, data = dumps(body, serializer=SERIALIZER)
+        self.assertEqual(content_type, CONTENT_TYPE)
+
+        return loads(data, content_type, content_encoding)
+
+    def test_track_info(self):
+        args, kwargs, embed = self._round_trip(
+            ((), {'origin': self.track_info, 'platform': 'SPOTIFY', 'channel': '123'}, {})
+        )
+
+        self.assertIsInstance(kwargs['origin'], TrackInfo)
+        self.assertEqual(kwargs['origin'].to_wire(), self.track_info.to_wire())
+        self.assertEqual(kwargs['platform'], 'SPOTIFY')
+
+    def test_track_info_ref(self):
+        ref = TrackInfoRef.from_track_info(self.track_info)
+
+        _, kwargs, _ = self._round_trip(((), {'origin': ref}, {}))
+
+        self.assertEqual(kwargs['origin'], ref)
+        self.assertEqual(kwargs['origin'].link(), 'https://www.youtube.com/watch?v=XPpTgCho5ZA')
+
+    def test_warns_without_msgpack_extension(self):
+        with patch('src.serialization.msgpack_is_compiled', return_value=False), \
+                patch('src.serialization.logger') as logger_mock:
+            register_serializer()
+
+        self.assertEqual(len(logger_mock.warning.mock_calls), 1)
@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import Mock, patch
+
+from src.constants import SlackUrl
+from src.slack_client import CHANNEL_POST_INTERVAL, SLACK_MAX_RETRIES, ChannelSlots, SlackClient
+from tests.fakes import FakeRedis
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = 'ok'
+
+
+class SlackClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        self.sleep = sleep
+
+        self.fake_redis = FakeRedis(clock=lambda: self.now)
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+
+        self.session = Mock()
+        self.session.request.return_value = FakeResponse()
+        self.client = self.make_client()
+
+    def tearDown(self):
+        self.redis_patcher.stop()
+
+    def make_client(self):
+        return SlackClient(
+            token='token',
+            session=self.session,
+            clock=lambda: self.now,
+            sleep=self.sleep,
+            channel_slots=ChannelSlots(namespace='test')
+        )
+
+    def test_respond(self):
+        self.client.respond(response_url='https://hooks.slack.com/commands/1', text='ok')
+
+        # response_urls don't take the bot token
+        self.session.request.assert_called_once_with(
+            'POST',
+            'https://hooks.slack.com/commands/1',
+            json={'response_type': 'ephemeral', 'text': 'ok'},
+            headers={"Content-type": "application/json"},
+            timeout=10
+        )
+
+    def test_post_message(self):
+        payload = {'channel': '123', 'text': 'ok'}
+
+        res = self.client.post_message(payload=payload)
+
+        self.assertEqual(res.status_code, 200)
+        self.session.request.assert_called_once_with(
+            'POST',
+            SlackUrl.POST_MESSAGE.value,
+            json=payload,
+            headers={"Content-type": "application/json", "Authorization": "Bearer token"},
+            timeout=10
+        )
+        self.assertEqual(self.client.metrics()['count'], 1)
+
+    def test_spaces_out_posts_to_same_channel(self):
+        self.client.post_message(payload={'channel': '123'})
+        self.client.post_message(payload={'channel': '456'})
+        self.client.post_message(payload={'channel': '123'})
+
+        self.assertEqual(self.sleeps, [CHANNEL_POST_INTERVAL])
+
+    def test_retries_after_rate_limit(self):
+        self.session.request.side_effect = [
+            FakeResponse(status_code=429, headers={'Retry-After': '5'}),
+            FakeResponse(),
+        ]
+
+        res = self.client.post_message(payload={'channel': '123'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.sleeps, [5.0])
+        self.assertEqual(self.client.metrics()['rate_limited'], 1)
+
+    def test_gives_up_after_max_retries(self):
+        self.session.request.return_value = FakeResponse(status_code=429, headers={'Retry-After': '1'})
+
+        res = self.client.post_message(payload={'channel': '123'})
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(self.session.request.call_count, SLACK_MAX_RETRIES + 1)
+
+    def test_spacing_shared_across_workers(self):
+        other_worker = self.make_client()
+
+        self.client.post_message(payload={'channel': '123'})
+        other_worker.post_message(payload={'channel': '123'})
+
+        self.assertEqual(self.sleeps, [CHANNEL_POST_INTERVAL])
+
+    def test_rate_limit_back_off_shared_across_workers(self):
+        other_worker = self.make_client()
+        other_worker_waits = []
+        self.session.request.side_effect = [
+            FakeResponse(status_code=429, headers={'Retry-After': '5'}),
+            FakeResponse(),
+        ]
+
+        def sleep(seconds):
+            # another worker tries the channel while this one backs off
+            other_worker_waits.append(other_worker.channel_slots.reserve('123'))
+            self.sleep(seconds)
+
+        self.client.sleep = sleep
+        self.client.post_message(payload={'channel': '123'})
+
+        self.assertEqual(other_worker_waits, [5.0])
+        self.assertEqual(self.sleeps, [5.0])
+
+    def test_spacing_without_redis(self):
+        self.fake_redis.fail = True
+
+        self.client.post_message(payload={'channel': '123'})
+        self.client.post_message(payload={'channel': '123'})
+
+        self.assertEqual(self.sleeps, [CHANNEL_POST_INTERVAL])
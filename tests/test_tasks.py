@@ -1,13 +1,34 @@
-import copy
+import datetime
 import json
-from unittest.mock import patch
+import time
+from unittest.mock import Mock, patch
+
+from oauth2client.client import OAuth2Credentials
 
 from tests.base import DatabaseTestBase
 from src.constants import Platform
 from src.message_formatters import SlackMessageFormatter
-from src.models import Credential, Playlist, User
+from src.models import ChannelBackfill, Credential, DeferredSearch, Playlist, User
 from src.music_services import TrackInfo
-from src.tasks import add_link_to_playlists, search_and_add_to_playlists
+from src.oauth_wrappers import fresh_spotify_credentials, spotify_token_key
+from src.quota import QuotaExhaustedError
+from src.serialization import TrackInfoRef
+from src.tokens import SingleFlightRefresher
+from src.tasks import (
+    METRICS_LOG_INTERVAL,
+    add_link_to_playlists,
+    add_links_to_playlists,
+    backfill_tracks,
+    command_latency,
+    create_playlist_from_command,
+    delete_playlist_from_command,
+    log_metrics_periodically,
+    refresh_spotify_tokens,
+    refresh_youtube_tokens,
+    run_deferred_searches,
+    scrape_channel_history,
+    search_and_add_to_playlists
+)
 
 
 YT_TRACK_INFO = TrackInfo(
@@ -57,7 +78,8 @@ class TaskTestBase(DatabaseTestBase):
         super(TaskTestBase, self).tearDown()
 
         self.message_formatter_patcher.stop()
-        self.add_track_results_patcher.stop()
+        # some patchers here and in subclasses are swapped for their mocks, so stop() alone leaks them
+        patch.stopall()
 
     def _make_playlists(self, channel_id, num_yt=0, num_spot=0, user=None):
         if not user:
@@ -103,22 +125,20 @@ class TestAddTrackToPlaylistsTestCase(TaskTestBase):
             channel=channel_id
         )
 
-        self.message_formatter_mock.called_once_with(payload={
-            'channel': channel_id,
-            'text': 'Unable to find info for link %s' % link
-        })
+        self.assertEqual(self.message_formatter_mock.call_count, 1)
+        payload = self.message_formatter_mock.call_args[1]['payload']
+        self.assertEqual(payload['channel'], channel_id)
+        self.assertEqual(payload['blocks'][0]['text']['text'], 'Unable to find info for link %s' % link)
 
     @patch('src.tasks.get_track_info_from_link', return_value=YT_TRACK_INFO)
     def test_no_native_playlists(self, track_info_mock):
         channel = '123'
-        link = 'https://www.youtube.com/watch?v=123'
+        link = 'https://www.youtube.com/watch?v=XPpTgCho5ZA'
         _, spotify_playlists = self._make_playlists(
             channel_id=channel,
             num_yt=0,
             num_spot=2
         )
-        yt_track_json = copy.deepcopy(YT_TRACK_INFO.__dict__)
-        yt_track_json['platform'] = YT_TRACK_INFO.platform.name
         with patch('src.tasks.search_and_add_to_playlists.delay') as search_mock:
             with patch('src.tasks.add_track_to_playlists', return_value=([1], [2])) as add_track_mock:
                 add_link_to_playlists(
@@ -129,7 +149,7 @@ class TestAddTrackToPlaylistsTestCase(TaskTestBase):
                 search_mock.assert_called_once_with(
                     channel=channel,
                     platform=Platform.SPOTIFY.name,
-                    origin=yt_track_json
+                    origin=YT_TRACK_INFO
                 )
 
                 self.assertEqual(add_track_mock.call_count, 0)
@@ -138,14 +158,12 @@ class TestAddTrackToPlaylistsTestCase(TaskTestBase):
     @patch('src.tasks.get_track_info_from_link', return_value=YT_TRACK_INFO)
     def test_native_playlists(self, track_info_mock):
         channel = '123'
-        link = "https://www.youtube.com/watch?v=123"
+        link = "https://www.youtube.com/watch?v=XPpTgCho5ZA"
         yt_playlists, spotify_playlists = self._make_playlists(
             channel_id=channel,
             num_yt=2,
             num_spot=2
         )
-        yt_track_json = copy.deepcopy(YT_TRACK_INFO.__dict__)
-        yt_track_json['platform'] = YT_TRACK_INFO.platform.name
         with patch('src.tasks.search_and_add_to_playlists.delay') as search_mock:
             with patch('src.tasks.add_track_to_playlists', return_value=([1], [2])) as add_track_mock:
                 add_link_to_playlists(
@@ -156,7 +174,7 @@ class TestAddTrackToPlaylistsTestCase(TaskTestBase):
                 search_mock.assert_called_once_with(
                     channel=channel,
                     platform=Platform.SPOTIFY.name,
-                    origin=yt_track_json
+                    origin=YT_TRACK_INFO
                 )
 
                 add_track_mock.assert_called_with(
@@ -171,6 +189,70 @@ class TestAddTrackToPlaylistsTestCase(TaskTestBase):
                 )
 
 
+
+class AddLinksToPlaylistsTestCase(TaskTestBase):
+    def setUp(self):
+        super(AddLinksToPlaylistsTestCase, self).setUp()
+
+        self.resolve_links_mock = patch('src.tasks.resolve_links').start()
+        self.search_cross_platform_mock = patch('src.tasks.search_cross_platform').start()
+        self.add_track_to_playlists_mock = patch(
+            'src.tasks.add_track_to_playlists',
+            return_value=([1], [2])
+        ).start()
+        self.format_results_mock = patch.object(
+            SlackMessageFormatter,
+            'format_add_tracks_results_messages',
+            return_value=[{'text': 'ok', 'blocks': [{'ok': 'ok'}]}]
+        ).start()
+
+    def tearDown(self):
+        super(AddLinksToPlaylistsTestCase, self).tearDown()
+
+        patch.stopall()
+
+    def test_no_playlists(self):
+        add_links_to_playlists(links=['https://youtu.be/abc123'], channel='123')
+
+        self.assertEqual(self.resolve_links_mock.call_count, 0)
+        self.assertEqual(self.message_formatter_mock.call_count, 0)
+
+    def test_one_message_for_all_links(self):
+        channel = '123'
+        yt_link = 'https://youtu.be/XPpTgCho5ZA'
+        # parses, but the video doesn't exist
+        bad_link = 'https://youtu.be/AAAAAAAAAAA'
+        sp_link = 'https://open.spotify.com/track/6ECp64rv50XVz93WvxXMGF'
+        yt_playlists, sp_playlists = self._make_playlists(channel_id=channel, num_yt=1, num_spot=1)
+
+        self.resolve_links_mock.return_value = [
+            (yt_link, YT_TRACK_INFO),
+            (bad_link, None),
+            (sp_link, SP_TRACK_INFO),
+        ]
+        # no youtube match for the spotify track
+        self.search_cross_platform_mock.return_value = [SP_TRACK_INFO, None]
+
+        add_links_to_playlists(links=[yt_link, bad_link, sp_link, yt_link], channel=channel)
+
+        self.resolve_links_mock.assert_called_once_with(links=[yt_link, bad_link, sp_link])
+        self.search_cross_platform_mock.assert_called_once_with(
+            track_infos=[YT_TRACK_INFO, SP_TRACK_INFO], deferred=[])
+        self.format_results_mock.assert_called_once_with(
+            results=[
+                (yt_link, YT_TRACK_INFO, [1], [2]),
+                (YT_TRACK_INFO, SP_TRACK_INFO, [1], [2]),
+                (sp_link, SP_TRACK_INFO, [1], [2]),
+            ],
+            failed_searches=[
+                (bad_link, Platform.YOUTUBE),
+                (SP_TRACK_INFO, Platform.YOUTUBE),
+            ]
+        )
+        self.message_formatter_mock.assert_called_once_with(
+            payload={'text': 'ok', 'blocks': [{'ok': 'ok'}], 'channel': channel})
+
+
 class SearchAndAddToPlaylistsTestCase(TaskTestBase):
     def setUp(self):
         super(SearchAndAddToPlaylistsTestCase, self).setUp()
@@ -197,8 +279,7 @@ class SearchAndAddToPlaylistsTestCase(TaskTestBase):
         channel = '123'
         self._make_playlists(num_yt=2, num_spot=0, channel_id='123')
 
-        yt_track_json = copy.deepcopy(YT_TRACK_INFO.__dict__)
-        yt_track_json['platform'] = YT_TRACK_INFO.platform.name
+        yt_track_json = YT_TRACK_INFO.to_wire()
 
 
         search_and_add_to_playlists(origin=yt_track_json, platform=Platform.SPOTIFY.name, channel=channel)
@@ -250,12 +331,84 @@ class SearchAndAddToPlaylistsTestCase(TaskTestBase):
         self.assertEqual(self.add_track_to_playlists_mock.call_count, 0)
         self.assertEqual(self.format_add_track_results_message_mock.call_count, 0)
 
+    @patch('src.tasks.youtube_quota')
+    def test_search_deferred_until_quota_resets(self, quota_mock):
+        channel = '123'
+        self._make_playlists(num_yt=2, num_spot=0, channel_id=channel)
+        self.fuzzy_search_from_track_info_mock.side_effect = QuotaExhaustedError('nope')
+        quota_mock.seconds_until_reset.return_value = 1000
+
+        search_and_add_to_playlists(origin=SP_TRACK_INFO, platform=Platform.YOUTUBE.name, channel=channel)
+
+        deferred = DeferredSearch.query.one()
+        self.assertEqual(json.loads(deferred.origin), SP_TRACK_INFO.to_wire())
+        self.assertEqual(deferred.platform, Platform.YOUTUBE)
+        self.assertEqual(deferred.channel_id, channel)
+        self.assertTrue(deferred.post_results)
+        self.assertGreater(deferred.run_after, datetime.datetime.utcnow() + datetime.timedelta(seconds=990))
+        self.assertEqual(self.add_track_to_playlists_mock.call_count, 0)
+        self.assertEqual(self.format_failed_search_results_message_mock.call_count, 0)
+        self.assertEqual(self.post_message_mock.call_count, 0)
+
+    def test_search_error_reported_as_no_match(self):
+        channel = '123'
+        self._make_playlists(num_yt=2, num_spot=0, channel_id=channel)
+        self.fuzzy_search_from_track_info_mock.side_effect = Exception('HTTP 503')
+        self.format_failed_search_results_message_mock.return_value = {'ok': 'ok'}
+
+        search_and_add_to_playlists(origin=SP_TRACK_INFO, platform=Platform.YOUTUBE.name, channel=channel)
+
+        self.assertEqual(self.add_track_to_playlists_mock.call_count, 0)
+        self.post_message_mock.assert_called_once_with(payload={'ok': 'ok', 'channel': channel})
+
+    def test_search_without_posting_results(self):
+        channel = '123'
+        self._make_playlists(num_yt=2, num_spot=0, channel_id=channel)
+        self.fuzzy_search_from_track_info_mock.return_value = YT_TRACK_INFO
+        self.add_track_to_playlists_mock.return_value = ([1], [])
+
+        search_and_add_to_playlists(
+            origin=SP_TRACK_INFO, platform=Platform.YOUTUBE.name, channel=channel, post_results=False)
+
+        self.assertEqual(self.add_track_to_playlists_mock.call_count, 1)
+        self.assertEqual(self.format_add_track_results_message_mock.call_count, 0)
+        self.assertEqual(self.post_message_mock.call_count, 0)
+
+    def test_search_from_track_info_dict(self):
+        # tasks queued before TrackInfo.to_wire sent a dict
+        channel = '123'
+        self._make_playlists(num_yt=0, num_spot=2, channel_id=channel)
+        self.fuzzy_search_from_track_info_mock.return_value = None
+
+        search_and_add_to_playlists(
+            origin=YT_TRACK_INFO.to_cache_dict(),
+            platform=Platform.SPOTIFY.name,
+            channel=channel
+        )
+
+        origin = self.fuzzy_search_from_track_info_mock.call_args[1]['track_info']
+        self.assertEqual(origin.to_wire(), YT_TRACK_INFO.to_wire())
+
+    @patch('src.tasks.get_track_info_from_link', return_value=YT_TRACK_INFO)
+    def test_search_from_track_info_ref(self, track_info_mock):
+        channel = '123'
+        self._make_playlists(num_yt=0, num_spot=2, channel_id=channel)
+        self.fuzzy_search_from_track_info_mock.return_value = None
+
+        search_and_add_to_playlists(
+            origin=TrackInfoRef.from_track_info(YT_TRACK_INFO),
+            platform=Platform.SPOTIFY.name,
+            channel=channel
+        )
+
+        track_info_mock.assert_called_once_with(link='https://www.youtube.com/watch?v=abc123')
+        self.fuzzy_search_from_track_info_mock.assert_called_once_with(track_info=YT_TRACK_INFO)
+
     def test_search_from_jsonified_track_info_no_match(self):
         channel = '123'
         self._make_playlists(num_yt=0, num_spot=2, channel_id=channel)
 
-        yt_track_json = copy.deepcopy(YT_TRACK_INFO.__dict__)
-        yt_track_json['platform'] = YT_TRACK_INFO.platform.name
+        yt_track_json = YT_TRACK_INFO.to_wire()
 
         self.fuzzy_search_from_track_info_mock.return_value = None
         self.format_failed_search_results_message_mock.return_value = {'ok': 'ok'}
@@ -325,3 +478,409 @@ class SearchAndAddToPlaylistsTestCase(TaskTestBase):
 
         self.assertEqual(self.fuzzy_search_from_track_info_mock.call_count, 0)
         self.assertEqual(self.format_failed_search_results_message_mock.call_count, 0)
+
+
+class BackfillTracksTestCase(TaskTestBase):
+    def setUp(self):
+        super(BackfillTracksTestCase, self).setUp()
+
+        self.add_tracks_to_playlists_mock = patch('src.tasks.add_tracks_to_playlists', return_value=[]).start()
+        patch('src.tasks.get_service_user_service').start()
+        patch('src.tasks.sanitize_titles').start()
+        self.fuzzy_search_from_track_info_mock = patch('src.tasks.fuzzy_search_from_track_info').start()
+
+    def tearDown(self):
+        super(BackfillTracksTestCase, self).tearDown()
+
+        patch.stopall()
+
+    def test_deferred_searches_dont_post(self):
+        channel = '123'
+        self._make_playlists(channel_id=channel, num_yt=1, num_spot=1)
+        self.fuzzy_search_from_track_info_mock.side_effect = QuotaExhaustedError('nope')
+
+        backfill_tracks(track_infos=[YT_TRACK_INFO, SP_TRACK_INFO], channel=channel)
+
+        deferred = DeferredSearch.query.all()
+        self.assertEqual(len(deferred), 2)
+        for search in deferred:
+            self.assertFalse(search.post_results)
+
+
+class RunDeferredSearchesTestCase(TaskTestBase):
+    def setUp(self):
+        super(RunDeferredSearchesTestCase, self).setUp()
+
+        self.delay_mock = patch.object(search_and_add_to_playlists, 'delay').start()
+        self.searches_left_mock = patch('src.tasks.searches_left', return_value=None).start()
+
+    def tearDown(self):
+        super(RunDeferredSearchesTestCase, self).tearDown()
+
+        patch.stopall()
+
+    def _defer(self, seconds_from_now, origin=SP_TRACK_INFO):
+        deferred = DeferredSearch(
+            origin=json.dumps(origin.to_wire()),
+            platform=Platform.YOUTUBE,
+            channel_id='123',
+            post_results=False,
+            run_after=datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds_from_now)
+        )
+        deferred.save()
+        return deferred.id
+
+    def test_queues_due_searches(self):
+        self._defer(-60)
+        later_id = self._defer(3600)
+
+        self.assertEqual(run_deferred_searches(), 1)
+
+        self.delay_mock.assert_called_once_with(
+            origin=SP_TRACK_INFO.to_wire(),
+            platform=Platform.YOUTUBE.name,
+            channel='123',
+            post_results=False
+        )
+        self.assertEqual([search.id for search in DeferredSearch.query.all()], [later_id])
+
+    def test_stops_at_quota(self):
+        self._defer(-120)
+        self._defer(-60, origin=YT_TRACK_INFO)
+        self.searches_left_mock.return_value = 1
+
+        self.assertEqual(run_deferred_searches(), 1)
+
+        self.assertEqual(self.delay_mock.call_args[1]['origin'], SP_TRACK_INFO.to_wire())
+        self.assertEqual(DeferredSearch.query.count(), 1)
+
+
+class ScrapeChannelHistoryTestCase(TaskTestBase):
+    def setUp(self):
+        super(ScrapeChannelHistoryTestCase, self).setUp()
+
+        self.history_mock = patch.object(SlackMessageFormatter, 'get_channel_history').start()
+        self.track_infos_mock = patch(
+            'src.tasks.get_track_infos_from_links',
+            return_value=[YT_TRACK_INFO]
+        ).start()
+        self.backfill_tracks_mock = patch('src.tasks.backfill_tracks', return_value=1).start()
+        self.delay_mock = patch('src.tasks.scrape_channel_history.delay').start()
+
+    def tearDown(self):
+        super(ScrapeChannelHistoryTestCase, self).tearDown()
+
+        patch.stopall()
+
+    def test_saves_cursor_and_schedules_next_page(self):
+        channel = '123'
+        link = 'https://www.youtube.com/watch?v=XPpTgCho5ZA'
+        self.history_mock.return_value = {
+            'ok': True,
+            'has_more': True,
+            'messages': [
+                {'ts': '2.0', 'text': '<%s>' % link},
+                {'ts': '1.0', 'text': 'no links here'},
+            ]
+        }
+
+        run_id = ChannelBackfill.claim_run(channel)
+        scrape_channel_history(channel=channel, run_id=run_id)
+
+        self.history_mock.assert_called_once_with(channel=channel, latest=None, count=200)
+        self.track_infos_mock.assert_called_once_with(links=[link])
+        self.backfill_tracks_mock.assert_called_once_with(track_infos=[YT_TRACK_INFO], channel=channel)
+        self.delay_mock.assert_called_once_with(channel=channel, run_id=run_id)
+
+        backfill = ChannelBackfill.query.filter_by(channel_id=channel).first()
+        self.assertEqual(backfill.latest_ts, '1.0')
+        self.assertEqual(backfill.messages_scanned, 2)
+        self.assertEqual(backfill.tracks_added, 1)
+        self.assertFalse(backfill.is_finished)
+
+    def test_resumes_from_cursor_and_finishes(self):
+        channel = '123'
+        backfill = ChannelBackfill(channel_id=channel)
+        backfill.latest_ts = '1.0'
+        backfill.save()
+        self.history_mock.return_value = {
+            'ok': True,
+            'has_more': False,
+            'messages': [{'ts': '0.5', 'text': 'nothing'}]
+        }
+
+        scrape_channel_history(channel=channel)
+
+        self.history_mock.assert_called_once_with(channel=channel, latest='1.0', count=200)
+        self.assertEqual(self.backfill_tracks_mock.call_count, 0)
+        self.assertEqual(self.delay_mock.call_count, 0)
+        self.message_formatter_mock.assert_called_once()
+        self.assertTrue(ChannelBackfill.query.filter_by(channel_id=channel).first().is_finished)
+
+    def test_replaced_run_stops(self):
+        channel = '123'
+        run_id = ChannelBackfill.claim_run(channel)
+        backfill = ChannelBackfill.query.filter_by(channel_id=channel).first()
+        backfill.run_id = 'newer run'
+        backfill.save()
+
+        scrape_channel_history(channel=channel, run_id=run_id)
+
+        self.assertEqual(self.history_mock.call_count, 0)
+        self.assertEqual(self.delay_mock.call_count, 0)
+
+
+class SlashCommandTasksTestCase(TaskTestBase):
+    def setUp(self):
+        super(SlashCommandTasksTestCase, self).setUp()
+
+        self.respond_patcher = patch.object(SlackMessageFormatter, 'respond')
+        self.respond_mock = self.respond_patcher.start()
+        self.service = Mock()
+        self.service.create_playlist.return_value = (True, {'id': 'new123'})
+        self.service_patcher = patch('src.tasks.ServiceFactory.from_enum', return_value=Mock(return_value=self.service))
+        self.service_patcher.start()
+        self.creds_patcher = patch.object(User, 'credentials_for_platform', return_value={'access_token': True})
+        self.creds_patcher.start()
+
+    def tearDown(self):
+        super(SlashCommandTasksTestCase, self).tearDown()
+
+        self.respond_patcher.stop()
+        self.service_patcher.stop()
+        self.creds_patcher.stop()
+
+    def create(self, slack_user_id='abc123', playlist_name='jams'):
+        return create_playlist_from_command(
+            channel_id='C123',
+            slack_user_id=slack_user_id,
+            slack_user_name='tester',
+            playlist_name=playlist_name,
+            platform=Platform.YOUTUBE.name,
+            auth_url='https://slacktunes.me/auth',
+            response_url='https://hooks.slack.com/commands/1',
+            received_at=time.time()
+        )
+
+    def delete(self, playlist_name, platform=None):
+        return delete_playlist_from_command(
+            channel_id='C123',
+            channel_name='music',
+            slack_user_id='abc123',
+            slack_user_name='tester',
+            playlist_name=playlist_name,
+            platform=platform,
+            response_url='https://hooks.slack.com/commands/1',
+            received_at=time.time()
+        )
+
+    def reply(self):
+        return self.respond_mock.call_args[1]
+
+    def test_create_playlist(self):
+        count = command_latency.get('create_playlist').count
+
+        self.create()
+
+        playlist = Playlist.query.one()
+        self.assertEqual((playlist.name, playlist.platform_id), ('jams', 'new123'))
+        self.assertEqual(self.reply(), {
+            'response_url': 'https://hooks.slack.com/commands/1',
+            'text': 'Created playlist jams for tester in this channel!',
+        })
+        self.assertEqual(command_latency.get('create_playlist').count, count + 1)
+
+    def test_create_playlist_no_auth(self):
+        self.create(slack_user_id='nobody')
+
+        self.assertEqual(self.service.create_playlist.call_count, 0)
+        self.assertIn('https://slacktunes.me/auth', self.reply()['text'])
+
+    def test_create_playlist_exists(self):
+        self.create()
+        self.create()
+
+        self.assertEqual(self.service.create_playlist.call_count, 1)
+        self.assertIn('already', self.reply()['text'])
+
+    def test_delete_playlist(self):
+        self._make_playlists(channel_id='C123', num_yt=1, num_spot=1)
+
+        self.delete(playlist_name='Youtube Playlist 0')
+        self.assertIn('More than one playlist', self.reply()['text'])
+
+        self.delete(playlist_name='Youtube Playlist 0', platform=Platform.SPOTIFY.name)
+        self.assertIn('Deleted slacktunes record', self.reply()['text'])
+        self.assertEqual([pl.platform for pl in Playlist.query.all()], [Platform.YOUTUBE])
+
+    def test_delete_playlist_not_found(self):
+        self._make_playlists(channel_id='C123', num_yt=1)
+
+        self.delete(playlist_name='nope')
+
+        self.assertIn("Couldn't find a playlist named nope", self.reply()['text'])
+        self.assertEqual(Playlist.query.count(), 1)
+
+
+class RefreshSpotifyTokensTestCase(TaskTestBase):
+    def setUp(self):
+        super(RefreshSpotifyTokensTestCase, self).setUp()
+
+        self.other_user = User(name='other', slack_id='def456')
+        self.other_user.save()
+        self.expiring_creds = Credential(
+            platform=Platform.SPOTIFY,
+            credentials=json.dumps({
+                'access_token': 'old',
+                'refresh_token': 'refresh',
+                'expires_at': int(time.time()) + 300,
+                'userdata': 'def456:other',
+            }),
+            user_id=self.other_user.id
+        )
+        self.expiring_creds.save()
+
+        self.tokens = SingleFlightRefresher(
+            namespace='test', expires_at=lambda token: token['expires_at'], use_redis=False)
+        self.tokens_patcher = patch('src.oauth_wrappers.spotify_tokens', self.tokens)
+        self.tokens_patcher.start()
+        self.new_token = {'access_token': 'new', 'expires_at': int(time.time()) + 3600}
+        self.refresh_patcher = patch(
+            'src.oauth_wrappers.SpotipyDBWrapper.refresh_access_token',
+            return_value=self.new_token
+        )
+        self.refresh_mock = self.refresh_patcher.start()
+
+    def tearDown(self):
+        super(RefreshSpotifyTokensTestCase, self).tearDown()
+
+        self.tokens_patcher.stop()
+        self.refresh_patcher.stop()
+
+    def test_refreshes_expiring_tokens(self):
+        self.assertEqual(refresh_spotify_tokens(), 1)
+
+        self.refresh_mock.assert_called_once_with('refresh')
+        credentials = Credential.query.get(self.expiring_creds.id).to_oauth2_creds()
+        self.assertEqual(credentials['access_token'], 'new')
+        self.assertEqual(credentials['refresh_token'], 'refresh')
+        # the refresh token and userdata aren't shared
+        self.assertEqual(list(self.tokens.cache.local.values()), [self.new_token])
+
+        # now good for another hour
+        self.assertEqual(refresh_spotify_tokens(), 0)
+        self.assertEqual(self.refresh_mock.call_count, 1)
+
+    def test_uses_another_workers_token(self):
+        self.tokens.cache.set(spotify_token_key({'refresh_token': 'refresh'}), self.new_token)
+        credentials = self.expiring_creds.to_oauth2_creds()
+
+        new_credentials = fresh_spotify_credentials(credentials, margin=900)
+
+        self.assertEqual(self.refresh_mock.call_count, 0)
+        self.assertEqual(new_credentials, dict(credentials, **self.new_token))
+
+    def test_adopted_token_not_counted(self):
+        self.tokens.cache.set(spotify_token_key({'refresh_token': 'refresh'}), self.new_token)
+
+        self.assertEqual(refresh_spotify_tokens(), 0)
+        self.assertEqual(self.refresh_mock.call_count, 0)
+
+
+class RefreshYoutubeTokensTestCase(TaskTestBase):
+    def setUp(self):
+        super(RefreshYoutubeTokensTestCase, self).setUp()
+
+        self.other_user = User(name='other', slack_id='def456')
+        self.other_user.save()
+        self.expiring_creds = Credential(
+            platform=Platform.YOUTUBE,
+            credentials=OAuth2Credentials(
+                access_token='old',
+                client_id='client',
+                client_secret='secret',
+                refresh_token='refresh',
+                token_expiry=datetime.datetime.utcnow() + datetime.timedelta(seconds=300),
+                token_uri='https://oauth2.googleapis.com/token',
+                user_agent='slacktunes-tests'
+            ).to_json(),
+            user_id=self.other_user.id
+        )
+        self.expiring_creds.save()
+
+        self.tokens_patcher = patch(
+            'src.tokens.youtube_tokens',
+            SingleFlightRefresher(namespace='test', expires_at=lambda token: token['expires_at'], use_redis=False)
+        )
+        self.tokens_patcher.start()
+
+        def do_refresh_request(credentials, http):
+            credentials.access_token = 'new'
+            credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+            credentials.store.locked_put(credentials)
+
+        self.refresh_patcher = patch.object(
+            OAuth2Credentials, '_do_refresh_request', autospec=True, side_effect=do_refresh_request)
+        self.refresh_mock = self.refresh_patcher.start()
+
+    def tearDown(self):
+        super(RefreshYoutubeTokensTestCase, self).tearDown()
+
+        self.tokens_patcher.stop()
+        self.refresh_patcher.stop()
+
+    def test_refreshes_expiring_tokens(self):
+        self.assertEqual(refresh_youtube_tokens(), 1)
+
+        self.assertEqual(self.refresh_mock.call_count, 1)
+        credentials = Credential.query.get(self.expiring_creds.id).to_oauth2_creds()
+        self.assertEqual(credentials.access_token, 'new')
+        self.assertEqual(credentials.refresh_token, 'refresh')
+
+        # now good for another hour
+        self.assertEqual(refresh_youtube_tokens(), 0)
+        self.assertEqual(self.refresh_mock.call_count, 1)
+
+    def test_failed_refresh(self):
+        self.refresh_mock.side_effect = Exception('invalid_grant')
+
+        self.assertEqual(refresh_youtube_tokens(), 0)
+        self.assertEqual(Credential.query.get(self.expiring_creds.id).to_oauth2_creds().access_token, 'old')
+
+
+class LogMetricsTestCase(TaskTestBase):
+    def setUp(self):
+        super(LogMetricsTestCase, self).setUp()
+
+        self.logger_mock = patch('src.tasks.logger').start()
+        patch('src.tasks.slack_client.metrics', return_value={
+            'count': 12, 'p50': 0.1, 'p99': 0.5, 'connections': 2, 'rate_limited': 1
+        }).start()
+        cache_stats = {'hits': 3, 'local_hits': 2, 'redis_hits': 1, 'misses': 1, 'hit_rate': 0.75, 'size': 2}
+        patch('src.tasks.track_info_cache.stats', return_value=cache_stats).start()
+        patch('src.tasks.playlist_index_cache.stats', return_value=cache_stats).start()
+
+    def tearDown(self):
+        super(LogMetricsTestCase, self).tearDown()
+
+        patch.stopall()
+
+    def test_logs_after_interval(self):
+        patch('src.tasks.metrics_logged_at', time.monotonic() - METRICS_LOG_INTERVAL - 1).start()
+
+        log_metrics_periodically()
+        self.assertEqual([call[0][0] for call in self.logger_mock.info.call_args_list], [
+            "Slack client: 12 requests (p50 0.10s, p99 0.50s), 2 connections, 1 rate limited",
+            "track_info cache: 75% of 4 lookups hit (2 local, 1 redis), 2 cached locally",
+            "playlist_index cache: 75% of 4 lookups hit (2 local, 1 redis), 2 cached locally",
+        ])
+
+        # and not again until another interval has passed
+        log_metrics_periodically()
+        self.assertEqual(self.logger_mock.info.call_count, 3)
+
+    def test_quiet_within_interval(self):
+        patch('src.tasks.metrics_logged_at', time.monotonic()).start()
+
+        log_metrics_periodically()
+        self.assertEqual(self.logger_mock.info.call_count, 0)
@@ -0,0 +1,230 @@
+import datetime
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import httplib2
+from oauth2client.client import OAuth2Credentials
+
+from src.constants import Platform
+from src.models import Credential, User
+from src.tokens import SingleFlightRefresher, adopt_shared_token, token_identity
+from tests.base import DatabaseTestBase
+from tests.fakes import FakeRedis
+
+
+class SingleFlightRefresherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.fake_redis = FakeRedis()
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+
+        self.sleep = Mock()
+        self.refresher = SingleFlightRefresher(
+            namespace='test',
+            expires_at=lambda token: token['expires_at'],
+            clock=lambda: self.now,
+            sleep=self.sleep
+        )
+        self.expired = {'access_token': 'old', 'expires_at': self.now + 30}
+        self.refresh = Mock(return_value={'access_token': 'new', 'expires_at': self.now + 3600})
+
+    def tearDown(self):
+        self.redis_patcher.stop()
+
+    def fresh(self):
+        return self.refresher.fresh(key='abc', token=self.expired, refresh=self.refresh, margin=60)
+
+    def test_usable_token(self):
+        token = {'access_token': 'ok', 'expires_at': self.now + 600}
+
+        self.assertIs(self.refresher.fresh(key='abc', token=token, refresh=self.refresh, margin=60), token)
+        self.assertEqual(self.refresh.call_count, 0)
+
+    def test_refresh_is_cached_for_other_workers(self):
+        self.assertEqual(self.fresh()['access_token'], 'new')
+
+        self.refresh.assert_called_once_with(self.expired)
+        self.assertIn('test:token:abc', self.fake_redis.data)
+        # the lock is released
+        self.assertNotIn('test:refresh:abc', self.fake_redis.data)
+
+        other_worker = SingleFlightRefresher(
+            namespace='test',
+            expires_at=lambda token: token['expires_at'],
+            clock=lambda: self.now
+        )
+        other_refresh = Mock()
+        token = other_worker.fresh(key='abc', token=self.expired, refresh=other_refresh, margin=60)
+
+        self.assertEqual(token['access_token'], 'new')
+        self.assertEqual(other_refresh.call_count, 0)
+
+    def test_waits_for_another_workers_refresh(self):
+        self.fake_redis.data['test:refresh:abc'] = b'other worker'
+
+        def other_worker_finishes(seconds):
+            self.fake_redis.data['test:token:abc'] = b'{"access_token":"theirs","expires_at":4600}'
+
+        self.sleep.side_effect = other_worker_finishes
+
+        self.assertEqual(self.fresh()['access_token'], 'theirs')
+        self.assertEqual(self.refresh.call_count, 0)
+
+    def test_lock_holder_never_finishes(self):
+        self.fake_redis.data['test:refresh:abc'] = b'other worker'
+
+        self.assertEqual(self.fresh()['access_token'], 'new')
+        self.assertEqual(self.refresh.call_count, 1)
+        # not ours to release
+        self.assertEqual(self.fake_redis.data['test:refresh:abc'], b'other worker')
+
+    def test_redis_down(self):
+        self.fake_redis.fail = True
+
+        self.assertEqual(self.fresh()['access_token'], 'new')
+        self.assertEqual(self.fresh()['access_token'], 'new')
+        self.assertEqual(self.refresh.call_count, 1)
+
+    def test_threads_share_one_refresh(self):
+        refresher = SingleFlightRefresher(namespace='test', expires_at=lambda token: token['expires_at'])
+        expired = {'access_token': 'old', 'expires_at': time.time() - 1}
+
+        def slow_refresh(token):
+            time.sleep(0.05)
+            return {'access_token': 'new', 'expires_at': time.time() + 3600}
+
+        tokens = []
+
+        def use_token():
+            tokens.append(refresher.fresh(key='abc', token=expired, refresh=slow_refresh, margin=60))
+
+        threads = [threading.Thread(target=use_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([t['access_token'] for t in tokens], ['new'] * 8)
+        self.assertEqual(refresher.refreshes, 1)
+
+
+def make_oauth2_creds(access_token, expires_in, refresh_token='refresh'):
+    return OAuth2Credentials(
+        access_token=access_token,
+        client_id='client',
+        client_secret='secret',
+        refresh_token=refresh_token,
+        token_expiry=datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in),
+        token_uri='https://oauth2.googleapis.com/token',
+        user_agent='slacktunes-tests'
+    )
+
+
+class OAuth2CredentialStorageTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(OAuth2CredentialStorageTestCase, self).setUp()
+
+        self.fake_redis = FakeRedis()
+        self.redis_patcher = patch('src.cache.get_redis', return_value=self.fake_redis)
+        self.redis_patcher.start()
+        self.tokens = SingleFlightRefresher(
+            namespace='test', expires_at=lambda token: token['expires_at'], sleep=Mock())
+        self.tokens_patcher = patch('src.tokens.youtube_tokens', self.tokens)
+        self.tokens_patcher.start()
+
+        self.user = User(name='tester', slack_id='abc123')
+        self.user.save()
+        self.credential = Credential(
+            platform=Platform.YOUTUBE,
+            credentials=make_oauth2_creds('old', expires_in=30).to_json(),
+            user_id=self.user.id
+        )
+        self.credential.save()
+        self.token_key = 'test:token:%s' % token_identity('refresh')
+
+    def tearDown(self):
+        super(OAuth2CredentialStorageTestCase, self).tearDown()
+
+        self.redis_patcher.stop()
+        self.tokens_patcher.stop()
+
+    def refresh_to(self, access_token):
+        def do_refresh_request(credentials, http):
+            credentials.access_token = access_token
+            credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+            credentials.store.locked_put(credentials)
+
+        return patch.object(OAuth2Credentials, '_do_refresh_request', autospec=True, side_effect=do_refresh_request)
+
+    def test_refresh_is_saved_and_shared(self):
+        credentials = self.credential.to_oauth2_creds()
+
+        with self.refresh_to('new') as refresh_mock:
+            credentials.refresh(httplib2.Http())
+
+        self.assertEqual(refresh_mock.call_count, 1)
+        self.assertEqual(credentials.access_token, 'new')
+        self.assertEqual(Credential.query.get(self.credential.id).to_oauth2_creds().access_token, 'new')
+        self.assertIn(self.token_key, self.fake_redis.data)
+        # the lock is released
+        self.assertEqual(
+            [key for key in self.fake_redis.data if key.startswith('test:refresh')], [])
+
+    def test_other_worker_uses_stored_token(self):
+        # both load the row before either refreshes
+        credentials = self.credential.to_oauth2_creds()
+        other_worker_credentials = self.credential.to_oauth2_creds()
+
+        with self.refresh_to('new') as refresh_mock:
+            credentials.refresh(httplib2.Http())
+            other_worker_credentials.refresh(httplib2.Http())
+
+        self.assertEqual(refresh_mock.call_count, 1)
+        self.assertEqual(other_worker_credentials.access_token, 'new')
+        self.assertEqual(self.tokens.refreshes, 1)
+
+    def test_waits_for_another_workers_refresh(self):
+        lock_key = 'test:refresh:%s' % token_identity('refresh')
+        self.fake_redis.data[lock_key] = b'other worker'
+
+        def other_worker_finishes(seconds):
+            self.tokens.cache.set(token_identity('refresh'), {
+                'access_token': 'theirs',
+                'expires_at': int(time.time()) + 3600
+            })
+
+        self.tokens.sleep.side_effect = other_worker_finishes
+        credentials = self.credential.to_oauth2_creds()
+
+        with self.refresh_to('new') as refresh_mock:
+            credentials.refresh(httplib2.Http())
+
+        self.assertEqual(refresh_mock.call_count, 0)
+        self.assertEqual(credentials.access_token, 'theirs')
+        self.assertEqual(self.fake_redis.data[lock_key], b'other worker')
+
+    def test_adopt_shared_token(self):
+        credentials = self.credential.to_oauth2_creds()
+        self.assertFalse(adopt_shared_token(credentials))
+
+        self.tokens.cache.set(token_identity('refresh'), {
+            'access_token': 'new',
+            'expires_at': int(time.time()) + 3600
+        })
+
+        self.assertTrue(adopt_shared_token(credentials))
+        self.assertEqual(credentials.access_token, 'new')
+        self.assertFalse(credentials.access_token_expired)
+
+        # good for a while now
+        self.assertFalse(adopt_shared_token(credentials))
+
+    def test_no_refresh_token_no_store(self):
+        self.credential.credentials = make_oauth2_creds('old', expires_in=30, refresh_token=None).to_json()
+        credentials = self.credential.to_oauth2_creds()
+
+        self.assertIsNone(credentials.store)
+        self.assertFalse(adopt_shared_token(credentials))
@@ -0,0 +1,559 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from apiclient.errors import HttpError
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from tests.base import DatabaseTestBase
+from tests.fakes import FakeRedis, FakeSpotifyClient, FakeYoutubeClient
+from tests.json_fakes import SPOTIFY_ADD_TRACK_RESPONSE, SPOTIFY_PLAYLIST_SNAPSHOT_RESP
+from src.cache import TieredCache
+from src.constants import DUPLICATE_TRACK, Platform
+from src.models import MATCH_CACHE_TTL, NO_MATCH_CACHE_TTL, Credential, Playlist, PlaylistTrack, TrackMatch, User
+from src.music_services import SpotifyService, TrackInfo, YoutubeService
+from src.quota import YOUTUBE_SEARCH_COST, YOUTUBE_SEARCH_RESERVE, QuotaAccountant, QuotaExhaustedError
+from src.service_registry import ServiceUserRegistry, SharedGeneration, service_user_registry
+from src.utils import (
+    add_track_to_playlists,
+    add_tracks_to_playlists,
+    cache_match,
+    ensure_playlist_index,
+    extract_links_from_message,
+    fuzzy_search_from_track_info,
+    get_track_info_from_link,
+    map_concurrently,
+    reconcile_playlist_index,
+    search_cross_platform
+)
+
+
+class PlaylistIndexTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(PlaylistIndexTestCase, self).setUp()
+
+        self.user = User(name='tester', slack_id='abc123')
+        self.user.save()
+
+        self.playlist = Playlist(
+            name='yt',
+            channel_id='123',
+            platform=Platform.YOUTUBE,
+            platform_id='abc123',
+            user_id=self.user.id
+        )
+        self.playlist.save()
+
+        self.fake_client = FakeYoutubeClient(expected_responses={'playlistItems_list': {'items': []}})
+        self.service = YoutubeService(credentials={'ok': True}, client=self.fake_client)
+        self.service_patcher = patch('src.utils.service_for_playlist', return_value=self.service)
+        self.service_patcher.start()
+
+        self.track_info = TrackInfo(name='nah', platform=Platform.YOUTUBE, track_id='nah')
+
+    def tearDown(self):
+        super(PlaylistIndexTestCase, self).tearDown()
+
+        self.service_patcher.stop()
+
+    def test_reconcile_playlist_index(self):
+        PlaylistTrack(playlist_id=self.playlist.id, track_id='gone').save()
+
+        reconcile_playlist_index(playlist=self.playlist, service=YoutubeService(
+            credentials={'ok': True},
+            client=FakeYoutubeClient()
+        ))
+
+        self.assertTrue(self.playlist.is_indexed())
+        # cheating because I know what's in the json fake
+        self.assertTrue(self.playlist.has_track('XPpTgCho5ZA'))
+        self.assertFalse(self.playlist.has_track('gone'))
+
+    def test_reconcile_loses_race(self):
+        # another worker indexed the playlist between our read and our commit
+        with patch('src.models.db.session.commit', side_effect=IntegrityError('INSERT', {}, Exception())):
+            self.playlist.reconcile_track_index(['XPpTgCho5ZA'])
+
+        self.assertFalse(self.playlist.is_indexed())
+        self.playlist.reconcile_track_index(['XPpTgCho5ZA'])
+        self.assertTrue(self.playlist.has_track('XPpTgCho5ZA'))
+
+    def test_failed_index_rolls_back(self):
+        def bad_reconcile(track_ids, snapshot_id=None):
+            db.session.add(PlaylistTrack(playlist_id=self.playlist.id, track_id=None))
+            db.session.flush()
+
+        with patch.object(self.playlist, 'reconcile_track_index', side_effect=bad_reconcile):
+            self.assertFalse(ensure_playlist_index(self.playlist, self.service))
+
+        # the session is usable for the next playlist
+        self.assertFalse(self.playlist.is_indexed())
+
+    def test_add_track_indexes_playlist(self):
+        successes, failures = add_track_to_playlists(
+            track_info=self.track_info,
+            playlists=[self.playlist]
+        )
+
+        self.assertEqual(successes, [(self.playlist, None)])
+        self.assertEqual(failures, [])
+        self.assertTrue(self.playlist.is_indexed())
+        self.assertTrue(self.playlist.has_track(self.track_info.track_id))
+
+    def test_add_track_duplicate_from_index(self):
+        self.playlist.reconcile_track_index({self.track_info.track_id})
+
+        successes, failures = add_track_to_playlists(
+            track_info=self.track_info,
+            playlists=[self.playlist]
+        )
+
+        self.assertEqual(successes, [])
+        self.assertEqual(failures, [(self.playlist, DUPLICATE_TRACK)])
+        self.assertEqual(self.fake_client.playlist_item_insert_calls, [])
+
+    def test_add_track_runs_users_concurrently(self):
+        other_user = User(name='other', slack_id='def456')
+        other_user.save()
+        playlists = [self.playlist]
+        for i, user in enumerate([self.user, other_user, other_user]):
+            pl = Playlist(
+                name='yt%s' % i,
+                channel_id='123',
+                platform=Platform.YOUTUBE,
+                platform_id='def%s' % i,
+                user_id=user.id
+            )
+            pl.save()
+            playlists.append(pl)
+        playlists[2].reconcile_track_index({self.track_info.track_id})
+
+        lock = threading.Lock()
+        active = {}
+        max_active = {}
+
+        def add_track_to_playlist(track_info, playlist, check_duplicates):
+            with lock:
+                active[playlist.user_id] = active.get(playlist.user_id, 0) + 1
+                max_active[playlist.user_id] = max(max_active.get(playlist.user_id, 0), active[playlist.user_id])
+            time.sleep(0.05)
+            with lock:
+                active[playlist.user_id] -= 1
+            return True, None
+
+        service = Mock()
+        service.get_playlist_snapshot_id.return_value = None
+        service.known_snapshot_id.return_value = None
+        service.get_track_ids_in_playlist.return_value = set()
+        service.add_track_to_playlist.side_effect = add_track_to_playlist
+        self.service_patcher.stop()
+        self.service_patcher = patch('src.utils.service_for_playlist', return_value=service)
+        self.service_patcher.start()
+
+        successes, failures = add_track_to_playlists(track_info=self.track_info, playlists=playlists)
+
+        self.assertEqual(successes, [(pl, None) for pl in playlists if pl is not playlists[2]])
+        self.assertEqual(failures, [(playlists[2], DUPLICATE_TRACK)])
+        self.assertEqual(max_active, {self.user.id: 1, other_user.id: 1})
+        self.assertTrue(all(pl.has_track(self.track_info.track_id) for pl in playlists))
+
+    def test_delete_playlist_removes_index(self):
+        self.playlist.reconcile_track_index({'a', 'b'})
+
+        self.playlist.delete()
+
+        self.assertEqual(PlaylistTrack.query.count(), 0)
+
+
+class PlaylistSnapshotTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(PlaylistSnapshotTestCase, self).setUp()
+
+        self.user = User(name='tester', slack_id='abc123')
+        self.user.save()
+
+        self.playlist = Playlist(
+            name='spot',
+            channel_id='123',
+            platform=Platform.SPOTIFY,
+            platform_id='abc123',
+            user_id=self.user.id
+        )
+        self.playlist.save()
+
+        self.fake_client = FakeSpotifyClient()
+        self.service = SpotifyService(credentials={'ok': True}, client=self.fake_client)
+        self.service_patcher = patch('src.utils.service_for_playlist', return_value=self.service)
+        self.service_patcher.start()
+
+        self.track_info = TrackInfo(name='nah', platform=Platform.SPOTIFY, track_id='nah')
+
+    def tearDown(self):
+        super(PlaylistSnapshotTestCase, self).tearDown()
+
+        self.service_patcher.stop()
+
+    def test_add_track_indexes_with_snapshot(self):
+        successes, failures = add_track_to_playlists(track_info=self.track_info, playlists=[self.playlist])
+
+        self.assertEqual(successes, [(self.playlist, None)])
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [self.playlist.platform_id])
+        self.assertTrue(self.playlist.has_track(self.track_info.track_id))
+        # the insert's snapshot, so the next add doesn't think someone else changed the playlist
+        self.assertEqual(self.playlist.snapshot_id, SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id'])
+
+    def test_add_track_unchanged_snapshot_uses_index(self):
+        self.playlist.reconcile_track_index({'a'}, snapshot_id=SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id'])
+
+        successes, failures = add_track_to_playlists(track_info=self.track_info, playlists=[self.playlist])
+
+        self.assertEqual(successes, [(self.playlist, None)])
+        self.assertEqual(self.fake_client.user_playlist_calls, [self.playlist.platform_id])
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [])
+        self.assertEqual(self.fake_client.add_track_calls, [self.track_info.track_id])
+        self.assertTrue(self.playlist.has_track('a'))
+        self.assertEqual(self.playlist.snapshot_id, SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id'])
+
+    def test_add_track_changed_snapshot_repages(self):
+        # the track was removed from the playlist outside slacktunes
+        self.playlist.reconcile_track_index({self.track_info.track_id}, snapshot_id='old')
+
+        successes, failures = add_track_to_playlists(track_info=self.track_info, playlists=[self.playlist])
+
+        self.assertEqual(successes, [(self.playlist, None)])
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [self.playlist.platform_id])
+        # cheating because I know what's in the json fake
+        self.assertTrue(self.playlist.has_track('6ECp64rv50XVz93WvxXMGF'))
+        self.assertTrue(self.playlist.has_track(self.track_info.track_id))
+        self.assertEqual(self.playlist.snapshot_id, SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id'])
+
+    def test_add_tracks_unchanged_snapshot_uses_index(self):
+        self.playlist.reconcile_track_index(
+            {self.track_info.track_id},
+            snapshot_id=SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id']
+        )
+        new_track = TrackInfo(name='new', platform=Platform.SPOTIFY, track_id='new')
+
+        [(pl, successes, failures)] = add_tracks_to_playlists(
+            track_infos=[self.track_info, new_track],
+            playlists=[self.playlist]
+        )
+
+        self.assertEqual(successes, [(new_track, None)])
+        self.assertEqual(failures, [(self.track_info, DUPLICATE_TRACK)])
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [])
+        self.assertTrue(self.playlist.has_track(new_track.track_id))
+        self.assertEqual(self.playlist.snapshot_id, SPOTIFY_ADD_TRACK_RESPONSE['snapshot_id'])
+
+    def test_reconcile_unchanged_snapshot(self):
+        self.playlist.reconcile_track_index({'a'}, snapshot_id=SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id'])
+        self.playlist.index_reconciled_at = datetime.datetime(2000, 1, 1)
+        self.playlist.save()
+
+        reconcile_playlist_index(playlist=self.playlist, service=self.service)
+
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [])
+        self.assertTrue(self.playlist.has_track('a'))
+        self.assertGreater(self.playlist.index_reconciled_at, datetime.datetime(2000, 1, 1))
+
+    def test_reconcile_changed_snapshot(self):
+        self.playlist.reconcile_track_index({'a'}, snapshot_id='old')
+
+        reconcile_playlist_index(playlist=self.playlist, service=self.service)
+
+        self.assertEqual(self.fake_client.user_playlist_tracks_calls, [self.playlist.platform_id])
+        self.assertFalse(self.playlist.has_track('a'))
+        self.assertEqual(self.playlist.snapshot_id, SPOTIFY_PLAYLIST_SNAPSHOT_RESP['snapshot_id'])
+
+
+
+class MatchCacheTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(MatchCacheTestCase, self).setUp()
+
+        self.yt_track = TrackInfo(name='This Love', platform=Platform.YOUTUBE, track_id='abc123')
+        self.match = TrackInfo(
+            name='This Love',
+            platform=Platform.SPOTIFY,
+            track_id='def456',
+            artists=['Maroon 5'],
+            match_score=90
+        )
+        self.service = Mock()
+
+    def test_caches_match(self):
+        self.service.fuzzy_search_from_track_info.return_value = self.match
+
+        first = fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service)
+        second = fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service)
+
+        self.assertIs(first, self.match)
+        self.assertEqual(second.to_cache_dict(), self.match.to_cache_dict())
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 1)
+
+        cached = TrackMatch.query.one()
+        self.assertEqual(cached.target_track_id, 'def456')
+        self.assertEqual(cached.score, 90)
+
+    def test_caches_no_match(self):
+        self.service.fuzzy_search_from_track_info.return_value = None
+
+        self.assertIsNone(fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service))
+        self.assertIsNone(fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service))
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 1)
+
+    def test_expired_no_match(self):
+        self.service.fuzzy_search_from_track_info.return_value = None
+        fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service)
+
+        cached = TrackMatch.query.one()
+        cached.matched_at -= NO_MATCH_CACHE_TTL + datetime.timedelta(minutes=1)
+        cached.save()
+
+        self.service.fuzzy_search_from_track_info.return_value = self.match
+        self.assertEqual(
+            fuzzy_search_from_track_info(self.yt_track, slacktunes_cross_service=self.service),
+            self.match
+        )
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 2)
+        self.assertEqual(TrackMatch.query.one().target_track_id, 'def456')
+
+
+    @patch('src.utils.searches_left', return_value=None)
+    def test_failed_search_not_cached(self, searches_left_mock):
+        def raise_server_error():
+            raise HttpError(Mock(status=503), b'{}')
+
+        sp_track = TrackInfo(name='This Love', platform=Platform.SPOTIFY, track_id='def456', artists=['Maroon 5'])
+        service = YoutubeService(
+            credentials=True, client=FakeYoutubeClient(expected_responses={'search': raise_server_error}))
+
+        with self.assertRaises(HttpError):
+            fuzzy_search_from_track_info(sp_track, slacktunes_cross_service=service)
+        self.assertEqual(TrackMatch.query.count(), 0)
+
+class SearchQuotaTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(SearchQuotaTestCase, self).setUp()
+
+        self.sp_track = TrackInfo(name='This Love', platform=Platform.SPOTIFY, track_id='def456')
+        self.match = TrackInfo(name='This Love', platform=Platform.YOUTUBE, track_id='abc123')
+        self.service = Mock()
+        self.service.fuzzy_search_from_track_info.return_value = self.match
+        self.service_patcher = patch('src.utils.get_service_user_service', return_value=self.service)
+        self.service_patcher.start()
+        self.registry_patcher = patch.object(service_user_registry, 'load')
+        self.registry_patcher.start()
+
+        self.quota = QuotaAccountant(namespace='yt', daily_budget=YOUTUBE_SEARCH_RESERVE, use_redis=False)
+        self.quota_patcher = patch('src.utils.youtube_quota', self.quota)
+        self.quota_patcher.start()
+
+    def tearDown(self):
+        super(SearchQuotaTestCase, self).tearDown()
+
+        self.service_patcher.stop()
+        self.registry_patcher.stop()
+        self.quota_patcher.stop()
+
+    def expire_match(self):
+        cached = TrackMatch.query.one()
+        cached.matched_at -= MATCH_CACHE_TTL + datetime.timedelta(minutes=1)
+        cached.save()
+
+    def test_no_quota_raises(self):
+        with self.assertRaises(QuotaExhaustedError):
+            fuzzy_search_from_track_info(self.sp_track)
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 0)
+
+    def test_no_quota_uses_expired_match(self):
+        cache_match(track_info=self.sp_track, match=self.match)
+        self.expire_match()
+
+        self.assertEqual(fuzzy_search_from_track_info(self.sp_track).track_id, self.match.track_id)
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 0)
+
+    def test_search_cross_platform_defers(self):
+        self.quota.daily_budget += YOUTUBE_SEARCH_COST
+        other_tracks = [
+            TrackInfo(name=str(i), platform=Platform.SPOTIFY, track_id=str(i))
+            for i in range(2)
+        ]
+        yt_track = TrackInfo(name='yt', platform=Platform.YOUTUBE, track_id='yt')
+        self.service.fuzzy_search_from_track_info.side_effect = lambda track_info: self.match
+
+        deferred = []
+        matches = search_cross_platform(other_tracks + [yt_track], deferred=deferred)
+
+        # room for one youtube search; spotify searches aren't rationed
+        self.assertEqual(matches, [self.match, None, self.match])
+        self.assertEqual(deferred, [other_tracks[1]])
+        self.assertEqual(self.service.fuzzy_search_from_track_info.call_count, 2)
+        # the deferred track wasn't cached as "no match"
+        self.assertEqual(TrackMatch.query.filter_by(source_track_id='1').count(), 0)
+
+    def test_search_cross_platform_quota_exceeded(self):
+        self.quota.daily_budget += YOUTUBE_SEARCH_COST
+        self.service.fuzzy_search_from_track_info.side_effect = QuotaExhaustedError('nope')
+
+        deferred = []
+        self.assertEqual(search_cross_platform([self.sp_track], deferred=deferred), [None])
+        self.assertEqual(deferred, [self.sp_track])
+        self.assertEqual(TrackMatch.query.count(), 0)
+
+class ExtractLinksFromMessageTestCase(unittest.TestCase):
+    def test_extract_links_from_message(self):
+        message = {
+            'text': 'check these <https://youtu.be/XPpTgCho5ZA> and '
+                    '<https://open.spotify.com/track/6ECp64rv50XVz93WvxXMGF|This Love> '
+                    'but not <https://example.com>',
+            'attachments': [{'from_url': 'https://youtu.be/XPpTgCho5ZA'}]
+        }
+
+        self.assertEqual(
+            extract_links_from_message(message),
+            [
+                'https://youtu.be/XPpTgCho5ZA',
+                'https://open.spotify.com/track/6ECp64rv50XVz93WvxXMGF',
+            ]
+        )
+
+
+class MapConcurrentlyTestCase(unittest.TestCase):
+    def test_map_concurrently_keeps_order(self):
+        self.assertEqual(map_concurrently(lambda a, b: a + b, [1, 2, 3], [10, 20, 30]), [11, 22, 33])
+
+    def test_map_concurrently_reuses_threads(self):
+        local = threading.local()
+
+        def thread_value(_):
+            if not hasattr(local, 'value'):
+                local.value = object()
+            return local.value
+
+        first = set(map(id, map_concurrently(thread_value, range(50))))
+        second = set(map(id, map_concurrently(thread_value, range(50))))
+
+        # a per-thread cache built in one call is still there for the next
+        self.assertTrue(first & second)
+
+    def test_map_concurrently_serial(self):
+        threads = map_concurrently(lambda _: threading.current_thread(), range(3), max_workers=1)
+
+        self.assertEqual(set(threads), {threading.current_thread()})
+
+    def test_map_concurrently_removes_pool_db_sessions(self):
+        with patch.object(db.session, 'remove') as remove_mock:
+            map_concurrently(lambda _: None, range(3))
+            self.assertEqual(remove_mock.call_count, 3)
+
+            # the task's own session is left alone
+            map_concurrently(lambda _: None, range(3), max_workers=1)
+            self.assertEqual(remove_mock.call_count, 3)
+
+
+class TrackInfoCacheTestCase(unittest.TestCase):
+    @patch('src.utils.track_info_cache', TieredCache(namespace='test', maxsize=10, ttl=60, use_redis=False))
+    def test_get_track_info_from_link_cached(self):
+        fake_client = FakeYoutubeClient()
+        service = YoutubeService(credentials={'ok': True}, client=fake_client)
+
+        with patch.object(fake_client, 'videos', wraps=fake_client.videos) as videos_mock:
+            first = get_track_info_from_link(link='https://youtu.be/XPpTgCho5ZA', service=service)
+            second = get_track_info_from_link(
+                link='https://www.youtube.com/watch?v=XPpTgCho5ZA',
+                service=service
+            )
+
+        self.assertEqual(videos_mock.call_count, 1)
+        self.assertEqual(second.track_id, first.track_id)
+        self.assertEqual(second.name, first.name)
+        self.assertEqual(second.track_image_url(), first.track_image_url())
+        self.assertEqual(second.channel_title(), first.channel_title())
+
+
+class ServiceUserRegistryTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(ServiceUserRegistryTestCase, self).setUp()
+
+        self.user = User(name='slacktunes', slack_id='abc123')
+        self.user.is_service_user = True
+        self.user.save()
+
+        self.creds = Credential(
+            platform=Platform.SPOTIFY,
+            credentials=json.dumps({'access_token': 'first'}),
+            user_id=self.user.id
+        )
+        self.creds.save()
+        service_user_registry.invalidate()
+
+    def test_reuses_service(self):
+        service = service_user_registry.get_service(Platform.SPOTIFY)
+
+        with patch('src.service_registry.User.query') as query_mock:
+            self.assertIs(service_user_registry.get_service(Platform.SPOTIFY), service)
+            self.assertEqual(query_mock.mock_calls, [])
+
+        self.assertIsInstance(service, SpotifyService)
+        self.assertEqual(service.credentials, {'access_token': 'first'})
+
+    def test_credential_save_invalidates(self):
+        service = service_user_registry.get_service(Platform.SPOTIFY)
+
+        self.creds.credentials = json.dumps({'access_token': 'second'})
+        self.creds.save()
+
+        new_service = service_user_registry.get_service(Platform.SPOTIFY)
+        self.assertIsNot(new_service, service)
+        self.assertEqual(new_service.credentials, {'access_token': 'second'})
+
+    @patch('src.cache.get_redis', return_value=FakeRedis())
+    def test_credential_save_in_another_process_invalidates(self, get_redis_mock):
+        worker_registry = ServiceUserRegistry(
+            shared_generation=SharedGeneration(namespace='test_registry', check_interval=0)
+        )
+        web_registry = ServiceUserRegistry(
+            shared_generation=SharedGeneration(namespace='test_registry', check_interval=0)
+        )
+        service = worker_registry.get_service(Platform.SPOTIFY)
+
+        # the save happens in the web process, so only its registry hears about it directly
+        Credential.query.filter_by(id=self.creds.id).update(
+            {'credentials': json.dumps({'access_token': 'second'})}
+        )
+        db.session.commit()
+        web_registry.invalidate(user_id=self.user.id)
+
+        new_service = worker_registry.get_service(Platform.SPOTIFY)
+        self.assertIsNot(new_service, service)
+        self.assertEqual(new_service.credentials, {'access_token': 'second'})
+        self.assertIs(worker_registry.get_service(Platform.SPOTIFY), new_service)
+
+    @patch('src.cache.get_redis', return_value=FakeRedis())
+    def test_shared_generation_checked_once_per_interval(self, get_redis_mock):
+        now = [0]
+        worker_registry = ServiceUserRegistry(
+            shared_generation=SharedGeneration(namespace='test_registry', check_interval=5, clock=lambda: now[0])
+        )
+        web_registry = ServiceUserRegistry(
+            shared_generation=SharedGeneration(namespace='test_registry', check_interval=5, clock=lambda: now[0])
+        )
+        service = worker_registry.get_service(Platform.SPOTIFY)
+
+        web_registry.invalidate(user_id=self.user.id)
+        self.assertIs(worker_registry.get_service(Platform.SPOTIFY), service)
+
+        now[0] = 5
+        self.assertIsNot(worker_registry.get_service(Platform.SPOTIFY), service)
+
+    @patch('src.cache.get_redis', return_value=FakeRedis(fail=True))
+    def test_redis_down_keeps_local_cache(self, get_redis_mock):
+        registry = ServiceUserRegistry(shared_generation=SharedGeneration(namespace='test_registry', check_interval=0))
+        service = registry.get_service(Platform.SPOTIFY)
+
+        self.assertIs(registry.get_service(Platform.SPOTIFY), service)
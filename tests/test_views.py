@@ -0,0 +1,154 @@
+import datetime
+import json
+import unittest
+from unittest.mock import patch
+
+from app import application
+from src.cache import TTLSet
+from src.constants import Platform
+from src.models import ChannelBackfill, Playlist
+from src import views
+from tests.base import DatabaseTestBase
+
+
+class SlackEventsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = application.test_client()
+        self.patchers = [
+            patch.object(views, 'seen_slack_events', TTLSet(namespace='e', maxsize=10, ttl=60, use_redis=False)),
+            patch.object(views, 'seen_shared_links', TTLSet(namespace='l', maxsize=10, ttl=60, use_redis=False)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _post_event(self, event_id, channel, urls):
+        return self.client.post('/slack_events/', data=json.dumps({
+            'token': views.SLACK_VERIFICATION_TOKEN,
+            'event_id': event_id,
+            'event': {
+                'type': 'link_shared',
+                'channel': channel,
+                'links': [{'url': url} for url in urls],
+            },
+        }))
+
+    @patch('src.views.add_links_to_playlists.delay')
+    def test_drops_retries_and_repeated_links(self, delay_mock):
+        urls = [
+            'https://www.youtube.com/watch?v=XPpTgCho5ZA',
+            'https://open.spotify.com/track/6ECp64rv50XVz93WvxXMGF',
+        ]
+
+        self._post_event('Ev1', 'C123', urls)
+        # slack retrying the same event
+        self._post_event('Ev1', 'C123', urls)
+        # the same track shared again as a different link
+        self._post_event('Ev2', 'C123', ['https://youtu.be/XPpTgCho5ZA'])
+        # but it's new to another channel
+        self._post_event('Ev3', 'C456', ['https://youtu.be/XPpTgCho5ZA'])
+
+        self.assertEqual(
+            [c[1] for c in delay_mock.call_args_list],
+            [
+                {'links': urls, 'channel': 'C123'},
+                {'links': ['https://youtu.be/XPpTgCho5ZA'], 'channel': 'C456'},
+            ]
+        )
+
+
+    @patch('src.views.add_links_to_playlists.delay')
+    def test_retry_accepted_when_queueing_fails(self, delay_mock):
+        urls = ['https://www.youtube.com/watch?v=XPpTgCho5ZA']
+        delay_mock.side_effect = [ConnectionError('redis is down'), None]
+
+        with patch.dict(application.config, {'PROPAGATE_EXCEPTIONS': False}):
+            self.assertEqual(self._post_event('Ev1', 'C123', urls).status_code, 500)
+
+        self._post_event('Ev1', 'C123', urls)
+        self.assertEqual(delay_mock.call_count, 2)
+        delay_mock.assert_called_with(links=urls, channel='C123')
+
+
+class SlashCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = application.test_client()
+
+    def _post_command(self, command, text):
+        return self.client.post('/%s/' % command, data={
+            'token': views.SLACK_VERIFICATION_TOKEN,
+            'channel_id': 'C123',
+            'channel_name': 'music',
+            'user_id': 'U123',
+            'user_name': 'tester',
+            'text': text,
+            'response_url': 'https://hooks.slack.com/commands/1',
+        })
+
+    @patch('src.views.create_playlist_from_command.delay')
+    def test_create_playlist_acks(self, delay_mock):
+        res = self._post_command('create_playlist', 'jams spotify')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data.decode('utf-8'), 'Creating Spotify playlist jams...')
+
+        kwargs = delay_mock.call_args[1]
+        self.assertEqual(kwargs['playlist_name'], 'jams')
+        self.assertEqual(kwargs['platform'], 'SPOTIFY')
+        self.assertEqual(kwargs['response_url'], 'https://hooks.slack.com/commands/1')
+        self.assertTrue(kwargs['auth_url'].endswith('/auth/s/spotify/u/U123:tester'))
+        self.assertEqual(views.command_ack_latency.summary()['create_playlist']['count'] > 0, True)
+
+    @patch('src.views.logger')
+    @patch('src.views.delete_playlist_from_command.delay')
+    def test_delete_playlist_acks(self, delay_mock, logger_mock):
+        res = self._post_command('delete_playlist', 'jams y')
+
+        self.assertIn('/delete_playlist acked', logger_mock.info.call_args[0][0])
+
+        self.assertEqual(res.status_code, 200)
+        kwargs = delay_mock.call_args[1]
+        self.assertEqual((kwargs['playlist_name'], kwargs['platform']), ('jams', 'YOUTUBE'))
+
+    @patch('src.views.delete_playlist_from_command.delay')
+    def test_delete_playlist_bad_platform(self, delay_mock):
+        res = self._post_command('delete_playlist', 'jams nope')
+
+        self.assertEqual(res.data.decode('utf-8'), 'Unknown platform nope')
+        self.assertEqual(delay_mock.call_count, 0)
+
+
+class ScrapeMusicTestCase(DatabaseTestBase):
+    def setUp(self):
+        super(ScrapeMusicTestCase, self).setUp()
+
+        self.client = application.test_client()
+        Playlist(name='jams', channel_id='C123', platform=Platform.YOUTUBE, platform_id='abc', user_id=1).save()
+
+    def _scrape(self):
+        return self.client.post('/scrape_music/', data={
+            'token': views.SLACK_VERIFICATION_TOKEN,
+            'channel_id': 'C123',
+            'channel_name': 'music',
+        }).data.decode('utf-8')
+
+    @patch('src.views.scrape_channel_history.delay')
+    def test_one_run_at_a_time(self, delay_mock):
+        self.assertIn('Scraping channel history', self._scrape())
+        self.assertEqual(self._scrape(), 'Already scraping the history of this channel')
+        self.assertEqual(delay_mock.call_count, 1)
+
+        run_id = delay_mock.call_args[1]['run_id']
+        self.assertEqual(ChannelBackfill.query.one().run_id, run_id)
+
+        # the run died without finishing
+        backfill = ChannelBackfill.query.one()
+        backfill.heartbeat_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        backfill.save()
+
+        self.assertIn('Scraping channel history', self._scrape())
+        self.assertEqual(delay_mock.call_count, 2)
+        self.assertNotEqual(delay_mock.call_args[1]['run_id'], run_id)